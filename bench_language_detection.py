@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк определения языка: локальный детектор против OpenAI API
+
+Сравнивает точность и задержку на небольшом корпусе из 30 языков.
+Запросы к API выполняются только при запуске с флагом --api и заданном
+OPENAI_API_KEY (каждый пример - отдельный платный запрос).
+
+Запуск:
+    python bench_language_detection.py
+    python bench_language_detection.py --api
+"""
+
+import sys
+import time
+import asyncio
+import statistics
+
+from language_detector import get_language_detector, LANGUAGE_NAMES
+
+# Пример: (код языка, текст)
+CORPUS = [
+    ('ru', 'Добрый день! Подскажите, пожалуйста, где находится ближайшая аптека?'),
+    ('ru', 'Спасибо за покупку, ждём вас снова в нашем магазине.'),
+    ('en', 'Thank you for your purchase, please keep this receipt for your records.'),
+    ('en', 'What time does the museum open on weekends?'),
+    ('de', 'Vielen Dank für Ihren Einkauf, wir freuen uns auf Ihren nächsten Besuch.'),
+    ('de', 'Die Straße ist wegen Bauarbeiten bis Freitag gesperrt.'),
+    ('fr', 'Merci pour votre achat, nous espérons vous revoir bientôt dans notre magasin.'),
+    ('fr', 'Le train pour Paris part à dix heures et quart.'),
+    ('es', 'Gracias por su compra, esperamos verle pronto en nuestra tienda.'),
+    ('es', '¿Dónde está la estación de tren más cercana?'),
+    ('it', 'Grazie per il tuo acquisto, speriamo di rivederti presto nel nostro negozio.'),
+    ('it', 'Il museo è chiuso il lunedì, però è aperto tutti gli altri giorni.'),
+    ('pt', 'Obrigado pela sua compra, esperamos vê-lo em breve na nossa loja.'),
+    ('pt', 'Não sei onde fica a estação, você pode me ajudar?'),
+    ('zh', '感谢您的购买，欢迎再次光临我们的商店。'),
+    ('zh', '请问最近的地铁站在哪里？'),
+    ('ja', 'お買い上げいただきありがとうございます。またのご来店をお待ちしております。'),
+    ('ja', '駅までの道を教えてください。'),
+    ('ko', '구매해 주셔서 감사합니다. 다음에 또 방문해 주세요.'),
+    ('ko', '가장 가까운 지하철역이 어디에 있나요?'),
+    ('ar', 'شكرا لك على الشراء، نتمنى أن نراك قريبا في متجرنا.'),
+    ('ar', 'أين تقع أقرب محطة قطار؟'),
+    ('tr', 'Alışverişiniz için teşekkür ederiz, sizi yine bekleriz.'),
+    ('tr', 'En yakın tren istasyonu nerede, bana yardım eder misiniz?'),
+    ('pl', 'Dziękujemy za zakupy, zapraszamy ponownie do naszego sklepu.'),
+    ('pl', 'Gdzie jest najbliższy przystanek autobusowy?'),
+    ('uk', 'Дякуємо за покупку, чекаємо на вас знову в нашому магазині.'),
+    ('uk', 'Де знаходиться найближча аптека? Мені потрібні ліки.'),
+    ('cs', 'Děkujeme za nákup, těšíme se na vaši příští návštěvu.'),
+    ('cs', 'Kde je nejbližší zastávka tramvaje? Nevím, kudy jít.'),
+    ('nl', 'Bedankt voor uw aankoop, we hopen u snel weer te zien in onze winkel.'),
+    ('nl', 'Waar is het dichtstbijzijnde treinstation? Ik ben de weg kwijt.'),
+    ('sv', 'Tack för ditt köp, vi hoppas att se dig snart igen i vår butik.'),
+    ('sv', 'Var ligger närmaste tågstation? Jag har gått vilse.'),
+    ('no', 'Takk for handelen, vi håper å se deg igjen snart i butikken vår.'),
+    ('no', 'Hvor er nærmeste togstasjon? Jeg har gått meg vill.'),
+    ('da', 'Tak for dit køb, vi håber at se dig snart igen i vores butik.'),
+    ('da', 'Hvor ligger den nærmeste togstation? Jeg er faret vild.'),
+    ('fi', 'Kiitos ostoksestasi, toivottavasti näemme pian uudelleen myymälässämme.'),
+    ('fi', 'Missä on lähin rautatieasema? Olen eksynyt.'),
+    ('el', 'Ευχαριστούμε για την αγορά σας, ελπίζουμε να σας ξαναδούμε σύντομα.'),
+    ('el', 'Πού είναι ο πλησιέστερος σταθμός του μετρό;'),
+    ('hu', 'Köszönjük a vásárlást, reméljük, hamarosan újra látjuk üzletünkben.'),
+    ('hu', 'Hol van a legközelebbi vasútállomás? Eltévedtem.'),
+    ('ro', 'Vă mulțumim pentru cumpărături, sperăm să vă revedem curând în magazinul nostru.'),
+    ('ro', 'Unde este cea mai apropiată stație de tren?'),
+    ('bg', 'Благодарим ви за покупката, очакваме ви отново в нашия магазин.'),
+    ('bg', 'Къде се намира най-близката аптека? Търся лекарство.'),
+    ('hr', 'Hvala vam na kupnji, nadamo se da ćemo vas uskoro ponovno vidjeti.'),
+    ('hr', 'Gdje je najbliža željeznička stanica? Izgubio sam se.'),
+    ('sk', 'Ďakujeme za nákup, tešíme sa na vašu ďalšiu návštevu.'),
+    ('sk', 'Kde je najbližšia zastávka električky? Neviem, kadiaľ ísť.'),
+    ('sl', 'Hvala za vaš nakup, upamo, da se kmalu spet vidimo v naši trgovini.'),
+    ('sl', 'Kje je najbližja železniška postaja? Izgubil sem se.'),
+    ('et', 'Täname teid ostu eest, ootame teid varsti jälle meie poodi.'),
+    ('et', 'Kus on lähim rongijaam? Ma olen ära eksinud.'),
+    ('lv', 'Paldies par pirkumu, ceram jūs drīz atkal redzēt mūsu veikalā.'),
+    ('lv', 'Kur atrodas tuvākā dzelzceļa stacija? Es esmu apmaldījies.'),
+    ('lt', 'Ačiū už pirkinį, tikimės jus greitai vėl pamatyti mūsų parduotuvėje.'),
+    ('lt', 'Kur yra artimiausia geležinkelio stotis? Aš pasiklydau.'),
+]
+
+# Названия языков, которые возвращает API, в коды
+NAME_TO_CODE = {name: code for code, name in LANGUAGE_NAMES.items()}
+
+
+def bench_local(threshold: float):
+    """Точность и задержка локального детектора"""
+    detector = get_language_detector()
+    latencies = []
+    correct = 0
+    confident = 0
+    confident_correct = 0
+    errors = []
+
+    for expected, text in CORPUS:
+        start = time.perf_counter()
+        result = detector.detect(text)
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+        code = result['language_code'] if result else None
+        confidence = result['confidence'] if result else 0
+        if code == expected:
+            correct += 1
+        else:
+            errors.append((expected, code, confidence, text))
+        if confidence >= threshold:
+            confident += 1
+            if code == expected:
+                confident_correct += 1
+
+    total = len(CORPUS)
+    print("=== Локальный детектор ===")
+    print(f"Точность: {correct}/{total} ({correct / total:.1%})")
+    print(f"Выше порога {threshold}: {confident}/{total} ({confident / total:.1%}), "
+          f"из них верно {confident_correct}/{confident}")
+    print(f"Задержка: медиана {statistics.median(latencies):.1f} мкс, "
+          f"максимум {max(latencies):.1f} мкс")
+    for expected, code, confidence, text in errors:
+        print(f"  ошибка: ожидался {expected}, получен {code} ({confidence}): {text[:50]}")
+
+
+async def bench_api():
+    """Точность и задержка определения языка через OpenAI"""
+    from openai_handler import get_openai_handler
+
+    handler = get_openai_handler()
+    # Только API путь, без локального детектора
+    handler.language_detection_threshold = float('inf')
+
+    latencies = []
+    correct = 0
+    for expected, text in CORPUS:
+        start = time.perf_counter()
+        name = await handler.detect_language(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if name and NAME_TO_CODE.get(name.strip(' ."')) == expected:
+            correct += 1
+
+    total = len(CORPUS)
+    print("=== OpenAI API ===")
+    print(f"Точность: {correct}/{total} ({correct / total:.1%})")
+    print(f"Задержка: медиана {statistics.median(latencies):.0f} мс, "
+          f"максимум {max(latencies):.0f} мс")
+
+
+if __name__ == '__main__':
+    import os
+    threshold = float(os.getenv('LANGUAGE_DETECTION_THRESHOLD', '0.5'))
+    bench_local(threshold)
+    if '--api' in sys.argv:
+        asyncio.run(bench_api())
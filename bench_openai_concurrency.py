@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест OpenAIHandler: N одновременных чатов
+
+Каждый "чат" вызывает translate_text. По умолчанию вместо OpenAI используется
+имитация клиента с фиксированной задержкой ответа, чтобы сравнить:
+- блокирующий клиент (синхронный вызов внутри async метода)
+- асинхронный клиент, который используется сейчас
+
+При асинхронном клиенте N чатов должны завершаться примерно за время одного
+запроса (пока N не превышает OPENAI_MAX_CONCURRENCY).
+
+Запуск:
+    python bench_openai_concurrency.py [число чатов] [задержка в секундах]
+    python bench_openai_concurrency.py 5 --api   # реальные запросы к OpenAI
+"""
+
+import os
+import sys
+import time
+import asyncio
+from types import SimpleNamespace
+
+os.environ.setdefault('OPENAI_API_KEY', 'bench')
+
+from openai_handler import OpenAIHandler
+
+
+def _completion(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class SimulatedClient:
+    """Имитация openai клиента с задержкой ответа"""
+
+    def __init__(self, latency: float, blocking: bool):
+        self.latency = latency
+        self.blocking = blocking
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        if self.blocking:
+            # Так вел себя синхронный клиент: event loop стоит на время запроса
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        return _completion('перевод')
+
+
+async def run_chats(handler: OpenAIHandler, chats: int) -> float:
+    """Время выполнения N одновременных переводов"""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        handler.translate_text(f"Hello from chat {i}", 'Русский') for i in range(chats)
+    ))
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for result in results if result is None)
+    if failed:
+        print(f"  неудачных переводов: {failed}")
+    return elapsed
+
+
+async def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    chats = int(args[0]) if args else 10
+    latency = float(args[1]) if len(args) > 1 else 0.5
+
+    handler = OpenAIHandler()
+    print(f"Чатов: {chats}, OPENAI_MAX_CONCURRENCY={handler.max_concurrency}")
+
+    if '--api' in sys.argv:
+        single = await run_chats(handler, 1)
+        concurrent = await run_chats(handler, chats)
+        print(f"OpenAI API: один чат {single:.2f} с, {chats} чатов {concurrent:.2f} с "
+              f"({concurrent / single:.1f}x)")
+        return
+
+    print(f"Имитация задержки ответа: {latency} с")
+    for title, blocking in (('Блокирующий клиент', True), ('Асинхронный клиент', False)):
+        handler.client = SimulatedClient(latency, blocking)
+        elapsed = await run_chats(handler, chats)
+        print(f"{title}: {elapsed:.2f} с ({elapsed / latency:.1f}x от одного запроса)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк предобработки изображений для OCR
+
+Сравнивает прежнюю цепочку PIL (RGB -> контраст -> резкость -> серый ->
+медиана -> LANCZOS) с профилями ImagePreprocessor. Для каждого шага
+выводится время и пиковый объем памяти: выделения NumPy по tracemalloc
+и размер промежуточного изображения (буферы PIL tracemalloc не видит).
+
+Запуск:
+    python bench_preprocessing.py [путь к изображению] [повторов]
+Без пути используется синтетическое фото чека 3000x4000.
+"""
+
+import sys
+import time
+import statistics
+import tracemalloc
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+from image_preprocessing import ImagePreprocessor, PROFILES, NUMPY_AVAILABLE
+
+
+def synthetic_receipt(width: int = 3000, height: int = 4000) -> Image.Image:
+    """Цветное фото с текстовыми строками"""
+    image = Image.new('RGB', (width, height), (235, 228, 215))
+    draw = ImageDraw.Draw(image)
+    for row, y in enumerate(range(80, height - 80, 60)):
+        draw.text((120, y), f"ITEM {row:03d}  Milk 2.5%  x{row % 7 + 1}   {row * 37 % 1000}.{row % 100:02d}",
+                  fill=(40, 40, 60))
+    return image
+
+
+def legacy_steps():
+    """Прежняя цепочка OCRHandler.preprocess_image"""
+    def to_rgb(image):
+        return image.convert('RGB') if image.mode != 'RGB' else image
+
+    def resize(image):
+        width, height = image.size
+        if width < 1000 or height < 1000:
+            scale_factor = max(1000 / width, 1000 / height)
+            image = image.resize((int(width * scale_factor), int(height * scale_factor)),
+                                 Image.Resampling.LANCZOS)
+        return image
+
+    return [
+        ('rgb', to_rgb),
+        ('contrast', lambda image: ImageEnhance.Contrast(image).enhance(1.5)),
+        ('sharpness', lambda image: ImageEnhance.Sharpness(image).enhance(2.0)),
+        ('grayscale', lambda image: image.convert('L')),
+        ('median', lambda image: image.filter(ImageFilter.MedianFilter())),
+        ('resize', resize),
+    ]
+
+
+def image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def bench_pipeline(title: str, steps, source: Image.Image, repeats: int):
+    timings = {name: [] for name, _ in steps}
+    peaks = {name: 0 for name, _ in steps}
+    sizes = {}
+
+    for _ in range(repeats):
+        image = source
+        for name, step in steps:
+            tracemalloc.start()
+            start = time.perf_counter()
+            image = step(image)
+            timings[name].append((time.perf_counter() - start) * 1000)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peaks[name] = max(peaks[name], peak)
+            sizes[name] = image_bytes(image)
+
+    total = sum(statistics.median(values) for values in timings.values())
+    print(f"=== {title}: {total:.0f} мс ===")
+    for name, _ in steps:
+        print(f"  {name:<20} {statistics.median(timings[name]):8.1f} мс"
+              f"  numpy пик {peaks[name] / 2**20:7.1f} MB"
+              f"  изображение {sizes[name] / 2**20:6.1f} MB")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    source = Image.open(args[0]) if args else synthetic_receipt()
+    source.load()
+    repeats = int(args[1]) if len(args) > 1 else 3
+
+    print(f"Изображение {source.size} {source.mode}, NumPy: {'да' if NUMPY_AVAILABLE else 'нет'}")
+    bench_pipeline('прежняя цепочка', legacy_steps(), source, repeats)
+    for profile in PROFILES:
+        bench_pipeline(f"профиль {profile}", ImagePreprocessor(profile).steps(), source, repeats)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк масштабирования перед OCR: время распознавания против точности
+
+Сравнивает прежнее правило (увеличение до 1000 px по меньшей стороне) с
+масштабированием по оценке высоты строки на синтетическом корпусе:
+длинные узкие чеки, крупные фото и мелкие скриншоты с известным текстом.
+Точность - посимвольное сходство распознанного текста с эталоном.
+
+Если Tesseract не установлен, выводятся только оценка высоты строки,
+размер после предобработки и время предобработки.
+
+Запуск:
+    python bench_resampling.py
+"""
+
+import time
+import difflib
+import statistics
+
+from PIL import Image, ImageDraw, ImageFont
+
+from image_preprocessing import ImagePreprocessor, estimate_text_height
+
+try:
+    import pytesseract
+    pytesseract.get_tesseract_version()
+    TESSERACT_AVAILABLE = True
+except Exception:
+    TESSERACT_AVAILABLE = False
+
+LINES = [
+    'Молоко 2.5% 1 л          89.90',
+    'Хлеб Бородинский         54.00',
+    'Сыр Российский 0.3 кг   239.70',
+    'Bananas 1.2 kg           95.88',
+    'Coffee beans 250 g      449.00',
+    'ИТОГО                   928.48',
+]
+
+# (название, ширина, высота, размер шрифта)
+CORPUS = [
+    ('узкий чек, мелкий шрифт', 420, 3000, 14),
+    ('узкий чек, крупный шрифт', 700, 5000, 36),
+    ('фото 12 Мп, крупный текст', 3000, 4000, 90),
+    ('фото 12 Мп, средний текст', 3000, 4000, 40),
+    ('скриншот, мелкий текст', 900, 600, 11),
+    ('документ A4 300 dpi', 2480, 3508, 42),
+]
+
+
+def render(width: int, height: int, font_size: int):
+    """Изображение с повторяющимися строками и эталонный текст"""
+    image = Image.new('RGB', (width, height), (238, 232, 220))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=font_size)
+    lines = []
+    y = font_size
+    index = 0
+    while y < height - 2 * font_size:
+        line = LINES[index % len(LINES)]
+        draw.text((font_size, y), line, font=font, fill=(30, 30, 45))
+        lines.append(line)
+        y += int(font_size * 1.6)
+        index += 1
+    return image, '\n'.join(lines)
+
+
+def accuracy(text: str, expected: str) -> float:
+    normalize = lambda value: ' '.join(value.split())
+    return difflib.SequenceMatcher(None, normalize(text), normalize(expected)).ratio()
+
+
+def run(preprocessor: ImagePreprocessor, image: Image.Image, expected: str):
+    start = time.perf_counter()
+    processed = preprocessor.process(image)
+    preprocess_time = time.perf_counter() - start
+
+    ocr_time, score = None, None
+    if TESSERACT_AVAILABLE:
+        start = time.perf_counter()
+        text = pytesseract.image_to_string(processed, lang='rus+eng', config='--oem 3 --psm 6')
+        ocr_time = time.perf_counter() - start
+        score = accuracy(text, expected)
+    return processed.size, preprocess_time, ocr_time, score
+
+
+if __name__ == '__main__':
+    legacy = ImagePreprocessor('balanced')
+    legacy.adaptive_resize = False
+    adaptive = ImagePreprocessor('balanced')
+
+    print(f"Tesseract: {'да' if TESSERACT_AVAILABLE else 'нет (только предобработка)'}")
+    print(f"Целевая высота строки: {adaptive.text_height:.0f} px\n")
+
+    totals = {'прежнее': [], 'адаптивное': []}
+    for title, width, height, font_size in CORPUS:
+        image, expected = render(width, height, font_size)
+        estimated = estimate_text_height(image.convert('L'))
+        print(f"{title} ({width}x{height}, шрифт {font_size}, оценка строки {estimated})")
+        for name, preprocessor in (('прежнее', legacy), ('адаптивное', adaptive)):
+            size, preprocess_time, ocr_time, score = run(preprocessor, image, expected)
+            totals[name].append((preprocess_time, ocr_time, score))
+            line = f"  {name:<11} {size[0]}x{size[1]:<6} предобработка {preprocess_time * 1000:6.0f} мс"
+            if ocr_time is not None:
+                line += f"  OCR {ocr_time * 1000:6.0f} мс  точность {score:.1%}"
+            print(line)
+
+    print("\nИтого:")
+    for name, rows in totals.items():
+        line = f"  {name:<11} предобработка {sum(row[0] for row in rows) * 1000:6.0f} мс"
+        if TESSERACT_AVAILABLE:
+            line += (f"  OCR {sum(row[1] for row in rows) * 1000:6.0f} мс"
+                     f"  средняя точность {statistics.mean(row[2] for row in rows):.1%}")
+        print(line)
@@ -9,10 +9,8 @@
 import os
 import json
 import logging
-import urllib.request
 import urllib.parse
-import urllib.error
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
 import threading
 import time
 import sys
@@ -29,6 +27,19 @@ except ImportError as e:
     KEEP_ALIVE_AVAILABLE = False
     print(f"⚠️ Keep-alive сервис недоступен: {e}")
 
+from dispatcher import UpdateDispatcher, REJECTED
+from http_pool import get_pool, get_pool_stats
+from cache import TTLCache, make_key
+from telegram_files import TelegramFileResolver, to_data_url
+from vision_budget import VisionBudget, select_photo_size, TILE_SIZE
+from media_group import MediaGroupAggregator
+from conversation_memory import ConversationMemory
+from send_scheduler import SendScheduler
+from openai_limiter import OpenAIRequestExecutor
+from singleflight import SingleFlight
+from model_router import get_model_router
+from concurrent.futures import ThreadPoolExecutor
+
 # OpenAI API через HTTP запросы (без внешних зависимостей)
 OPENAI_AVAILABLE = True  # Всегда доступен через HTTP
 print("✅ OpenAI API клиент готов (HTTP режим без внешних зависимостей)")
@@ -46,56 +57,174 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 PORT = int(os.getenv('PORT', 10000))
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', f'https://umbb-gpt-bot.onrender.com')
 
+# Настройки HTTP сервера
+HTTP_SERVER_MODE = os.getenv('HTTP_SERVER_MODE', 'threading')  # threading | single
+HTTP_MAX_THREADS = int(os.getenv('HTTP_MAX_THREADS', 16))
+HTTP_MAX_BODY_SIZE = int(os.getenv('HTTP_MAX_BODY_SIZE', 1048576))  # 1MB
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+HTTP_KEEP_ALIVE = os.getenv('HTTP_KEEP_ALIVE', 'true').lower() == 'true'
+# Одновременных соединений Telegram с webhook (по умолчанию Telegram открывает до 40).
+# Каждое keep-alive соединение занимает поток, поэтому их меньше числа потоков:
+# остальные потоки остаются для проверок / и /diagnostics
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 0)) or (
+    max(1, HTTP_MAX_THREADS - 2) if HTTP_SERVER_MODE == 'threading' else 1)
+
+# Настройки потоковой генерации ответов
+OPENAI_STREAMING = os.getenv('OPENAI_STREAMING', 'true').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))  # секунд между правками
+STREAM_FIRST_CHUNK_CHARS = int(os.getenv('STREAM_FIRST_CHUNK_CHARS', 20))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Ограничение частоты отправки сообщений в Telegram
+TELEGRAM_RATE_LIMIT_ENABLED = os.getenv('TELEGRAM_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+# Настройки кэша ответов (те же переменные, что и в config.Config). bot.py работает
+# только на стандартной библиотеке, а config.py импортирует loguru и dotenv, поэтому
+# переменные читаются здесь повторно; значения по умолчанию должны совпадать
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'false').lower() == 'true'
+CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', 3600))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 5242880))  # 5MB
+
+# Кэш анализа фото по file_unique_id: пересланное фото не анализируется повторно
+VISION_CACHE_ENABLED = os.getenv('VISION_CACHE_ENABLED', 'true').lower() == 'true'
+VISION_CACHE_TTL_SECONDS = int(os.getenv('VISION_CACHE_TTL_SECONDS', 86400))
+VISION_CACHE_MAX_BYTES = int(os.getenv('VISION_CACHE_MAX_BYTES', 2097152))  # 2MB
+
+# История диалогов для текстовых ответов
+CONVERSATION_MEMORY_ENABLED = os.getenv('CONVERSATION_MEMORY_ENABLED', 'true').lower() == 'true'
+# url - OpenAI скачивает фото по ссылке Telegram, data - бот скачивает фото сам
+# и отправляет уменьшенную копию в base64 (токен бота не передается в OpenAI)
+VISION_IMAGE_MODE = os.getenv('VISION_IMAGE_MODE', 'url')
+
+# Альбомы: combined - все фото одним запросом, parallel - по запросу на фото
+VISION_ALBUM_MODE = os.getenv('VISION_ALBUM_MODE', 'combined')
+VISION_ALBUM_CONCURRENCY = int(os.getenv('VISION_ALBUM_CONCURRENCY', 3))
+
+# Переводим текст с изображения на английский язык
+PHOTO_TRANSLATION_PROMPT = "Переведи весь текст с этого изображения на английский язык. Предоставь только переведенный текст без дополнительных комментариев. Если на изображении нет текста, напиши 'No text found in the image'."
+ALBUM_TRANSLATION_PROMPT = "Это альбом из {count} изображений. Для каждого изображения по порядку переведи весь текст на английский язык и начни ответ по нему со строки 'Изображение N:'. Предоставь только переведенный текст без дополнительных комментариев. Если на изображении нет текста, напиши 'No text found in the image'."
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Разбиение длинного текста на сообщения Telegram, по возможности по строкам"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text:
+        parts.append(text)
+    return parts
+
+def normalize_prompt(text):
+    """Нормализация сообщения для ключа кэша: регистр, пробелы и концевая пунктуация"""
+    return ' '.join(text.casefold().split()).strip(' .,!?…')
+
+def update_chat_id(update):
+    """chat_id обновления Telegram (сообщение, альбом, callback) или None"""
+    message = (update.get('message') or update.get('edited_message')
+               or (update.get('media_group') or [None])[0]
+               or (update.get('callback_query') or {}).get('message'))
+    if not message:
+        return None
+    return message.get('chat', {}).get('id')
+
 class TelegramAPI:
     """Простой клиент для Telegram Bot API"""
     
-    def __init__(self, token):
+    def __init__(self, token, pool=None, scheduler=None):
         self.token = token
         self.base_url = f'https://api.telegram.org/bot{token}'
+        self.pool = pool or get_pool('api.telegram.org')
+        # Планировщик отправок с лимитами Telegram, None если отключен
+        self.scheduler = scheduler
     
-    def send_message(self, chat_id, text, parse_mode='HTML'):
-        """Отправка сообщения"""
+    def call(self, method, data, timeout=10):
+        """Вызов метода Bot API через общий пул соединений"""
+        data_encoded = urllib.parse.urlencode(data).encode('utf-8')
+        response = self.pool.request(
+            'POST', f'/bot{self.token}/{method}', body=data_encoded,
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+            timeout=timeout
+        )
+        result = response.json()
+        if not result.get('ok'):
+            result.setdefault('error', f"{response.status}: {result.get('description', 'Unknown error')}")
+        return result
+    
+    def call_for_chat(self, chat_id, method, data, wait=True):
+        """
+        Вызов метода, отправляющего сообщение в чат, с учетом лимитов частоты
+        
+        При wait=False вызов не ждет лимита, а пропускается: {'ok': False, 'skipped': True}
+        """
+        if self.scheduler is None:
+            return self.call(method, data)
+        if not wait:
+            result = self.scheduler.try_submit(chat_id, lambda: self.call(method, data))
+            return result if result is not None else {'ok': False, 'skipped': True}
+        return self.scheduler.submit(chat_id, lambda: self.call(method, data))
+    
+    def send_message(self, chat_id, text, parse_mode='HTML', wait=True):
+        """Отправка сообщения (wait=False - пропуск при исчерпанном лимите)"""
         if self.token == 'dummy_token':
             logger.warning(f"🤖 Dummy mode: would send to {chat_id}: {text[:50]}...")
             return {'ok': True, 'result': {'message_id': 1}}
         
-        url = f'{self.base_url}/sendMessage'
         data = {
             'chat_id': chat_id,
-            'text': text,
-            'parse_mode': parse_mode
+            'text': text
         }
+        if parse_mode:
+            data['parse_mode'] = parse_mode
         
         try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            req.add_header('Content-Type', 'application/x-www-form-urlencoded')
-            
-            with urllib.request.urlopen(req, timeout=10) as response:
-                result = json.loads(response.read().decode('utf-8'))
+            result = self.call_for_chat(chat_id, 'sendMessage', data, wait=wait)
+            if result.get('ok'):
                 logger.info(f"✅ Сообщение отправлено в чат {chat_id}")
-                return result
+            elif not result.get('skipped'):
+                logger.error(f"❌ Ошибка отправки сообщения: {result['error']}")
+            return result
         except Exception as e:
             logger.error(f"❌ Ошибка отправки сообщения: {e}")
             return {'ok': False, 'error': str(e)}
     
-    def set_webhook(self, webhook_url):
-        """Установка webhook"""
+    def edit_message_text(self, chat_id, message_id, text, parse_mode=None, wait=True):
+        """Изменение текста ранее отправленного сообщения (wait=False - пропуск при исчерпанном лимите)"""
+        if self.token == 'dummy_token':
+            logger.warning(f"🤖 Dummy mode: would edit {chat_id}/{message_id}: {text[:50]}...")
+            return {'ok': True, 'result': {'message_id': message_id}}
+        
+        data = {
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'text': text
+        }
+        if parse_mode:
+            data['parse_mode'] = parse_mode
+        
+        try:
+            result = self.call_for_chat(chat_id, 'editMessageText', data, wait=wait)
+            if not result.get('ok') and not result.get('skipped'):
+                logger.error(f"❌ Ошибка изменения сообщения: {result['error']}")
+            return result
+        except Exception as e:
+            logger.error(f"❌ Ошибка изменения сообщения: {e}")
+            return {'ok': False, 'error': str(e)}
+    
+    def set_webhook(self, webhook_url, max_connections=None):
+        """Установка webhook (max_connections - предел одновременных соединений Telegram, 1-100)"""
         if self.token == 'dummy_token':
             logger.warning(f"🤖 Dummy mode: would set webhook to {webhook_url}")
             return {'ok': True}
         
-        url = f'{self.base_url}/setWebhook'
         data = {'url': webhook_url}
+        if max_connections:
+            data['max_connections'] = min(100, max(1, max_connections))
         
         try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            req.add_header('Content-Type', 'application/x-www-form-urlencoded')
-            
-            with urllib.request.urlopen(req, timeout=10) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                return result
+            return self.call('setWebhook', data)
         except Exception as e:
             logger.error(f"❌ Ошибка установки webhook: {e}")
             return {'ok': False, 'error': str(e)}
@@ -103,35 +232,59 @@ class TelegramAPI:
 class OpenAIAPI:
     """HTTP клиент для OpenAI API без внешних зависимостей"""
     
-    def __init__(self, api_key):
+    def __init__(self, api_key, pool=None, response_cache=None, vision_cache=None, conversations=None,
+                 executor=None, router=None):
         self.api_key = api_key
         self.base_url = "https://api.openai.com/v1"
+        self.base_path = "/v1"
+        self.pool = pool or get_pool('api.openai.com')
+        # Повторы при 429/5xx и адаптивный лимит одновременных запросов
+        self.executor = executor or OpenAIRequestExecutor(max_connections=self.pool.max_connections)
+        # Одинаковые одновременные запросы из разных чатов выполняются один раз
+        self.inflight = SingleFlight()
+        # Выбор модели, max_tokens и таймаута по задаче и размеру входа
+        self.router = router or get_model_router()
+        # Кэш текстовых ответов, None если кэширование отключено
+        self.response_cache = response_cache
+        # Кэш анализа изображений по file_unique_id, None если отключен
+        self.vision_cache = vision_cache
+        # История диалогов по чатам, None если отключена
+        self.conversations = conversations
     
     def is_available(self):
         """Проверка доступности OpenAI API"""
         return bool(self.api_key)
     
-    def generate_text_response(self, user_message):
+    def generate_text_response(self, user_message, chat_id=None):
         """Генерация ответа через OpenAI API с HTTP запросами"""
         if not self.is_available():
             return self._get_fallback_response(user_message)
         
+        history = self.get_history(chat_id)
+        # Ответ из кэша подходит только для вопроса без предыдущего контекста
+        cached = self.get_cached_response(user_message) if not history else None
+        if cached is not None:
+            self.remember(chat_id, user_message, cached)
+            return cached
+        
         try:
             # Подготовка данных для запроса
-            data = {
-                "model": "gpt-3.5-turbo",
-                "messages": [
-                    {"role": "system", "content": "Ты полезный ассистент UMBB GPT Bot. Отвечай на русском языке, будь дружелюбным и информативным."},
-                    {"role": "user", "content": user_message}
-                ],
-                "max_tokens": 1000,
-                "temperature": 0.7
-            }
+            route = self._chat_route(user_message)
+            data = self._build_chat_request(user_message, history, route)
             
-            # HTTP запрос к OpenAI API
-            response = self._make_openai_request("/chat/completions", data)
+            # HTTP запрос к OpenAI API (общий для одинаковых одновременных вопросов)
+            response, shared = self.inflight.do(
+                self.request_key('text', user_message, history),
+                lambda: self._make_openai_request("/chat/completions", data, route)
+            )
+            if shared:
+                logger.info("🔗 Ответ получен от такого же выполняющегося запроса")
             if response and "choices" in response and len(response["choices"]) > 0:
-                return response["choices"][0]["message"]["content"]
+                content = response["choices"][0]["message"]["content"]
+                if not history:
+                    self.cache_response(user_message, content)
+                self.remember(chat_id, user_message, content)
+                return content
             else:
                 logger.error("❌ Некорректный ответ от OpenAI API")
                 return self._get_fallback_response(user_message)
@@ -140,31 +293,109 @@ class OpenAIAPI:
             logger.error(f"❌ Ошибка OpenAI API: {e}")
             return self._get_fallback_response(user_message)
     
-    def analyze_image(self, image_url, user_message="Опиши это изображение"):
-        """Анализ изображения через OpenAI Vision API с HTTP запросами"""
+    def stream_text_response(self, user_message, history=None):
+        """
+        Потоковая генерация ответа через OpenAI API
+        
+        Разбирает server-sent events по мере поступления и возвращает
+        фрагменты текста. Если запрос не удался, ничего не возвращает.
+        """
+        route = self._chat_route(user_message)
+        data = self._build_chat_request(user_message, history, route)
+        data["stream"] = True
+        # Последний фрагмент потока содержит число токенов
+        data["stream_options"] = {"include_usage": True}
+        
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
+        }
+        json_data = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        
+        # Потоковый запрос не повторяется (при ошибке ответ генерируется обычным запросом),
+        # но учитывается в лимите одновременных запросов
+        slot = self.executor.acquire()
+        status, response_headers, usage = None, None, {}
+        started_at = time.monotonic()
+        try:
+            with self.pool.stream('POST', f"{self.base_path}/chat/completions", body=json_data, headers=headers,
+                                  timeout=route['timeout']) as response:
+                status, response_headers = response.status, response.headers
+                if response.status != 200:
+                    logger.error(f"❌ HTTP ошибка OpenAI API (stream): {response.status} - {response.read().decode('utf-8')}")
+                    return
+                
+                for raw_line in response:
+                    line = raw_line.decode('utf-8').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    
+                    payload = line[5:].strip()
+                    if payload == '[DONE]':
+                        # Дочитываем ответ, чтобы соединение вернулось в пул
+                        response.read()
+                        break
+                    
+                    chunk = json.loads(payload)
+                    usage = chunk.get('usage') or usage
+                    choices = chunk.get('choices') or []
+                    if choices:
+                        delta = choices[0].get('delta', {}).get('content')
+                        if delta:
+                            yield delta
+        finally:
+            self.executor.release(slot, status, response_headers)
+            self.router.record(route, time.monotonic() - started_at, usage.get('prompt_tokens', 0),
+                               usage.get('completion_tokens', 0), success=status == 200)
+    
+    def analyze_image(self, image_url, user_message="Опиши это изображение", cache_id=None, detail=None):
+        """
+        Анализ изображения через OpenAI Vision API с HTTP запросами
+        
+        cache_id - file_unique_id фото Telegram, под которым сохраняется успешный ответ
+        detail - low | high, по умолчанию выбирает OpenAI
+        """
+        return self.analyze_images([(image_url, detail)], user_message, cache_id=cache_id)
+    
+    def analyze_images(self, images, user_message, cache_id=None):
+        """
+        Анализ одного или нескольких изображений одним запросом
+        
+        images - список (image_url, detail)
+        """
         if not self.is_available():
             return "🔍 Анализ изображений недоступен. Проверьте настройки OpenAI API."
         
         try:
             # Подготовка данных для запроса к Vision API
+            intro = "Проанализируй это изображение" if len(images) == 1 else "Проанализируй эти изображения"
+            content = [{"type": "text", "text": f"{intro} и ответь на русском языке: {user_message}"}]
+            for image_url, detail in images:
+                image = {"url": image_url}
+                if detail:
+                    image["detail"] = detail
+                content.append({"type": "image_url", "image_url": image})
+            
+            route = self.router.route('vision', user_message)
             data = {
-                "model": "gpt-4o",
+                "model": route['model'],
                 "messages": [
                     {
                         "role": "user",
-                        "content": [
-                            {"type": "text", "text": f"Проанализируй это изображение и ответь на русском языке: {user_message}"},
-                            {"type": "image_url", "image_url": {"url": image_url}}
-                        ]
+                        "content": content
                     }
                 ],
-                "max_tokens": 1000
+                "max_tokens": min(4000, route['max_tokens'] * len(images))
             }
             
             # HTTP запрос к OpenAI Vision API
-            response = self._make_openai_request("/chat/completions", data)
+            response = self._make_openai_request("/chat/completions", data, route)
             if response and "choices" in response and len(response["choices"]) > 0:
-                return response["choices"][0]["message"]["content"]
+                content = response["choices"][0]["message"]["content"]
+                if cache_id:
+                    self.cache_analysis(cache_id, user_message, content)
+                return content
             else:
                 logger.error("❌ Некорректный ответ от OpenAI Vision API")
                 return "❌ Не удалось проанализировать изображение."
@@ -173,10 +404,114 @@ class OpenAIAPI:
             logger.error(f"❌ Ошибка анализа изображения: {e}")
             return f"❌ Не удалось проанализировать изображение: {str(e)}"
     
-    def _make_openai_request(self, endpoint, data):
-        """Выполнение HTTP запроса к OpenAI API"""
-        url = f"{self.base_url}{endpoint}"
+    def get_cached_response(self, user_message):
+        """Ответ из кэша или None"""
+        if self.response_cache is None:
+            return None
+        cached = self.response_cache.get(self._response_cache_key(user_message))
+        if cached is not None:
+            logger.info("💾 Ответ найден в кэше")
+        return cached
+    
+    def cache_response(self, user_message, content):
+        """Сохранение ответа ИИ в кэш"""
+        if self.response_cache is not None and content:
+            self.response_cache.set(self._response_cache_key(user_message), content)
+    
+    def get_cached_analysis(self, file_unique_id, user_message):
+        """Результат анализа фото из кэша или None"""
+        if self.vision_cache is None:
+            return None
+        cached = self.vision_cache.get(make_key(file_unique_id, user_message, self.router.route('vision')['model']))
+        if cached is not None:
+            logger.info(f"💾 Анализ фото {file_unique_id} найден в кэше")
+        return cached
+    
+    def cache_analysis(self, file_unique_id, user_message, content):
+        """Сохранение результата анализа фото в кэш"""
+        if self.vision_cache is not None and content:
+            self.vision_cache.set(make_key(file_unique_id, user_message, self.router.route('vision')['model']), content)
+    
+    def get_history(self, chat_id):
+        """Сообщения истории чата для запроса (в пределах бюджета токенов)"""
+        if self.conversations is None or chat_id is None:
+            return []
+        return self.conversations.get_context(chat_id)
+    
+    def remember(self, chat_id, user_message, content):
+        """Сохранение вопроса и ответа в историю чата"""
+        if self.conversations is not None and chat_id is not None and content:
+            self.conversations.append(chat_id, user_message, content)
+    
+    def compact_history(self, chat_id):
+        """Сворачивание старой части истории чата, если она не помещается в бюджет"""
+        if self.conversations is None or not self.is_available():
+            return
+        if self.conversations.needs_compaction(chat_id):
+            self.conversations.compact(chat_id, self.summarize_conversation)
+    
+    def summarize_conversation(self, summary, turns):
+        """Краткое содержание прежнего краткого содержания и старых реплик"""
+        roles = {"user": "Пользователь", "assistant": "Ассистент"}
+        parts = []
+        if summary:
+            parts.append(f"Ранее: {summary}")
+        parts.extend(f"{roles.get(turn['role'], turn['role'])}: {turn['content']}" for turn in turns)
+        text = "\n".join(parts)
+        
+        route = self.router.route('summary', text)
+        data = {
+            "model": route['model'],
+            "messages": [
+                {"role": "system", "content": "Кратко перескажи разговор пользователя с ассистентом для продолжения диалога. Сохрани факты, имена, числа, вопросы пользователя и договоренности. Пиши на русском языке, без вступлений."},
+                {"role": "user", "content": text}
+            ],
+            "max_tokens": min(route['max_tokens'], self.conversations.summary_tokens),
+            "temperature": 0.3
+        }
+        response = self._make_openai_request("/chat/completions", data, route)
+        if response and response.get("choices"):
+            return response["choices"][0]["message"]["content"]
+        return None
+    
+    def request_key(self, kind, user_message, history=None):
+        """Ключ объединения одновременных запросов: как ключ кэша, плюс история чата"""
+        if not history:
+            return make_key(kind, self._response_cache_key(user_message))
+        return make_key(kind, self._build_chat_request(user_message, history))
+    
+    def _response_cache_key(self, user_message):
+        """Ключ кэша: нормализованное сообщение, модель, системный промпт и температура"""
+        data = self._build_chat_request(user_message)
+        system_prompt = data["messages"][0]["content"]
+        return make_key(normalize_prompt(user_message), data["model"], system_prompt, data["temperature"])
+    
+    def _chat_route(self, user_message):
+        """
+        Маршрут текстового ответа по размеру текущего сообщения
         
+        История не учитывается: она ограничена CONVERSATION_MAX_TOKENS, и иначе
+        любой вопрос в длинном диалоге уходил бы на большую модель. Большая
+        модель нужна только для длинных документов.
+        """
+        return self.router.route('chat', user_message)
+    
+    def _build_chat_request(self, user_message, history=None, route=None):
+        """Тело запроса /chat/completions для текстового ответа"""
+        route = route or self._chat_route(user_message)
+        return {
+            "model": route['model'],
+            "messages": [
+                {"role": "system", "content": "Ты полезный ассистент UMBB GPT Bot. Отвечай на русском языке, будь дружелюбным и информативным."},
+                *(history or []),
+                {"role": "user", "content": user_message}
+            ],
+            "max_tokens": route['max_tokens'],
+            "temperature": 0.7
+        }
+    
+    def _make_openai_request(self, endpoint, data, route=None):
+        """Выполнение HTTP запроса к OpenAI API (route - маршрут модели для таймаута и метрик)"""
         # Подготовка заголовков
         headers = {
             'Authorization': f'Bearer {self.api_key}',
@@ -186,20 +521,27 @@ class OpenAIAPI:
         # Подготовка данных
         json_data = json.dumps(data, ensure_ascii=False).encode('utf-8')
         
-        # Создание запроса
-        req = urllib.request.Request(url, data=json_data, headers=headers, method='POST')
-        
+        timeout = route['timeout'] if route else 30
+        started_at = time.monotonic()
+        result = None
         try:
-            with urllib.request.urlopen(req, timeout=30) as response:
-                response_data = json.loads(response.read().decode('utf-8'))
-                return response_data
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
-            logger.error(f"❌ HTTP ошибка OpenAI API: {e.code} - {error_body}")
-            return None
+            # Запрос через общий пул keep-alive соединений, с повторами при 429 и 5xx
+            response = self.executor.execute(lambda: self.pool.request(
+                'POST', f"{self.base_path}{endpoint}", body=json_data, headers=headers, timeout=timeout
+            ))
+            if not response.ok:
+                logger.error(f"❌ HTTP ошибка OpenAI API: {response.status} - {response.text()}")
+                return None
+            result = response.json()
+            return result
         except Exception as e:
             logger.error(f"❌ Ошибка запроса к OpenAI API: {e}")
             return None
+        finally:
+            if route:
+                usage = (result or {}).get('usage') or {}
+                self.router.record(route, time.monotonic() - started_at, usage.get('prompt_tokens', 0),
+                                   usage.get('completion_tokens', 0), success=result is not None)
     
     def _get_fallback_response(self, user_message):
         """Базовые ответы без ИИ"""
@@ -219,26 +561,479 @@ class OpenAIAPI:
         
         return f"🤖 Получил ваше сообщение: '{user_message}'. \n\n💡 Для полноценной работы с ИИ необходимо настроить OpenAI API ключ."
 
+class StreamingMessage:
+    """
+    Сообщение Telegram, которое дополняется по мере генерации ответа
+    
+    Первое сообщение отправляется, как только накопится немного текста,
+    затем обновляется через editMessageText не чаще edit_interval секунд.
+    Текст длиннее лимита Telegram продолжается в новом сообщении.
+    
+    Пока идет генерация, append() не ждет лимита частоты: отправка или правка
+    без свободного лимита пропускается, текст копится и уходит при следующей
+    возможности. Поток ответа OpenAI при этом держит место в лимите запросов
+    и соединение пула, поэтому ждать лимита Telegram можно только в finish(),
+    после завершения потока.
+    """
+    
+    def __init__(self, telegram_api, chat_id, edit_interval=STREAM_EDIT_INTERVAL,
+                 first_chunk_chars=STREAM_FIRST_CHUNK_CHARS):
+        self.telegram_api = telegram_api
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.first_chunk_chars = first_chunk_chars
+        
+        # Части ответа по лимиту длины сообщения: {'text', 'message_id', 'sent_text'}
+        self.parts = [self._new_part()]
+        self.last_edit = 0.0
+        self.edits = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.first_message_at = None
+    
+    @staticmethod
+    def _new_part():
+        return {'text': '', 'message_id': None, 'sent_text': ''}
+    
+    def append(self, delta):
+        """Добавление очередного фрагмента ответа (без ожидания лимитов Telegram)"""
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        
+        part = self.parts[-1]
+        part['text'] += delta
+        # Текст не помещается в одно сообщение: продолжаем в новом
+        while len(part['text']) > TELEGRAM_MESSAGE_LIMIT:
+            tail = part['text'][TELEGRAM_MESSAGE_LIMIT:]
+            part['text'] = part['text'][:TELEGRAM_MESSAGE_LIMIT]
+            part = self._new_part()
+            part['text'] = tail
+            self.parts.append(part)
+        
+        self._flush(wait=False)
+    
+    def finish(self):
+        """Отправка окончательного текста, возвращает True если что-то было отправлено"""
+        self._flush(wait=True)
+        
+        if self.first_message_at is not None:
+            logger.info(
+                f"⚡ Потоковый ответ в чат {self.chat_id}: первый токен "
+                f"{(self.first_token_at - self.started_at) * 1000:.0f}мс, первое сообщение "
+                f"{(self.first_message_at - self.started_at) * 1000:.0f}мс, правок {self.edits}, "
+                f"пропущено {self.skipped}"
+            )
+        return self.first_message_at is not None
+    
+    def _flush(self, wait):
+        """
+        Отправка неотправленного текста частей по порядку
+        
+        При wait=False недошедшая отправка прекращает обход, чтобы следующая
+        часть не обогнала предыдущую; последняя часть отправляется, только
+        когда накопит first_chunk_chars, и правится не чаще edit_interval.
+        """
+        for index, part in enumerate(self.parts):
+            text = part['text']
+            if text == part['sent_text'] or not text.strip():
+                continue
+            growing = not wait and index == len(self.parts) - 1
+            
+            if part['message_id'] is None:
+                if growing and len(text.strip()) < self.first_chunk_chars:
+                    return
+                result = self.telegram_api.send_message(self.chat_id, text, parse_mode=None, wait=wait)
+                if result.get('ok'):
+                    part['message_id'] = result['result']['message_id']
+                    if self.first_message_at is None:
+                        self.first_message_at = time.monotonic()
+            else:
+                if growing and time.monotonic() - self.last_edit < self.edit_interval:
+                    return
+                result = self.telegram_api.edit_message_text(self.chat_id, part['message_id'], text, wait=wait)
+                if not result.get('skipped'):
+                    self.edits += 1
+            
+            if result.get('skipped'):
+                self.skipped += 1
+                return
+            self.last_edit = time.monotonic()
+            if result.get('ok'):
+                part['sent_text'] = text
+            elif part['message_id'] is None:
+                # Без первого сообщения части следующие отправлять нельзя
+                return
+
+class UpdateProcessor:
+    """Обработка обновлений Telegram с использованием общего контекста приложения"""
+    
+    def __init__(self, context):
+        self.context = context
+    
+    def process_telegram_update(self, update_data):
+        """Обработка обновления от Telegram"""
+        try:
+            telegram_api = self.context.telegram_api
+            openai_api = self.context.openai_api
+            
+            # Обработка сообщений
+            if 'message' in update_data:
+                message = update_data['message']
+                chat_id = message['chat']['id']
+                
+                if 'text' in message:
+                    text = message['text']
+                    logger.info(f"📝 Получено сообщение от {chat_id}: {text}")
+                    
+                    # Обработка команд
+                    if text == '/start':
+                        ai_status = "🧠 ИИ активен" if openai_api.is_available() else "⚠️ ИИ недоступен (базовые ответы)"
+                        response = (
+                            "🤖 <b>Добро пожаловать в UMBB GPT Bot!</b>\n\n"
+                            "Я готов помочь вам с различными задачами с использованием искусственного интеллекта.\n\n"
+                            "<b>Доступные команды:</b>\n"
+                            "• /start - Начать работу\n"
+                            "• /help - Получить помощь\n\n"
+                            "<b>Возможности:</b>\n"
+                            "🧠 Умные ответы с помощью GPT\n"
+                            "🔍 Анализ изображений\n"
+                            "💬 Естественное общение\n\n"
+                            f"<b>Статус ИИ:</b> {ai_status}"
+                        )
+                    elif text == '/help':
+                        ai_status = "🧠 ИИ активен" if openai_api.is_available() else "⚠️ ИИ недоступен"
+                        chat_model = get_model_router().route('chat')['model']
+                        response = (
+                            "🆘 <b>Помощь по использованию бота</b>\n\n"
+                            "<b>Команды:</b>\n"
+                            "• /start - Приветствие и начало работы\n"
+                            "• /help - Эта справка\n\n"
+                            "<b>Возможности:</b>\n"
+                            f"🧠 Генерация умных ответов с помощью {chat_model}\n"
+                            "🔍 Анализ и описание изображений\n"
+                            "💬 Естественное общение на русском языке\n"
+                            "🌐 Работа через webhook на Render\n\n"
+                            f"<b>Статус ИИ:</b> {ai_status}\n"
+                            "<b>Статус бота:</b> ✅ Онлайн и готов к работе!"
+                        )
+                    else:
+                        # Генерация ответа с помощью ИИ
+                        logger.info(f"🧠 Генерация ответа для: {text}")
+                        response = None
+                        if OPENAI_STREAMING and openai_api.is_available():
+                            history = openai_api.get_history(chat_id)
+                            response = openai_api.get_cached_response(text) if not history else None
+                            if response is not None:
+                                openai_api.remember(chat_id, text, response)
+                            # Потоковый ответ отправляется и обновляется по мере генерации
+                            elif self.send_streaming_response(chat_id, text, history):
+                                openai_api.compact_history(chat_id)
+                                return
+                        if response is None:
+                            response = openai_api.generate_text_response(text, chat_id)
+                        
+                        telegram_api.send_message(chat_id, response)
+                        # Краткое содержание истории готовится уже после отправки ответа
+                        openai_api.compact_history(chat_id)
+                        return
+                    
+                    telegram_api.send_message(chat_id, response)
+                
+                elif 'photo' in message:
+                    logger.info(f"📸 Получено фото от {chat_id}")
+                    
+                    # Фото альбома обрабатываются вместе после получения всего альбома
+                    if message.get('media_group_id'):
+                        self.context.media_groups.add(message)
+                        return
+                    
+                    telegram_api.send_message(chat_id, self.analyze_photo(message['photo']))
+                
+                else:
+                    logger.info(f"❓ Неизвестный тип сообщения от {chat_id}")
+                    response = (
+                        "🤔 <b>Неизвестный тип сообщения</b>\n\n"
+                        "Я пока умею обрабатывать только текстовые сообщения и фотографии.\n\n"
+                        "Попробуйте отправить текст или используйте команды /start или /help"
+                    )
+                    telegram_api.send_message(chat_id, response)
+            
+            elif 'media_group' in update_data:
+                self.process_media_group(update_data['media_group'])
+            
+            else:
+                logger.info(f"❓ Неизвестный тип обновления: {list(update_data.keys())}")
+        
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки обновления: {e}")
+    
+    def analyze_photo(self, photo_sizes, prompt=PHOTO_TRANSLATION_PROMPT):
+        """Анализ одного фото (с кэшем по file_unique_id), возвращает текст ответа"""
+        openai_api = self.context.openai_api
+        # Наименьший размер фото, достаточный для анализа
+        photo = select_photo_size(photo_sizes)
+        # Одинаков для всех копий фото, в том числе пересланных в другие чаты
+        file_unique_id = photo.get('file_unique_id')
+        
+        try:
+            response = openai_api.get_cached_analysis(file_unique_id, prompt) if file_unique_id else None
+            if response is None:
+                image_url, plan = self.prepare_image(photo_sizes, photo)
+                if image_url:
+                    logger.info(f"🔍 Анализ изображения: {prompt}")
+                    started = time.monotonic()
+                    response = openai_api.analyze_image(image_url, prompt, cache_id=file_unique_id,
+                                                        detail=plan['detail'])
+                    self.context.vision_budget.record(plan, time.monotonic() - started)
+                else:
+                    response = "❌ Не удалось получить изображение для анализа."
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения файла: {e}")
+            response = "❌ Произошла ошибка при обработке изображения."
+        return response
+    
+    def process_media_group(self, messages):
+        """Альбом: анализ всех фото и один общий ответ"""
+        chat_id = messages[0]['chat']['id']
+        photos = [message['photo'] for message in messages if 'photo' in message]
+        logger.info(f"📚 Анализ альбома из {len(photos)} фото для {chat_id}")
+        
+        if len(photos) == 1:
+            response = self.analyze_photo(photos[0])
+        elif VISION_ALBUM_MODE == 'parallel':
+            with ThreadPoolExecutor(max_workers=max(1, VISION_ALBUM_CONCURRENCY)) as executor:
+                results = list(executor.map(self.analyze_photo, photos))
+            response = '\n\n'.join(f"Изображение {index}:\n{result}" for index, result in enumerate(results, 1))
+        else:
+            response = self.analyze_album(photos)
+        
+        for part in split_message(response):
+            self.context.telegram_api.send_message(chat_id, part, parse_mode=None)
+    
+    def analyze_album(self, photos):
+        """Все фото альбома одним запросом к OpenAI"""
+        openai_api = self.context.openai_api
+        prompt = ALBUM_TRANSLATION_PROMPT.format(count=len(photos))
+        selected = [select_photo_size(photo_sizes) for photo_sizes in photos]
+        cache_id = '+'.join(photo.get('file_unique_id', '') for photo in selected)
+        
+        try:
+            response = openai_api.get_cached_analysis(cache_id, prompt)
+            if response is not None:
+                return response
+            
+            images, plans = [], []
+            for photo_sizes, photo in zip(photos, selected):
+                image_url, plan = self.prepare_image(photo_sizes, photo)
+                if not image_url:
+                    return "❌ Не удалось получить изображения альбома для анализа."
+                images.append((image_url, plan['detail']))
+                plans.append(plan)
+            
+            started = time.monotonic()
+            response = openai_api.analyze_images(images, prompt, cache_id=cache_id)
+            latency = time.monotonic() - started
+            for plan in plans:
+                self.context.vision_budget.record(plan, latency)
+            return response
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки альбома: {e}")
+            return "❌ Произошла ошибка при обработке альбома."
+    
+    def send_streaming_response(self, chat_id, text, history=None):
+        """Потоковая отправка ответа ИИ, возвращает False если ничего не отправлено"""
+        openai_api = self.context.openai_api
+        
+        def stream():
+            streaming_message = StreamingMessage(self.context.telegram_api, chat_id)
+            chunks = []
+            try:
+                for delta in openai_api.stream_text_response(text, history):
+                    chunks.append(delta)
+                    streaming_message.append(delta)
+            except Exception as e:
+                logger.error(f"❌ Ошибка потоковой генерации ответа: {e}")
+                chunks = []
+            
+            sent = streaming_message.finish()
+            content = ''.join(chunks) if sent and chunks else None
+            # Кэшируем только полностью сгенерированный ответ без предыдущего контекста
+            if content and not history:
+                openai_api.cache_response(text, content)
+            return sent, content
+        
+        (sent, content), shared = openai_api.inflight.do(openai_api.request_key('stream', text, history), stream)
+        if shared:
+            # Такой же вопрос из другого чата: готовый ответ отправляется целиком
+            if not content:
+                return False
+            logger.info("🔗 Ответ получен от такого же выполняющегося запроса")
+            sent = self.context.telegram_api.send_message(chat_id, content, parse_mode=None).get('ok', False)
+        if content:
+            openai_api.remember(chat_id, text, content)
+        return sent
+    
+    def get_file_info(self, file_id):
+        """Получение информации о файле от Telegram API (с кэшем file_path)"""
+        if self.context.bot_token == 'dummy_token':
+            logger.warning(f"🤖 Dummy mode: would get file info for {file_id}")
+            return None
+        
+        try:
+            return self.context.file_resolver.get_file_info(file_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка запроса файла: {e}")
+            return None
+    
+    def prepare_image(self, photo_sizes, photo):
+        """
+        Ссылка на фото для OpenAI и план бюджета токенов
+        
+        В режиме url OpenAI скачивает фото по ссылке Telegram. В режиме data фото
+        скачивается ботом: по нему оценивается размер текста для выбора detail,
+        а в OpenAI отправляется копия, уменьшенная под выбранный detail.
+        
+        Returns:
+            (image_url, plan) или (None, None)
+        """
+        budget = self.context.vision_budget
+        file_id = photo['file_id']
+        
+        if VISION_IMAGE_MODE == 'data':
+            if self.context.bot_token == 'dummy_token':
+                logger.warning(f"🤖 Dummy mode: would download {file_id}")
+                return None, None
+            try:
+                data = self.context.file_resolver.download(file_id, photo.get('file_unique_id'))
+            except Exception as e:
+                logger.error(f"❌ Ошибка загрузки файла: {e}")
+                return None, None
+            if not data:
+                return None, None
+            plan = budget.plan(photo_sizes, data, photo=photo)
+            if plan['detail'] == 'low':
+                return to_data_url(data, max_long_side=TILE_SIZE, max_short_side=TILE_SIZE), plan
+            return to_data_url(data), plan
+        
+        file_info = self.get_file_info(file_id)
+        if file_info and 'file_path' in file_info:
+            return self.context.file_resolver.file_url(file_info['file_path']), budget.plan(photo_sizes, photo=photo)
+        return None, None
+
+class BotContext:
+    """
+    Долгоживущий контекст приложения
+    
+    Создается один раз при запуске и владеет клиентами API, пулами соединений,
+    диспетчером обновлений и метриками. Передается в HTTP обработчик через сервер.
+    """
+    
+    def __init__(self, bot_token=BOT_TOKEN, openai_api_key=OPENAI_API_KEY, port=PORT, webhook_url=WEBHOOK_URL):
+        self.bot_token = bot_token
+        self.openai_api_key = openai_api_key
+        self.port = port
+        self.webhook_url = webhook_url
+        self.start_time = datetime.now()
+        
+        # Пулы соединений к внешним API
+        self.telegram_pool = get_pool('api.telegram.org')
+        self.openai_pool = get_pool('api.openai.com')
+        
+        # Кэши
+        self.response_cache = TTLCache(CACHE_MAX_BYTES, CACHE_TTL_SECONDS, name='responses') if CACHE_ENABLED else None
+        self.vision_cache = TTLCache(VISION_CACHE_MAX_BYTES, VISION_CACHE_TTL_SECONDS, name='vision') if VISION_CACHE_ENABLED else None
+        # История диалогов по чатам
+        self.conversations = ConversationMemory() if CONVERSATION_MEMORY_ENABLED else None
+        
+        # Клиенты API
+        self.send_scheduler = SendScheduler() if TELEGRAM_RATE_LIMIT_ENABLED else None
+        self.telegram_api = TelegramAPI(bot_token, pool=self.telegram_pool, scheduler=self.send_scheduler)
+        self.openai_executor = OpenAIRequestExecutor(max_connections=self.openai_pool.max_connections)
+        self.openai_api = OpenAIAPI(openai_api_key, pool=self.openai_pool, response_cache=self.response_cache,
+                                    vision_cache=self.vision_cache, conversations=self.conversations,
+                                    executor=self.openai_executor)
+        # getFile с кэшем и загрузка файлов в кэш байтов по file_unique_id
+        self.file_resolver = TelegramFileResolver(self.telegram_api)
+        # Выбор размера фото и detail для OpenAI Vision, учет токенов изображений
+        self.vision_budget = VisionBudget()
+        
+        # Обработка обновлений
+        self.processor = UpdateProcessor(self)
+        # Обновления одного чата обрабатываются по порядку: ответ учитывает историю диалога
+        self.dispatcher = UpdateDispatcher(self.processor.process_telegram_update, key=update_chat_id)
+        # Фото альбома собираются и обрабатываются одним обновлением
+        self.media_groups = MediaGroupAggregator(self.submit_media_group)
+    
+    def start(self):
+        """Запуск фоновых компонентов"""
+        self.dispatcher.start()
+    
+    def stop(self):
+        """Остановка фоновых компонентов"""
+        self.media_groups.flush_all()
+        self.dispatcher.stop()
+    
+    def submit_media_group(self, messages):
+        """Постановка собранного альбома в очередь диспетчера"""
+        update = {'media_group': messages}
+        if not self.dispatcher.is_running or self.dispatcher.submit(update) == REJECTED:
+            # Повторной доставки альбома от Telegram не будет: обрабатываем сразу
+            self.processor.process_telegram_update(update)
+    
+    def get_stats(self):
+        """Метрики всех компонентов контекста"""
+        return {
+            'uptime': str(datetime.now() - self.start_time),
+            'dispatcher': self.dispatcher.get_stats(),
+            'http_pools': get_pool_stats(),
+            'send_scheduler': self.send_scheduler.get_stats() if self.send_scheduler else None,
+            'openai_requests': self.openai_executor.get_stats(),
+            'openai_coalescing': self.openai_api.inflight.get_stats(),
+            'model_routes': self.openai_api.router.get_stats(),
+            'telegram_files': self.file_resolver.get_stats(),
+            'vision_budget': self.vision_budget.get_stats(),
+            'media_groups': self.media_groups.get_stats(),
+            'conversations': self.conversations.get_stats() if self.conversations else None,
+            'caches': {
+                'responses': self.response_cache.get_stats() if self.response_cache else None,
+                'vision': self.vision_cache.get_stats() if self.vision_cache else None
+            }
+        }
+
 class WebhookHandler(BaseHTTPRequestHandler):
     """Обработчик HTTP запросов для webhook"""
     
-    def __init__(self, *args, **kwargs):
-        self.bot_token = BOT_TOKEN
-        self.port = PORT
-        self.webhook_url = WEBHOOK_URL
-        super().__init__(*args, **kwargs)
+    # HTTP/1.1 включает keep-alive, поэтому каждый ответ содержит Content-Length
+    protocol_version = 'HTTP/1.1' if HTTP_KEEP_ALIVE else 'HTTP/1.0'
+    # Таймаут чтения запроса и простоя keep-alive соединения
+    timeout = HTTP_READ_TIMEOUT
+    
+    @property
+    def context(self):
+        """Контекст приложения, переданный серверу при запуске"""
+        return self.server.context
     
     def log_message(self, format, *args):
         """Переопределяем для уменьшения шума в логах"""
         logger.info(f"HTTP: {format % args}")
     
+    def send_body(self, status, body, content_type='application/json', headers=None):
+        """Отправка ответа с Content-Length для поддержки keep-alive"""
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+    
     def do_GET(self):
         """Обработка GET запросов"""
         if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            
+            openai_key_set = bool(self.context.openai_api_key and len(self.context.openai_api_key) > 10)
             html = f"""
             <!DOCTYPE html>
             <html>
@@ -262,23 +1057,23 @@ class WebhookHandler(BaseHTTPRequestHandler):
                     <h1>🤖 UMBB GPT Bot Status</h1>
                     
                     <div class="status success">
-                        <strong>✅ HTTP Сервер:</strong> Работает на порту {self.port}
+                        <strong>✅ HTTP Сервер:</strong> Работает на порту {self.context.port}
                     </div>
                     
-                    <div class="status {'success' if self.bot_token != 'dummy_token' else 'error'}">
-                        <strong>{'✅' if self.bot_token != 'dummy_token' else '❌'} Telegram Token:</strong> 
-                        {'Настроен' if self.bot_token != 'dummy_token' else 'НЕ НАСТРОЕН'}
-                        {'' if self.bot_token != 'dummy_token' else '<br><small>Установите TELEGRAM_BOT_TOKEN в Render Dashboard</small>'}
+                    <div class="status {'success' if self.context.bot_token != 'dummy_token' else 'error'}">
+                        <strong>{'✅' if self.context.bot_token != 'dummy_token' else '❌'} Telegram Token:</strong> 
+                        {'Настроен' if self.context.bot_token != 'dummy_token' else 'НЕ НАСТРОЕН'}
+                        {'' if self.context.bot_token != 'dummy_token' else '<br><small>Установите TELEGRAM_BOT_TOKEN в Render Dashboard</small>'}
                     </div>
                     
                     <div class="status info">
-                        <strong>🔗 Webhook URL:</strong> {self.webhook_url}/webhook
+                        <strong>🔗 Webhook URL:</strong> {self.context.webhook_url}/webhook
                     </div>
                     
                     <div class="status {'success' if OPENAI_AVAILABLE else 'warning'}">
                         <strong>🧠 OpenAI API:</strong> 
                         {'✅ Доступен' if OPENAI_AVAILABLE else '❌ Недоступен'}
-                        {f' (ключ: {"✅ Настроен" if OPENAI_API_KEY and len(OPENAI_API_KEY) > 10 else "❌ Не настроен"})' if OPENAI_AVAILABLE else ''}
+                        {f' (ключ: {"✅ Настроен" if openai_key_set else "❌ Не настроен"})' if OPENAI_AVAILABLE else ''}
                     </div>
                     
                     <div class="status info">
@@ -296,205 +1091,143 @@ class WebhookHandler(BaseHTTPRequestHandler):
             </html>
             """
             
-            self.wfile.write(html.encode('utf-8'))
+            self.send_body(200, html.encode('utf-8'), 'text/html; charset=utf-8')
             
         elif self.path == '/health':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
             health_data = {
                 'status': 'healthy',
-                'bot_token_set': self.bot_token != 'dummy_token',
-                'webhook_url': f'{self.webhook_url}/webhook'
+                'bot_token_set': self.context.bot_token != 'dummy_token',
+                'webhook_url': f'{self.context.webhook_url}/webhook'
             }
             
-            self.wfile.write(json.dumps(health_data, ensure_ascii=False).encode('utf-8'))
+            self.send_body(200, json.dumps(health_data, ensure_ascii=False).encode('utf-8'))
             
         elif self.path == '/diagnostics':
             # Диагностический endpoint
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
             diagnostics_data = {
                 'bot_status': 'running',
-                'bot_token_set': BOT_TOKEN != 'dummy_token',
+                'bot_token_set': self.context.bot_token != 'dummy_token',
                 'openai_available': OPENAI_AVAILABLE,
-                'openai_key_set': bool(OPENAI_API_KEY and len(OPENAI_API_KEY) > 10),
-                'webhook_url': f'{WEBHOOK_URL}/webhook',
-                'port': PORT,
+                'openai_key_set': bool(self.context.openai_api_key and len(self.context.openai_api_key) > 10),
+                'webhook_url': f'{self.context.webhook_url}/webhook',
+                'port': self.context.port,
                 'python_version': sys.version,
+                'http_server': self.server.get_stats() if hasattr(self.server, 'get_stats') else None,
+                **self.context.get_stats(),
                 'timestamp': datetime.now().isoformat()
             }
             
-            self.wfile.write(json.dumps(diagnostics_data, ensure_ascii=False, indent=2).encode('utf-8'))
+            self.send_body(200, json.dumps(diagnostics_data, ensure_ascii=False, indent=2).encode('utf-8'))
             
         else:
-            self.send_response(404)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'Not Found')
+            self.send_body(404, b'Not Found', 'text/plain')
     
     def do_POST(self):
         """Обработка POST запросов (webhook)"""
         if self.path == '/webhook':
             try:
                 content_length = int(self.headers.get('Content-Length', 0))
+                if content_length < 0 or content_length > HTTP_MAX_BODY_SIZE:
+                    # Тело не читаем, поэтому соединение нельзя переиспользовать
+                    logger.warning(f"⚠️ Отклонен запрос с телом {content_length} байт (лимит {HTTP_MAX_BODY_SIZE})")
+                    self.close_connection = True
+                    self.send_body(413, b'{"ok": false, "error": "Payload Too Large"}')
+                    return
+                
                 post_data = self.rfile.read(content_length)
                 
                 if content_length > 0:
                     update_data = json.loads(post_data.decode('utf-8'))
                     logger.info(f"📨 Получен webhook: {json.dumps(update_data, ensure_ascii=False)[:200]}...")
                     
-                    # Обработка обновления в отдельном потоке
-                    threading.Thread(
-                        target=self.process_telegram_update,
-                        args=(update_data,),
-                        daemon=True
-                    ).start()
+                    # Обработка обновления в пуле воркеров
+                    dispatcher = self.context.dispatcher
+                    status = dispatcher.submit(update_data)
+                    if status == REJECTED:
+                        # Telegram повторит доставку обновления позже
+                        self.send_body(429, json.dumps({
+                            'ok': False,
+                            'error': 'Too Many Requests',
+                            'retry_after': dispatcher.retry_after
+                        }).encode('utf-8'), headers={'Retry-After': str(dispatcher.retry_after)})
+                        return
                 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(b'{"ok": true}')
+                self.send_body(200, b'{"ok": true}')
                 
             except Exception as e:
                 logger.error(f"❌ Ошибка обработки webhook: {e}")
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'ok': False, 'error': str(e)}).encode('utf-8'))
+                self.send_body(500, json.dumps({'ok': False, 'error': str(e)}).encode('utf-8'))
         else:
-            self.send_response(404)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'Not Found')
+            self.send_body(404, b'Not Found', 'text/plain')
     
-    def process_telegram_update(self, update_data):
-        """Обработка обновления от Telegram"""
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    """HTTP сервер, обрабатывающий соединения в потоках с ограничением их числа"""
+    
+    daemon_threads = True
+    # Очередь ожидающих соединений в ядре, пока все потоки заняты
+    request_queue_size = 64
+    
+    def __init__(self, server_address, handler_class, context, max_threads=HTTP_MAX_THREADS):
+        self.context = context
+        self.max_threads = max_threads
+        self._slots = threading.BoundedSemaphore(max_threads)
+        self._lock = threading.Lock()
+        self.active_connections = 0
+        self.total_connections = 0
+        super().__init__(server_address, handler_class)
+    
+    def process_request(self, request, client_address):
+        """Ожидание свободного слота перед запуском потока для соединения"""
+        self._slots.acquire()
+        with self._lock:
+            self.active_connections += 1
+            self.total_connections += 1
         try:
-            telegram_api = TelegramAPI(BOT_TOKEN)
-            openai_api = OpenAIAPI(OPENAI_API_KEY)
-            
-            # Обработка сообщений
-            if 'message' in update_data:
-                message = update_data['message']
-                chat_id = message['chat']['id']
-                
-                if 'text' in message:
-                    text = message['text']
-                    logger.info(f"📝 Получено сообщение от {chat_id}: {text}")
-                    
-                    # Обработка команд
-                    if text == '/start':
-                        ai_status = "🧠 ИИ активен" if openai_api.is_available() else "⚠️ ИИ недоступен (базовые ответы)"
-                        response = (
-                            "🤖 <b>Добро пожаловать в UMBB GPT Bot!</b>\n\n"
-                            "Я готов помочь вам с различными задачами с использованием искусственного интеллекта.\n\n"
-                            "<b>Доступные команды:</b>\n"
-                            "• /start - Начать работу\n"
-                            "• /help - Получить помощь\n\n"
-                            "<b>Возможности:</b>\n"
-                            "🧠 Умные ответы с помощью GPT\n"
-                            "🔍 Анализ изображений\n"
-                            "💬 Естественное общение\n\n"
-                            f"<b>Статус ИИ:</b> {ai_status}"
-                        )
-                    elif text == '/help':
-                        ai_status = "🧠 ИИ активен" if openai_api.is_available() else "⚠️ ИИ недоступен"
-                        response = (
-                            "🆘 <b>Помощь по использованию бота</b>\n\n"
-                            "<b>Команды:</b>\n"
-                            "• /start - Приветствие и начало работы\n"
-                            "• /help - Эта справка\n\n"
-                            "<b>Возможности:</b>\n"
-                            "🧠 Генерация умных ответов с помощью GPT-3.5\n"
-                            "🔍 Анализ и описание изображений\n"
-                            "💬 Естественное общение на русском языке\n"
-                            "🌐 Работа через webhook на Render\n\n"
-                            f"<b>Статус ИИ:</b> {ai_status}\n"
-                            "<b>Статус бота:</b> ✅ Онлайн и готов к работе!"
-                        )
-                    else:
-                        # Генерация ответа с помощью ИИ
-                        logger.info(f"🧠 Генерация ответа для: {text}")
-                        response = openai_api.generate_text_response(text)
-                    
-                    telegram_api.send_message(chat_id, response)
-                
-                elif 'photo' in message:
-                    logger.info(f"📸 Получено фото от {chat_id}")
-                    
-                    # Получаем самое большое фото
-                    photo = message['photo'][-1]  # Последнее фото - самое большое
-                    file_id = photo['file_id']
-                    
-                    # Получаем URL файла через Telegram API
-                    try:
-                        file_info = self.get_file_info(file_id)
-                        if file_info and 'file_path' in file_info:
-                            file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_info['file_path']}"
-                            
-                            # Переводим текст с изображения на английский язык
-                            translation_prompt = "Переведи весь текст с этого изображения на английский язык. Предоставь только переведенный текст без дополнительных комментариев. Если на изображении нет текста, напиши 'No text found in the image'."
-                            logger.info(f"🔍 Анализ изображения: {translation_prompt}")
-                            
-                            response = openai_api.analyze_image(file_url, translation_prompt)
-                        else:
-                            response = "❌ Не удалось получить изображение для анализа."
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка получения файла: {e}")
-                        response = "❌ Произошла ошибка при обработке изображения."
-                    
-                    telegram_api.send_message(chat_id, response)
-                
-                else:
-                    logger.info(f"❓ Неизвестный тип сообщения от {chat_id}")
-                    response = (
-                        "🤔 <b>Неизвестный тип сообщения</b>\n\n"
-                        "Я пока умею обрабатывать только текстовые сообщения и фотографии.\n\n"
-                        "Попробуйте отправить текст или используйте команды /start или /help"
-                    )
-                    telegram_api.send_message(chat_id, response)
-            
-            else:
-                logger.info(f"❓ Неизвестный тип обновления: {list(update_data.keys())}")
-        
-        except Exception as e:
-            logger.error(f"❌ Ошибка обработки обновления: {e}")
+            super().process_request(request, client_address)
+        except Exception:
+            self._release_slot()
+            raise
     
-    def get_file_info(self, file_id):
-        """Получение информации о файле от Telegram API"""
-        if BOT_TOKEN == 'dummy_token':
-            logger.warning(f"🤖 Dummy mode: would get file info for {file_id}")
-            return None
-        
-        url = f'https://api.telegram.org/bot{BOT_TOKEN}/getFile'
-        data = {'file_id': file_id}
-        
+    def process_request_thread(self, request, client_address):
         try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            req.add_header('Content-Type', 'application/x-www-form-urlencoded')
-            
-            with urllib.request.urlopen(req, timeout=10) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                if result.get('ok'):
-                    return result.get('result')
-                else:
-                    logger.error(f"❌ Ошибка получения файла: {result}")
-                    return None
-        except Exception as e:
-            logger.error(f"❌ Ошибка запроса файла: {e}")
-            return None
+            super().process_request_thread(request, client_address)
+        finally:
+            self._release_slot()
+    
+    def _release_slot(self):
+        with self._lock:
+            self.active_connections -= 1
+        self._slots.release()
+    
+    def get_stats(self):
+        """Статистика соединений для диагностики"""
+        with self._lock:
+            return {
+                'mode': 'threading',
+                'max_threads': self.max_threads,
+                'active_connections': self.active_connections,
+                'total_connections': self.total_connections,
+                'keep_alive': HTTP_KEEP_ALIVE,
+                'max_body_size': HTTP_MAX_BODY_SIZE,
+                'read_timeout': HTTP_READ_TIMEOUT
+            }
 
-def setup_webhook():
+def create_server(context):
+    """Создание HTTP сервера в выбранном режиме"""
+    if HTTP_SERVER_MODE == 'single':
+        logger.warning("⚠️ HTTP сервер работает в однопоточном режиме")
+        server = HTTPServer(('0.0.0.0', context.port), WebhookHandler)
+        server.context = context
+        return server
+    return BoundedThreadingHTTPServer(('0.0.0.0', context.port), WebhookHandler, context)
+
+def setup_webhook(context):
     """Настройка webhook"""
     logger.info("🔧 Настройка webhook...")
+    bot_token = context.bot_token
     
     # Проверка токена
-    if BOT_TOKEN == 'dummy_token':
+    if bot_token == 'dummy_token':
         logger.critical(
             "\n" + "="*60 + "\n"
             "❌ КРИТИЧЕСКАЯ ОШИБКА: TELEGRAM_BOT_TOKEN не настроен!\n\n"
@@ -511,13 +1244,13 @@ def setup_webhook():
         )
         return False
     
-    telegram_api = TelegramAPI(BOT_TOKEN)
-    webhook_url = f'{WEBHOOK_URL}/webhook'
+    telegram_api = context.telegram_api
+    webhook_url = f'{context.webhook_url}/webhook'
     
     logger.info(f"🔗 Установка webhook: {webhook_url}")
-    logger.info(f"🔑 Токен: {BOT_TOKEN[:10]}...{BOT_TOKEN[-4:] if len(BOT_TOKEN) > 14 else '****'}")
+    logger.info(f"🔑 Токен: {bot_token[:10]}...{bot_token[-4:] if len(bot_token) > 14 else '****'}")
     
-    result = telegram_api.set_webhook(webhook_url)
+    result = telegram_api.set_webhook(webhook_url, max_connections=WEBHOOK_MAX_CONNECTIONS)
     
     if result.get('ok'):
         logger.info("✅ Webhook успешно установлен!")
@@ -533,11 +1266,15 @@ def setup_webhook():
 
 def run_server():
     """Запуск HTTP сервера"""
-    server = HTTPServer(('0.0.0.0', PORT), WebhookHandler)
-    logger.info(f"🚀 HTTP сервер запущен на порту {PORT}")
+    # Контекст приложения создается один раз на весь срок работы процесса
+    context = BotContext()
+    context.start()
+    
+    server = create_server(context)
+    logger.info(f"🚀 HTTP сервер запущен на порту {context.port} (режим: {HTTP_SERVER_MODE}, потоков: {HTTP_MAX_THREADS})")
     
     # Настройка webhook в отдельном потоке
-    webhook_thread = threading.Thread(target=setup_webhook, daemon=True)
+    webhook_thread = threading.Thread(target=setup_webhook, args=(context,), daemon=True)
     webhook_thread.start()
     
     try:
@@ -545,6 +1282,8 @@ def run_server():
     except KeyboardInterrupt:
         logger.info("🛑 Получен сигнал остановки")
         server.shutdown()
+    finally:
+        context.stop()
 
 def main():
     """Главная функция"""
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потокобезопасный LRU кэш с временем жизни записей и ограничением по размеру
+
+Используется для кэширования ответов внешних API. Размер кэша ограничен
+суммарным объемом записей в байтах, при превышении вытесняются давно
+не использовавшиеся записи.
+
+Использует только стандартную библиотеку Python.
+"""
+
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+
+def estimate_size(value: Any) -> int:
+    """Приблизительный объем значения в байтах"""
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (dict, list, tuple)):
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+    return sys.getsizeof(value)
+
+
+def make_key(*parts: Any) -> str:
+    """Стабильный ключ кэша из произвольных частей"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TTLCache:
+    """
+    LRU кэш с TTL и ограничением суммарного размера в байтах
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, name: str = 'cache',
+                 sizeof: Callable[[Any], int] = estimate_size):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self.sizeof = sizeof
+
+        # ключ -> (значение, размер, время истечения)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Получение значения, продлевает его позицию в LRU"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove_locked(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> bool:
+        """Сохранение значения, возвращает False если оно больше всего кэша"""
+        size = self.sizeof(value) + len(key)
+        if size > self.max_bytes:
+            return False
+
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            if key in self._data:
+                self._remove_locked(key)
+
+            self._data[key] = (value, size, time.monotonic() + ttl)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self._data))
+                self._remove_locked(oldest_key)
+                self.evictions += 1
+        return True
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._data:
+                self._remove_locked(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def _remove_locked(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self.current_bytes -= size
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_stats(self) -> dict:
+        """Статистика попаданий и заполненности"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._data),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -158,6 +158,7 @@ class Config:
 
     
     # === CACHE SETTINGS ===
+    # bot.py (только стандартная библиотека) читает те же переменные сам
     @property
     def cache_enabled(self) -> bool:
         """Включено ли кэширование"""
@@ -168,6 +169,11 @@ class Config:
         """Время жизни кэша в секундах"""
         return int(os.getenv('CACHE_TTL_SECONDS', '3600'))  # 1 час
     
+    @property
+    def cache_max_bytes(self) -> int:
+        """Максимальный объем кэша ответов в байтах"""
+        return int(os.getenv('CACHE_MAX_BYTES', '5242880'))  # 5MB
+    
     # === DEVELOPMENT SETTINGS ===
     @property
     def debug_mode(self) -> bool:
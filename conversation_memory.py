@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Память диалогов: история сообщений каждого чата для текстовых ответов ИИ
+
+В запрос к OpenAI попадают только последние реплики, которые помещаются
+в бюджет токенов контекста, поэтому размер промпта (и задержка) не растет
+с длиной диалога. Реплики, вышедшие за бюджет, сворачиваются в краткое
+содержание, которое передается вместе с окном последних реплик.
+
+Хранение компактное: реплики чата лежат в кольцевом буфере ограниченной
+длины, роли - общие строковые константы. Давно неактивные чаты и чаты
+сверх общего лимита памяти вытесняются.
+
+Использует только стандартную библиотеку Python.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Роли хранятся ссылками на одни и те же строки
+USER = sys.intern('user')
+ASSISTANT = sys.intern('assistant')
+
+# Служебные токены OpenAI на каждое сообщение запроса
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов
+
+    Около 4 байт UTF-8 на токен: для латиницы это ~4 символа,
+    для кириллицы ~2 символа, что близко к токенизатору OpenAI.
+    """
+    return len(text.encode('utf-8')) // 4 + 1 if text else 0
+
+
+class ChatHistory:
+    """История одного чата"""
+
+    __slots__ = ('turns', 'summary', 'summary_tokens', 'tokens', 'bytes', 'last_active', 'compacting')
+
+    def __init__(self, max_turns: int):
+        # (роль, текст, токены)
+        self.turns = deque(maxlen=max_turns)
+        self.summary = ''
+        self.summary_tokens = 0
+        self.tokens = 0
+        self.bytes = 0
+        self.last_active = time.monotonic()
+        self.compacting = False
+
+
+class ConversationMemory:
+    """
+    Истории чатов с окном по бюджету токенов и вытеснением неактивных чатов
+    """
+
+    def __init__(self, max_context_tokens: Optional[int] = None, max_turns: Optional[int] = None,
+                 max_bytes: Optional[int] = None, idle_ttl: Optional[float] = None,
+                 summary_tokens: Optional[int] = None):
+        # Бюджет истории в запросе (без системного промпта и текущего сообщения)
+        self.max_context_tokens = max_context_tokens or int(os.getenv('CONVERSATION_MAX_TOKENS', '1500'))
+        # Длина кольцевого буфера реплик одного чата
+        self.max_turns = max_turns or int(os.getenv('CONVERSATION_MAX_TURNS', '20'))
+        # Общий лимит памяти всех историй
+        self.max_bytes = max_bytes or int(os.getenv('CONVERSATION_MAX_BYTES', '4194304'))  # 4MB
+        # Через сколько секунд без сообщений история чата удаляется
+        self.idle_ttl = idle_ttl or float(os.getenv('CONVERSATION_IDLE_TTL', '21600'))  # 6 часов
+        # Максимальная длина краткого содержания
+        self.summary_tokens = summary_tokens or int(os.getenv('CONVERSATION_SUMMARY_TOKENS', '300'))
+
+        # chat_id -> ChatHistory, в порядке последней активности
+        self._chats: Dict[int, ChatHistory] = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+
+        # Статистика
+        self.summaries = 0
+        self.summary_failures = 0
+        self.dropped_turns = 0
+        self.idle_evictions = 0
+        self.memory_evictions = 0
+        self.context_requests = 0
+        self.context_tokens = 0
+
+    def get_context(self, chat_id: int) -> List[Dict]:
+        """
+        Сообщения истории для запроса: краткое содержание и последние реплики
+
+        Реплики берутся с конца, пока помещаются в бюджет токенов.
+        """
+        with self._lock:
+            self._evict_idle_locked()
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                return []
+
+            messages = []
+            used = 0
+            if chat.summary:
+                messages.append({"role": "system", "content": SUMMARY_PREFIX + chat.summary})
+                used += chat.summary_tokens + MESSAGE_OVERHEAD_TOKENS
+
+            window = []
+            for role, content, tokens in reversed(chat.turns):
+                cost = tokens + MESSAGE_OVERHEAD_TOKENS
+                if used + cost > self.max_context_tokens:
+                    break
+                used += cost
+                window.append((role, content, cost))
+
+            # Окно не должно начинаться с ответа ассистента без вопроса
+            if window and window[-1][0] == ASSISTANT:
+                used -= window.pop()[2]
+            messages.extend({"role": role, "content": content} for role, content, _ in reversed(window))
+
+            self.context_requests += 1
+            self.context_tokens += used
+            return messages
+
+    def append(self, chat_id: int, user_message: str, response: str):
+        """Сохранение вопроса пользователя и ответа ассистента"""
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = ChatHistory(self.max_turns)
+                self._chats[chat_id] = chat
+            else:
+                self._chats.move_to_end(chat_id)
+            chat.last_active = time.monotonic()
+
+            for role, content in ((USER, user_message), (ASSISTANT, response)):
+                if len(chat.turns) == chat.turns.maxlen:
+                    # Буфер полон, а краткое содержание еще не готово: старейшая реплика теряется
+                    _, dropped, dropped_tokens = chat.turns[0]
+                    self._account_locked(chat, -dropped_tokens, -len(dropped.encode('utf-8')))
+                    self.dropped_turns += 1
+                tokens = estimate_tokens(content)
+                chat.turns.append((role, content, tokens))
+                self._account_locked(chat, tokens, len(content.encode('utf-8')))
+
+            self._evict_idle_locked()
+            self._evict_over_limit_locked(chat_id)
+
+    def needs_compaction(self, chat_id: int) -> bool:
+        """Не помещается ли история чата в бюджет (или почти заполнен буфер)"""
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.compacting:
+                return False
+            return (chat.summary_tokens + chat.tokens > self.max_context_tokens
+                    or len(chat.turns) >= self.max_turns - 1)
+
+    def compact(self, chat_id: int, summarize: Callable[[str, List[Dict]], Optional[str]]) -> bool:
+        """
+        Сворачивание старых реплик в краткое содержание
+
+        В истории остаются последние реплики на половину бюджета, остальные
+        вместе с прежним кратким содержанием передаются summarize(summary, turns).
+        Вызывается после отправки ответа, чтобы не задерживать его.
+
+        Returns:
+            True если краткое содержание обновлено
+        """
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.compacting:
+                return False
+
+            keep_budget = self.max_context_tokens // 2
+            kept, kept_tokens = 0, 0
+            for role, content, tokens in reversed(chat.turns):
+                if kept_tokens + tokens > keep_budget or kept >= self.max_turns // 2:
+                    break
+                kept += 1
+                kept_tokens += tokens
+            # Оставляемое окно начинается с вопроса пользователя
+            if kept and chat.turns[len(chat.turns) - kept][0] == ASSISTANT:
+                kept -= 1
+
+            old_turns = list(chat.turns)[:len(chat.turns) - kept]
+            if not old_turns:
+                return False
+            chat.compacting = True
+            summary = chat.summary
+
+        try:
+            new_summary = summarize(summary, [{"role": role, "content": content} for role, content, _ in old_turns])
+        except Exception as e:
+            logger.error(f"❌ Ошибка сворачивания истории чата {chat_id}: {e}")
+            new_summary = None
+
+        with self._lock:
+            chat.compacting = False
+            if self._chats.get(chat_id) is not chat:
+                # Чат вытеснен, пока готовилось краткое содержание
+                return False
+            if not new_summary:
+                self.summary_failures += 1
+                return False
+
+            # Пока шел запрос, часть старых реплик могла уйти из кольцевого буфера
+            old = set(map(id, old_turns))
+            while chat.turns and id(chat.turns[0]) in old:
+                _, content, tokens = chat.turns.popleft()
+                self._account_locked(chat, -tokens, -len(content.encode('utf-8')))
+
+            new_summary = new_summary.strip()
+            summary_tokens = estimate_tokens(new_summary)
+            self._account_locked(chat, 0, len(new_summary.encode('utf-8')) - len(chat.summary.encode('utf-8')))
+            chat.summary = new_summary
+            chat.summary_tokens = summary_tokens
+            self.summaries += 1
+
+        logger.info(f"🗜 История чата {chat_id}: {len(old_turns)} реплик свернуто в краткое содержание "
+                    f"({summary_tokens} токенов)")
+        return True
+
+    def clear(self, chat_id: int):
+        """Удаление истории чата"""
+        with self._lock:
+            chat = self._chats.pop(chat_id, None)
+            if chat is not None:
+                self.current_bytes -= chat.bytes
+
+    def _account_locked(self, chat: ChatHistory, tokens: int, size: int):
+        chat.tokens += tokens
+        chat.bytes += size
+        self.current_bytes += size
+
+    def _evict_idle_locked(self):
+        """Удаление неактивных чатов (самые старые - в начале)"""
+        deadline = time.monotonic() - self.idle_ttl
+        while self._chats:
+            chat_id, chat = next(iter(self._chats.items()))
+            if chat.last_active > deadline:
+                break
+            self._chats.popitem(last=False)
+            self.current_bytes -= chat.bytes
+            self.idle_evictions += 1
+
+    def _evict_over_limit_locked(self, current_chat_id: int):
+        """Вытеснение давно неактивных чатов сверх общего лимита памяти"""
+        while self.current_bytes > self.max_bytes and len(self._chats) > 1:
+            chat_id, chat = next(iter(self._chats.items()))
+            if chat_id == current_chat_id:
+                break
+            self._chats.popitem(last=False)
+            self.current_bytes -= chat.bytes
+            self.memory_evictions += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'chats': len(self._chats),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'max_context_tokens': self.max_context_tokens,
+                'avg_context_tokens': round(self.context_tokens / self.context_requests, 1) if self.context_requests else 0,
+                'summaries': self.summaries,
+                'summary_failures': self.summary_failures,
+                'dropped_turns': self.dropped_turns,
+                'idle_evictions': self.idle_evictions,
+                'memory_evictions': self.memory_evictions
+            }
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Диспетчер обновлений Telegram с ограниченным пулом воркеров
+
+Вместо отдельного потока на каждое обновление обновления складываются
+в ограниченную очередь и обрабатываются фиксированным пулом воркеров.
+При переполнении очереди применяется одна из политик:
+
+    shed   - обновление отбрасывается, Telegram получает 200
+    delay  - ожидание свободного места не дольше enqueue_timeout,
+             затем ответ 429
+    reject - сразу ответ 429, Telegram повторит доставку позже
+
+Обновления с одним ключом (чат) обрабатываются по одному и в порядке
+поступления: если чат уже обрабатывается, воркер откладывает обновление
+в очередь этого чата, и его выполнит тот же воркер, что занят чатом.
+Иначе второй вопрос читал бы историю диалога без ответа на первый.
+
+Использует только стандартную библиотеку Python.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Результаты постановки обновления в очередь
+ACCEPTED = 'accepted'
+SHED = 'shed'
+REJECTED = 'rejected'
+
+OVERFLOW_POLICIES = ('shed', 'delay', 'reject')
+
+_STOP = object()
+
+
+class UpdateDispatcher:
+    """
+    Ограниченная очередь обновлений и пул воркеров для их обработки
+    """
+
+    def __init__(self, handler: Callable, workers: Optional[int] = None,
+                 queue_size: Optional[int] = None, overflow_policy: Optional[str] = None,
+                 enqueue_timeout: Optional[float] = None,
+                 key: Optional[Callable[[object], Optional[Hashable]]] = None):
+        self.handler = handler
+        # Ключ последовательной обработки (например, chat_id), None - без ограничений
+        self.key = key
+
+        # Настройки из переменных окружения
+        self.workers = workers or int(os.getenv('UPDATE_WORKERS', '4'))
+        self.queue_size = queue_size or int(os.getenv('UPDATE_QUEUE_SIZE', '100'))
+        self.overflow_policy = (overflow_policy or os.getenv('UPDATE_OVERFLOW_POLICY', 'reject')).lower()
+        self.enqueue_timeout = enqueue_timeout if enqueue_timeout is not None else float(
+            os.getenv('UPDATE_ENQUEUE_TIMEOUT', '2'))
+        # Подсказка Telegram, через сколько секунд повторить доставку
+        self.retry_after = int(os.getenv('UPDATE_RETRY_AFTER', '5'))
+
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            logger.warning(f"⚠️ Неизвестная политика переполнения '{self.overflow_policy}', используется 'reject'")
+            self.overflow_policy = 'reject'
+
+        self._queue = queue.Queue()
+        # Места в очереди: занимаются при постановке, освобождаются в начале обработки,
+        # поэтому отложенные обновления чатов тоже учитываются
+        self._capacity = threading.BoundedSemaphore(self.queue_size)
+        # Ключ -> отложенные обновления ключа, который сейчас обрабатывается
+        self._active = {}
+        self._waiting = 0
+        self._threads = []
+        self._lock = threading.Lock()
+        self.is_running = False
+        self.start_time = None
+
+        # Счетчики
+        self.accepted = 0
+        self.shed = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.deferred = 0
+        self.busy_workers = 0
+        self.max_queue_depth = 0
+        self._busy_time = 0.0
+        self._wait_time = 0.0
+
+    def start(self):
+        """Запуск пула воркеров"""
+        if self.is_running:
+            logger.warning("⚠️ Диспетчер уже запущен")
+            return
+
+        self.is_running = True
+        self.start_time = time.monotonic()
+
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f'update-worker-{index}',
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info(
+            f"✅ Диспетчер обновлений запущен: воркеров {self.workers}, "
+            f"очередь {self.queue_size}, политика '{self.overflow_policy}'"
+        )
+
+    def stop(self, timeout: float = 5):
+        """Остановка пула воркеров после обработки уже принятых обновлений"""
+        if not self.is_running:
+            return
+
+        self.is_running = False
+        for _ in self._threads:
+            # Блокирующая вставка: маркер остановки должен попасть в очередь
+            self._queue.put(_STOP)
+
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+
+        self._threads = []
+        logger.info(f"🛑 Диспетчер обновлений остановлен, обработано: {self.processed}")
+
+    def submit(self, update_data) -> str:
+        """
+        Постановка обновления в очередь
+
+        Returns:
+            ACCEPTED, SHED или REJECTED. На REJECTED вызывающий код
+            должен ответить 429, чтобы Telegram повторил доставку.
+        """
+        item = (update_data, time.monotonic())
+
+        if self.overflow_policy == 'delay':
+            acquired = self._capacity.acquire(timeout=self.enqueue_timeout)
+        else:
+            acquired = self._capacity.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                if self.overflow_policy == 'shed':
+                    self.shed += 1
+                    logger.warning(f"⚠️ Очередь обновлений переполнена, обновление отброшено (всего: {self.shed})")
+                    return SHED
+                self.rejected += 1
+            logger.warning(f"⚠️ Очередь обновлений переполнена, ответ 429 (всего: {self.rejected})")
+            return REJECTED
+
+        with self._lock:
+            self.accepted += 1
+            self._waiting += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._waiting)
+        self._queue.put(item)
+        return ACCEPTED
+
+    def _key_of(self, update_data) -> Optional[Hashable]:
+        if self.key is None:
+            return None
+        try:
+            return self.key(update_data)
+        except Exception:
+            return None
+
+    def _worker_loop(self):
+        """Цикл воркера: берет обновления из очереди и обрабатывает их"""
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            key = self._key_of(item[0])
+            if key is not None:
+                with self._lock:
+                    backlog = self._active.get(key)
+                    if backlog is not None:
+                        # Чат обрабатывается другим воркером: он выполнит и это обновление
+                        backlog.append(item)
+                        self.deferred += 1
+                    else:
+                        self._active[key] = deque()
+                if backlog is not None:
+                    self._queue.task_done()
+                    continue
+
+            try:
+                while True:
+                    self._process(*item)
+                    if key is None:
+                        break
+                    with self._lock:
+                        backlog = self._active[key]
+                        if not backlog:
+                            del self._active[key]
+                            break
+                        item = backlog.popleft()
+            finally:
+                self._queue.task_done()
+
+    def _process(self, update_data, enqueued_at: float):
+        """Обработка одного обновления с учетом статистики"""
+        started_at = time.monotonic()
+        with self._lock:
+            self._waiting -= 1
+            self.busy_workers += 1
+            self._wait_time += started_at - enqueued_at
+        self._capacity.release()
+
+        try:
+            self.handler(update_data)
+            failed = False
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки обновления в воркере: {e}")
+            failed = True
+        finally:
+            with self._lock:
+                self.busy_workers -= 1
+                self._busy_time += time.monotonic() - started_at
+                if failed:
+                    self.failed += 1
+                else:
+                    self.processed += 1
+
+    def get_stats(self) -> dict:
+        """Получение счетчиков для подбора размера пула"""
+        with self._lock:
+            uptime = time.monotonic() - self.start_time if self.start_time else 0
+            finished = self.processed + self.failed
+            capacity = uptime * self.workers
+
+            return {
+                'running': self.is_running,
+                'workers': self.workers,
+                'busy_workers': self.busy_workers,
+                'worker_utilization': round(self._busy_time / capacity, 4) if capacity > 0 else 0,
+                'queue_size': self.queue_size,
+                'queue_depth': self._waiting,
+                'active_keys': len(self._active),
+                'deferred': self.deferred,
+                'max_queue_depth': self.max_queue_depth,
+                'overflow_policy': self.overflow_policy,
+                'accepted': self.accepted,
+                'shed': self.shed,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'failed': self.failed,
+                'avg_queue_wait_ms': round(self._wait_time / finished * 1000, 1) if finished else 0,
+                'avg_processing_ms': round(self._busy_time / finished * 1000, 1) if finished else 0
+            }
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пул постоянных HTTPS соединений для внешних API (Telegram, OpenAI)
+
+Вместо нового TLS рукопожатия на каждый запрос соединения переиспользуются
+через HTTP keep-alive. Для каждого хоста создается отдельный пул с
+ограничением одновременных запросов и вытеснением простаивающих соединений.
+
+Использует только стандартную библиотеку Python.
+"""
+
+import http.client
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, которые возникают при попытке использовать соединение,
+# уже закрытое сервером по таймауту keep-alive
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+    ConnectionAbortedError,
+)
+
+
+class PoolTimeout(Exception):
+    """Не удалось дождаться свободного соединения в пуле"""
+
+
+class PooledResponse:
+    """Полностью прочитанный HTTP ответ"""
+
+    def __init__(self, status, headers, data: bytes):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def text(self) -> str:
+        return self.data.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text())
+
+
+class HTTPSConnectionPool:
+    """
+    Потокобезопасный пул keep-alive соединений к одному хосту
+    """
+
+    def __init__(self, host: str, port: int = 443, max_connections: Optional[int] = None,
+                 idle_timeout: Optional[float] = None, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        # Настройки из переменных окружения
+        self.max_connections = max_connections or int(os.getenv('HTTP_POOL_MAX_CONNECTIONS', '10'))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(
+            os.getenv('HTTP_POOL_IDLE_TIMEOUT', '60'))
+
+        self._ssl_context = ssl.create_default_context()
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._lock = threading.Lock()
+        # Простаивающие соединения: (соединение, время освобождения)
+        self._idle = []
+
+        # Статистика
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.connections_evicted = 0
+        self.stale_retries = 0
+        self.errors = 0
+        self.in_use = 0
+
+    def _new_connection(self) -> http.client.HTTPSConnection:
+        with self._lock:
+            self.connections_created += 1
+        return http.client.HTTPSConnection(
+            self.host, self.port, timeout=self.timeout, context=self._ssl_context
+        )
+
+    def _evict_idle_locked(self):
+        """Закрытие соединений, простаивающих дольше idle_timeout"""
+        now = time.monotonic()
+        alive = []
+        for conn, released_at in self._idle:
+            if now - released_at > self.idle_timeout:
+                conn.close()
+                self.connections_evicted += 1
+            else:
+                alive.append((conn, released_at))
+        self._idle = alive
+
+    def evict_idle(self):
+        """Принудительное вытеснение простаивающих соединений"""
+        with self._lock:
+            self._evict_idle_locked()
+
+    def _checkout(self, wait_timeout: float):
+        if not self._slots.acquire(timeout=wait_timeout):
+            raise PoolTimeout(f"Нет свободных соединений к {self.host} (лимит {self.max_connections})")
+
+        with self._lock:
+            self.in_use += 1
+            self._evict_idle_locked()
+            if self._idle:
+                # LIFO: самое свежее соединение с наименьшим шансом закрытия сервером
+                conn, _ = self._idle.pop()
+                self.connections_reused += 1
+                return conn, True
+
+        return self._new_connection(), False
+
+    def _checkin(self, conn, reusable: bool):
+        with self._lock:
+            self.in_use -= 1
+            if reusable:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                conn.close()
+        self._slots.release()
+
+    @contextmanager
+    def stream(self, method: str, path: str, body: Optional[bytes] = None,
+               headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None):
+        """
+        Выполнение запроса с потоковым чтением ответа
+
+        Соединение возвращается в пул только если ответ прочитан полностью.
+        """
+        timeout = timeout or self.timeout
+        conn, reused = self._checkout(wait_timeout=timeout)
+        with self._lock:
+            self.requests += 1
+
+        response = None
+        try:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # Сервер закрыл соединение, пока оно простаивало: повтор на новом
+                conn.close()
+                with self._lock:
+                    self.stale_retries += 1
+                conn = self._new_connection()
+                conn.timeout = timeout
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+
+            yield response
+        except BaseException as e:
+            # Включая GeneratorExit, если потребитель бросил чтение на середине
+            if isinstance(e, Exception):
+                with self._lock:
+                    self.errors += 1
+            self._checkin(conn, reusable=False)
+            raise
+        else:
+            reusable = response.isclosed() and not response.will_close
+            self._checkin(conn, reusable=reusable)
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None) -> PooledResponse:
+        """Выполнение запроса с полным чтением ответа"""
+        with self.stream(method, path, body=body, headers=headers, timeout=timeout) as response:
+            data = response.read()
+            return PooledResponse(response.status, response.headers, data)
+
+    def get_stats(self) -> dict:
+        """Статистика переиспользования соединений"""
+        with self._lock:
+            return {
+                'host': self.host,
+                'max_connections': self.max_connections,
+                'in_use': self.in_use,
+                'idle': len(self._idle),
+                'requests': self.requests,
+                'connections_created': self.connections_created,
+                'connections_reused': self.connections_reused,
+                'connections_evicted': self.connections_evicted,
+                'stale_retries': self.stale_retries,
+                'errors': self.errors,
+                'reuse_ratio': round(self.connections_reused / self.requests, 4) if self.requests else 0
+            }
+
+    def close(self):
+        """Закрытие всех простаивающих соединений"""
+        with self._lock:
+            for conn, _ in self._idle:
+                conn.close()
+            self._idle = []
+
+
+# Общие пулы по хостам
+_pools: Dict[str, HTTPSConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host: str) -> HTTPSConnectionPool:
+    """Получение общего пула соединений для хоста"""
+    with _pools_lock:
+        pool = _pools.get(host)
+        if pool is None:
+            pool = HTTPSConnectionPool(host)
+            _pools[host] = pool
+        return pool
+
+
+def get_pool_stats() -> dict:
+    """Статистика всех пулов соединений"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.host: pool.get_stats() for pool in pools}
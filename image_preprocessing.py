@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Предобработка изображений перед OCR
+
+Изображение сразу переводится в оттенки серого, поэтому контраст и резкость
+считаются по одному каналу вместо трех. При наличии NumPy контраст и резкость
+выполняются за один проход по полосам строк: контраст - таблица на 256
+значений, резкость - сумма окна 3x3 с ядром ImageFilter.SMOOTH. Округление,
+обрезка до 0..255 после контраста и несглаженные края повторяют PIL, так что
+результат совпадает с цепочкой ImageEnhance.Contrast и ImageEnhance.Sharpness.
+
+Масштаб выбирается по оценке высоты строки текста (горизонтальная проекция
+темных пикселей): крупные фото уменьшаются до остальных шагов, мелкий текст
+увеличивается в конце. Если высоту оценить не удалось, мелкие изображения
+увеличиваются до min_side, как раньше.
+
+Профили качества:
+- fast: только контраст, билинейное масштабирование
+- balanced: контраст, резкость, медианный фильтр, LANCZOS (как раньше)
+- quality: balanced с растяжением гистограммы и большим целевым размером
+"""
+
+import os
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+from loguru import logger
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+PROFILES: Dict[str, Dict] = {
+    'fast': {
+        'autocontrast': False,
+        'contrast': 1.5,
+        'sharpness': 1.0,
+        'median_size': 0,
+        'min_side': 1000,
+        'text_height': 20,
+        'resample': Image.Resampling.BILINEAR,
+    },
+    'balanced': {
+        'autocontrast': False,
+        'contrast': 1.5,
+        'sharpness': 2.0,
+        'median_size': 3,
+        'min_side': 1000,
+        'text_height': 24,
+        'resample': Image.Resampling.LANCZOS,
+    },
+    'quality': {
+        'autocontrast': True,
+        'contrast': 1.5,
+        'sharpness': 2.0,
+        'median_size': 3,
+        'min_side': 1500,
+        'text_height': 32,
+        'resample': Image.Resampling.LANCZOS,
+    },
+}
+
+# Изменения масштаба меньше этого не выполняются
+_SCALE_TOLERANCE = (0.85, 1.2)
+_MIN_SCALE = 0.25
+_MAX_SCALE = 4.0
+
+
+def otsu_threshold(image: Image.Image) -> int:
+    """Порог бинаризации по методу Оцу из гистограммы серого изображения"""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    total_sum = sum(value * count for value, count in enumerate(histogram))
+
+    best_threshold, best_variance = 127, -1.0
+    background_count, background_sum = 0, 0
+    for value, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += value * count
+        background_mean = background_sum / background_count
+        foreground_mean = (total_sum - background_sum) / foreground_count
+        variance = background_count * foreground_count * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = value, variance
+    return best_threshold
+
+
+def estimate_text_height(image: Image.Image) -> Optional[float]:
+    """
+    Оценка высоты строки текста в пикселях по горизонтальной проекции
+
+    Изображение бинаризуется по Оцу и делится на вертикальные полосы
+    (так меньше сказывается наклон фото). В каждой полосе строки с
+    темными пикселями образуют отрезки, высота строки - медиана их длин.
+
+    Args:
+        image: Изображение в оттенках серого
+
+    Returns:
+        Высота строки или None, если строк текста не найдено
+    """
+    width, height = image.size
+    if width < 16 or height < 16:
+        return None
+
+    # Для крупных фото точности уменьшенной вдвое копии достаточно
+    factor = 2 if width * height > 4000000 else 1
+    if factor > 1:
+        image = image.reduce(factor)
+        width, height = image.size
+
+    threshold = otsu_threshold(image)
+    ink = image.point([255 if value <= threshold else 0 for value in range(256)])
+
+    # Текст занимает меньшую часть изображения: иначе это светлый текст на темном фоне
+    columns = max(1, min(8, width // 300))
+    profile = ink.resize((columns, height), Image.Resampling.BOX)
+    if sum(profile.getdata()) > 255 * columns * height / 2:
+        profile = profile.point(lambda value: 255 - value)
+
+    data = list(profile.getdata())
+    runs = []
+    for column in range(columns):
+        row_ink = data[column::columns]
+        peak = max(row_ink)
+        if peak == 0:
+            continue
+        # Строка считается текстовой, если в ней заметная доля темных пикселей
+        level = max(3, peak * 0.1)
+        run = 0
+        for value in row_ink + [0]:
+            if value > level:
+                run += 1
+            elif run:
+                if 4 <= run <= height / 4:
+                    runs.append(run)
+                run = 0
+
+    if len(runs) < 3:
+        return None
+    runs.sort()
+    return float(runs[len(runs) // 2] * factor)
+
+
+# Вес центрального пикселя и сумма весов ядра ImageFilter.SMOOTH
+_SMOOTH_CENTER = 5
+_SMOOTH_TOTAL = 13
+
+# Высота полосы строк: временные массивы занимают память только на полосу
+_STRIPE_ROWS = 256
+
+
+def _smooth_sum(source: 'np.ndarray', top: int, bottom: int, width: int) -> 'np.ndarray':
+    """
+    Взвешенная сумма окна 3x3 (ядро SMOOTH без деления)
+
+    Строка i результата - окно с центром в source[top + i + 1], столбец j -
+    с центром в столбце j + 1 (source шире результата на пиксель с каждой стороны).
+    """
+    acc = np.zeros((bottom - top, width), dtype=np.uint16)
+    for dy in range(3):
+        for dx in range(3):
+            np.add(acc, source[top + dy:bottom + dy, dx:dx + width], out=acc)
+    # Центр уже учтен с весом 1
+    center = source[top + 1:bottom + 1, 1:width + 1]
+    for _ in range(_SMOOTH_CENTER - 1):
+        np.add(acc, center, out=acc)
+    return acc
+
+
+class ImagePreprocessor:
+    """
+    Конвейер предобработки из последовательных шагов
+
+    Каждый шаг принимает и возвращает PIL изображение, поэтому шаги можно
+    выполнять и замерять по отдельности (см. bench_preprocessing.py).
+    """
+
+    def __init__(self, profile: str = None):
+        profile = (profile or os.getenv('OCR_PREPROCESS_PROFILE', 'balanced')).lower()
+        if profile not in PROFILES:
+            logger.warning(f"Неизвестный профиль предобработки {profile}, используется balanced")
+            profile = 'balanced'
+        self.profile = profile
+        self.settings = PROFILES[profile]
+        
+        # Масштабирование по высоте строки и ограничение размера изображения
+        self.adaptive_resize = os.getenv('OCR_ADAPTIVE_RESIZE', 'true').lower() == 'true'
+        self.text_height = float(os.getenv('OCR_TARGET_TEXT_HEIGHT', '0')) or self.settings['text_height']
+        self.max_pixels = int(os.getenv('OCR_MAX_PIXELS', '12000000'))
+
+    def steps(self) -> List[Tuple[str, Callable[[Image.Image], Image.Image]]]:
+        """Шаги конвейера для текущего профиля"""
+        settings = self.settings
+        steps = [('grayscale', self.to_grayscale)]
+        if self.adaptive_resize:
+            # Уменьшение до остальных шагов, чтобы они обрабатывали меньше пикселей
+            steps.append(('downscale', self.downscale))
+        if settings['autocontrast']:
+            steps.append(('autocontrast', self.autocontrast))
+        steps.append(('contrast_sharpness', self.enhance))
+        if settings['median_size']:
+            steps.append(('median', self.median))
+        steps.append(('resize', self.resize))
+        return steps
+
+    def process(self, image: Image.Image) -> Image.Image:
+        for _, step in self.steps():
+            image = step(image)
+        return image
+
+    @staticmethod
+    def to_grayscale(image: Image.Image) -> Image.Image:
+        """Перевод в оттенки серого до всех остальных операций"""
+        if image.mode == 'L':
+            return image
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        return image.convert('L')
+
+    @staticmethod
+    def autocontrast(image: Image.Image) -> Image.Image:
+        """Растяжение гистограммы с отсечением 1% крайних значений"""
+        return ImageOps.autocontrast(image, cutoff=1)
+
+    def enhance(self, image: Image.Image) -> Image.Image:
+        """Контраст и резкость одним проходом"""
+        contrast = self.settings['contrast']
+        sharpness = self.settings['sharpness']
+
+        if not NUMPY_AVAILABLE:
+            if contrast != 1.0:
+                image = ImageEnhance.Contrast(image).enhance(contrast)
+            if sharpness != 1.0:
+                image = ImageEnhance.Sharpness(image).enhance(sharpness)
+            return image
+
+        pixels = np.asarray(image, dtype=np.uint8)
+        # Среднее как у ImageEnhance.Contrast
+        mean = int(pixels.mean() + 0.5)
+
+        # Контраст: y = mean + c * (x - mean), как Image.blend - с обрезкой до 0..255
+        # и отбрасыванием дробной части; для 8 бит это таблица на 256 значений
+        levels = np.arange(256, dtype=np.float32)
+        lut = np.clip(np.float32(mean) + np.float32(contrast) * (levels - np.float32(mean)), 0, 255)
+        contrasted = lut.astype(np.uint8)[pixels]
+        height, width = contrasted.shape
+        if sharpness == 1.0 or height < 3 or width < 3:
+            return Image.fromarray(contrasted, mode='L')
+
+        # Резкость: z = smooth(y) + s * (y - smooth(y)); крайние строки и столбцы
+        # фильтр PIL не сглаживает, поэтому они остаются равными y
+        output = contrasted.copy()
+        factor = np.float32(sharpness)
+        for top in range(1, height - 1, _STRIPE_ROWS):
+            bottom = min(height - 1, top + _STRIPE_ROWS)
+            # Округление суммы окна до целого, как у ImageFilter.SMOOTH
+            smooth = _smooth_sum(contrasted, top - 1, bottom - 1, width - 2)
+            smooth = ((smooth.astype(np.int32) * 2 + _SMOOTH_TOTAL) // (2 * _SMOOTH_TOTAL)).astype(np.float32)
+            stripe = contrasted[top:bottom, 1:width - 1] - smooth
+            stripe *= factor
+            stripe += smooth
+            np.clip(stripe, 0, 255, out=stripe)
+            output[top:bottom, 1:width - 1] = stripe
+
+        return Image.fromarray(output, mode='L')
+
+    def median(self, image: Image.Image) -> Image.Image:
+        """Подавление шума медианным фильтром"""
+        return image.filter(ImageFilter.MedianFilter(self.settings['median_size']))
+
+    def target_scale(self, image: Image.Image) -> float:
+        """Коэффициент масштабирования, при котором строка текста имеет высоту text_height"""
+        width, height = image.size
+        estimated = estimate_text_height(image) if self.adaptive_resize else None
+
+        if estimated:
+            scale = min(_MAX_SCALE, max(_MIN_SCALE, self.text_height / estimated))
+            if _SCALE_TOLERANCE[0] <= scale <= _SCALE_TOLERANCE[1]:
+                scale = 1.0
+        else:
+            min_side = self.settings['min_side']
+            scale = max(min_side / width, min_side / height) if width < min_side or height < min_side else 1.0
+
+        if self.adaptive_resize and width * height * scale * scale > self.max_pixels:
+            scale = (self.max_pixels / (width * height)) ** 0.5
+        return scale
+
+    def _scale(self, image: Image.Image, scale: float) -> Image.Image:
+        width, height = image.size
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        logger.info(f"Масштабирование изображения {image.size} -> {size}")
+        # reducing_gap ускоряет сильное уменьшение почти без потери качества
+        return image.resize(size, self.settings['resample'], reducing_gap=2.0 if scale < 1 else None)
+
+    def downscale(self, image: Image.Image) -> Image.Image:
+        """Уменьшение крупного текста и слишком больших фото"""
+        scale = self.target_scale(image)
+        return self._scale(image, scale) if scale < 1 else image
+
+    def resize(self, image: Image.Image) -> Image.Image:
+        """Увеличение мелкого текста для лучшего распознавания"""
+        scale = self.target_scale(image)
+        return self._scale(image, scale) if scale > 1 else image
@@ -0,0 +1,281 @@
+import re
+import unicodedata
+from typing import Optional, Dict
+
+# Названия языков на русском, как их возвращает OpenAIHandler.detect_language
+LANGUAGE_NAMES = {
+    'ru': 'русский',
+    'en': 'английский',
+    'de': 'немецкий',
+    'fr': 'французский',
+    'es': 'испанский',
+    'it': 'итальянский',
+    'pt': 'португальский',
+    'zh': 'китайский',
+    'ja': 'японский',
+    'ko': 'корейский',
+    'ar': 'арабский',
+    'tr': 'турецкий',
+    'pl': 'польский',
+    'uk': 'украинский',
+    'cs': 'чешский',
+    'nl': 'голландский',
+    'sv': 'шведский',
+    'no': 'норвежский',
+    'da': 'датский',
+    'fi': 'финский',
+    'el': 'греческий',
+    'hu': 'венгерский',
+    'ro': 'румынский',
+    'bg': 'болгарский',
+    'hr': 'хорватский',
+    'sk': 'словацкий',
+    'sl': 'словенский',
+    'et': 'эстонский',
+    'lv': 'латвийский',
+    'lt': 'литовский'
+}
+
+# Частые служебные слова языков на латинице и кириллице
+STOPWORDS = {
+    'en': 'the and is are of to in that it you for with this was have not be on your what my i',
+    'de': 'der die und das ist nicht ich sie es ein eine mit zu den von auf für auch wir sind danke',
+    'fr': 'le la les et est des un une du pour dans que qui pas vous nous je sur avec au merci',
+    'es': 'el la los las y es de que en un una por para con no del se está muy gracias hola',
+    'it': 'il la che e di è un una per non sono con del della gli le mi ho questo grazie ciao',
+    'pt': 'o a os as e é de que não um uma para com do da em você obrigado está muito olá',
+    'tr': 've bir bu da de için ile ne çok mi ben sen var yok değil olarak gibi teşekkür merhaba nasıl',
+    'pl': 'i w nie się na jest to że z do jak co ale tak dla czy jestem dziękuję bardzo mam',
+    'cs': 'a je se na v že to s z do jak ale jsem není pro co děkuji velmi tak mám kde jsou nebo jen když',
+    'sk': 'a je sa na v že to s z do ako ale som nie pre čo ďakujem veľmi tak mám kde sú alebo len keď',
+    'nl': 'de het een en is van ik niet dat je op te met voor zijn wat maar ook bedankt hoe',
+    'sv': 'och att det är en som på jag inte med för har de av till den du tack vad hur',
+    'no': 'og i det er en som på jeg ikke med for har av til den du takk hva hvordan meg deg vår noen ble',
+    'da': 'og i det er en som på jeg ikke med for har af til den du tak hvad hvordan mig dig vores nogle blev',
+    'fi': 'ja on ei se että hän minä sinä mitä kuin mutta tämä ovat oli kiitos hyvää kanssa myös niin olen',
+    'hu': 'a az és egy hogy nem van is meg de ez én te mi köszönöm nagyon vagy csak már szia',
+    'ro': 'și de la în un o este nu că pe cu să pentru mai din sunt mulțumesc ce foarte bună',
+    'hr': 'i je u na da se za su od ne što kako sam ali to hvala vrlo bio ili mi',
+    'sl': 'in je v na da se za so od ne kaj kako sem ampak to hvala zelo bil ali mi',
+    'et': 'ja on ei et see ma sa mis kui aga oli olen tänan väga ka kas siin seda nii ning teid meie kus',
+    'lv': 'un ir ar ka uz no par kas es tu bet vai nav paldies ļoti lai to šis arī kā',
+    'lt': 'ir yra su kad į iš ne tai aš tu bet ar kaip ačiū labai jis jau dar o kur',
+    'ru': 'и в не на что я с он как это по но вы мне меня так все уже только привет спасибо есть',
+    'uk': 'і в не на що я з він як це по але ви мені мене так все вже тільки привіт дякую є та',
+    'bg': 'и в не на че аз с той как това по но вие ви ми мен така всички вече само здравей благодаря е са ще къде се за'
+}
+
+# Характерные буквы: 3 - встречается только в этом языке из списка, 1 - в нескольких
+CHAR_WEIGHTS = {
+    'de': {'ß': 3, 'ä': 1, 'ö': 1, 'ü': 1},
+    'fr': {'ç': 1, 'è': 1, 'ê': 2, 'à': 1, 'ù': 1, 'œ': 3, 'â': 1, 'î': 1, 'û': 2, 'ë': 2, 'ï': 2, 'é': 1},
+    'es': {'ñ': 3, '¿': 3, '¡': 3, 'á': 1, 'í': 1, 'ó': 1, 'ú': 1, 'é': 1},
+    'it': {'à': 1, 'è': 1, 'ì': 3, 'ò': 3, 'ù': 1, 'é': 1},
+    'pt': {'ã': 3, 'õ': 1, 'ç': 1, 'á': 1, 'â': 1, 'ê': 1, 'ô': 1},
+    'tr': {'ğ': 3, 'ı': 3, 'ş': 1, 'ç': 1, 'ö': 1, 'ü': 1},
+    'pl': {'ł': 3, 'ś': 3, 'ź': 3, 'ż': 3, 'ń': 3, 'ć': 1, 'ą': 1, 'ę': 1, 'ó': 1},
+    'cs': {'ě': 3, 'ř': 3, 'ů': 3, 'č': 1, 'š': 1, 'ž': 1, 'ý': 1, 'ň': 1, 'ť': 1, 'ď': 1, 'í': 1, 'á': 1, 'é': 1, 'ú': 1},
+    'sk': {'ľ': 3, 'ĺ': 3, 'ŕ': 3, 'ô': 1, 'ä': 1, 'č': 1, 'š': 1, 'ž': 1, 'ý': 1, 'ň': 1, 'ť': 1, 'ď': 1, 'í': 1, 'á': 1, 'é': 1, 'ú': 1},
+    'sv': {'å': 1, 'ä': 1, 'ö': 1},
+    'no': {'æ': 1, 'ø': 1, 'å': 1},
+    'da': {'æ': 1, 'ø': 1, 'å': 1},
+    'fi': {'ä': 1, 'ö': 1},
+    'hu': {'ő': 3, 'ű': 3, 'á': 1, 'é': 1, 'í': 1, 'ó': 1, 'ö': 1, 'ü': 1, 'ú': 1},
+    'ro': {'ă': 3, 'ș': 3, 'ț': 3, 'ş': 1, 'ţ': 3, 'â': 1, 'î': 1},
+    'hr': {'đ': 3, 'ć': 1, 'č': 1, 'š': 1, 'ž': 1},
+    'sl': {'č': 1, 'š': 1, 'ž': 1},
+    'et': {'õ': 1, 'ä': 1, 'ö': 1, 'ü': 1, 'š': 1, 'ž': 1},
+    'lv': {'ā': 3, 'ē': 3, 'ī': 3, 'ģ': 3, 'ķ': 3, 'ļ': 3, 'ņ': 3, 'ū': 1, 'č': 1, 'š': 1, 'ž': 1},
+    'lt': {'ė': 3, 'į': 3, 'ų': 3, 'ą': 1, 'ę': 1, 'ū': 1, 'č': 1, 'š': 1, 'ž': 1},
+    'ru': {'ы': 2, 'э': 2, 'ё': 3, 'ъ': 0.5},
+    'uk': {'і': 3, 'ї': 3, 'є': 3, 'ґ': 3},
+    'bg': {'ъ': 1.5}
+}
+
+# Характерные окончания слов
+SUFFIXES = {
+    'en': 'ing tion ly ed ould',
+    'de': 'ung keit heit lich chen schaft',
+    'fr': 'tion ment eux aux eau oir ée',
+    'es': 'ción mente dad ado ida os',
+    'it': 'zione mente tà ato etto are',
+    'pt': 'ção ções mente dade inho ão',
+    'tr': 'lar ler lık lik siniz sınız iz ız',
+    'pl': 'ość ście ego ych ać',
+    'cs': 'ost ího ých ová ení ít',
+    'sk': 'osť ého ých ová enie ia',
+    'nl': 'ijk heid lijk aan en',
+    'sv': 'tion het ning are arna erna',
+    'no': 'sjon het ene ikk',
+    'da': 'tion hed ene else',
+    'fi': 'nen ssa ssä sta stä lla llä kin',
+    'hu': 'ság ség ban ben nak nek ból ből ott ett',
+    'ro': 'ului ilor ție ească ul',
+    'hr': 'ija nje ti',
+    'sl': 'ija nje ti mo',
+    'et': 'ga st mine lik dele tele ile id',
+    'lv': 'ās ām ība šana',
+    'lt': 'as ai ių ius umas imas',
+    'ru': 'ость ение ого ать ться ами ых',
+    'uk': 'ість ння ого ати тися ами их',
+    'bg': 'ата ото ите ния ост ване'
+}
+
+LATIN_LANGUAGES = ('en', 'de', 'fr', 'es', 'it', 'pt', 'tr', 'pl', 'cs', 'sk', 'nl', 'sv',
+                   'no', 'da', 'fi', 'hu', 'ro', 'hr', 'sl', 'et', 'lv', 'lt')
+CYRILLIC_LANGUAGES = ('ru', 'uk', 'bg')
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def _script_of(char: str) -> Optional[str]:
+    """Письменность символа по диапазону Unicode"""
+    code = ord(char)
+    if code < 0x250:
+        return 'latin'
+    if 0x400 <= code <= 0x52F:
+        return 'cyrillic'
+    if 0x370 <= code <= 0x3FF or 0x1F00 <= code <= 0x1FFF:
+        return 'greek'
+    if 0x600 <= code <= 0x6FF or 0x750 <= code <= 0x77F or 0xFB50 <= code <= 0xFEFF:
+        return 'arabic'
+    if 0x3040 <= code <= 0x30FF or 0x31F0 <= code <= 0x31FF or 0xFF66 <= code <= 0xFF9F:
+        return 'kana'
+    if 0xAC00 <= code <= 0xD7AF or 0x1100 <= code <= 0x11FF or 0x3130 <= code <= 0x318F:
+        return 'hangul'
+    if 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0xF900 <= code <= 0xFAFF:
+        return 'han'
+    if 0x1E00 <= code <= 0x1EFF:
+        return 'latin'
+    return None
+
+
+class LanguageDetector:
+    """
+    Локальное определение языка без запросов к API
+
+    Сначала определяется письменность по диапазонам Unicode. Для языков
+    с уникальной письменностью (китайский, японский, корейский, арабский,
+    греческий) этого достаточно. Языки на латинице и кириллице различаются
+    по частым служебным словам и характерным буквам.
+    """
+
+    def __init__(self, max_chars: int = 1000):
+        self.max_chars = max_chars
+        # Индексы признак -> [(язык, вес)] отдельно для каждой письменности
+        self._indexes = {
+            'latin': self._build_index(LATIN_LANGUAGES),
+            'cyrillic': self._build_index(CYRILLIC_LANGUAGES)
+        }
+
+    @staticmethod
+    def _build_index(languages) -> Dict[str, Dict]:
+        words, chars, suffixes = {}, {}, {}
+        for lang in languages:
+            for word in STOPWORDS[lang].split():
+                # Однобуквенные слова встречаются во многих языках и весят меньше
+                words.setdefault(word, []).append((lang, 0.5 if len(word) == 1 else 1.0))
+            for char, weight in CHAR_WEIGHTS.get(lang, {}).items():
+                chars.setdefault(char, []).append((lang, weight))
+            for suffix in SUFFIXES.get(lang, '').split():
+                suffixes.setdefault(suffix, []).append((lang, 0.5))
+        return {
+            'languages': languages,
+            'words': words,
+            'chars': chars,
+            'suffixes': suffixes,
+            'suffix_lengths': sorted({len(suffix) for suffix in suffixes})
+        }
+
+    def detect(self, text: str) -> Optional[Dict]:
+        """
+        Определение языка текста
+
+        Args:
+            text: Текст для анализа
+
+        Returns:
+            Словарь с кодом, названием языка и уверенностью от 0 до 1,
+            или None если в тексте нет букв
+        """
+        if not text:
+            return None
+
+        text = unicodedata.normalize('NFC', text[:self.max_chars]).lower()
+
+        scripts = {}
+        letters = 0
+        for char in text:
+            if not char.isalpha():
+                continue
+            letters += 1
+            script = _script_of(char)
+            if script:
+                scripts[script] = scripts.get(script, 0) + 1
+
+        if not letters or not scripts:
+            return None
+
+        # Японский текст смешивает кану и иероглифы
+        if scripts.get('kana'):
+            scripts['kana'] += scripts.pop('han', 0)
+
+        script, script_count = max(scripts.items(), key=lambda item: item[1])
+        share = script_count / letters
+
+        if script in self._indexes:
+            code, confidence = self._score(text, self._indexes[script])
+        else:
+            code = {'kana': 'ja', 'hangul': 'ko', 'han': 'zh', 'arabic': 'ar', 'greek': 'el'}[script]
+            confidence = 1.0
+
+        if code is None:
+            return None
+
+        return {
+            'language_code': code,
+            'language_name': LANGUAGE_NAMES[code],
+            'confidence': round(confidence * share, 3),
+            'script': script
+        }
+
+    def _score(self, text: str, index: Dict) -> tuple:
+        """Выбор языка внутри одной письменности по словам, окончаниям и буквам"""
+        scores = dict.fromkeys(index['languages'], 0.0)
+        words, chars, suffixes = index['words'], index['chars'], index['suffixes']
+
+        for word in _WORD_RE.findall(text):
+            for lang, weight in words.get(word, ()):
+                scores[lang] += weight
+            for length in index['suffix_lengths']:
+                if len(word) > length:
+                    for lang, weight in suffixes.get(word[-length:], ()):
+                        scores[lang] += weight
+
+        for char in text:
+            for lang, weight in chars.get(char, ()):
+                scores[lang] += weight
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_lang, best = ranked[0]
+        second = ranked[1][1] if len(ranked) > 1 else 0.0
+
+        if best <= 0:
+            return None, 0.0
+
+        # Уверенность: отрыв от второго места с поправкой на количество признаков
+        margin = (best - second) / best
+        evidence = min(1.0, best / 3)
+        return best_lang, margin * evidence
+
+
+# Глобальный экземпляр детектора
+language_detector = None
+
+
+def get_language_detector() -> LanguageDetector:
+    """Получить глобальный экземпляр детектора языка"""
+    global language_detector
+    if language_detector is None:
+        language_detector = LanguageDetector()
+    return language_detector
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сборка альбомов Telegram (media_group_id) в одно обновление
+
+Каждое фото альбома приходит отдельным обновлением с общим media_group_id.
+Сообщения буферизуются, пока новые фото альбома приходят чаще чем раз в
+window секунд (но не дольше max_wait), и затем передаются обработчику
+одним списком.
+
+Использует только стандартную библиотеку Python.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# В альбоме Telegram не больше 10 элементов
+MAX_GROUP_SIZE = 10
+
+
+class MediaGroupAggregator:
+    """
+    Буфер сообщений альбомов с отложенной передачей обработчику
+    """
+
+    def __init__(self, on_group: Callable[[List[Dict]], None], window: Optional[float] = None,
+                 max_wait: Optional[float] = None):
+        self.on_group = on_group
+        self.window = window if window is not None else float(os.getenv('MEDIA_GROUP_WINDOW', '1.0'))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('MEDIA_GROUP_MAX_WAIT', '5.0'))
+
+        # (chat_id, media_group_id) -> {'messages', 'first_at', 'timer'}
+        self._groups: Dict[Tuple, Dict] = {}
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.groups = 0
+        self.messages = 0
+
+    def add(self, message: Dict):
+        """Добавление сообщения альбома в буфер"""
+        key = (message['chat']['id'], message['media_group_id'])
+        now = time.monotonic()
+
+        with self._lock:
+            self.messages += 1
+            group = self._groups.get(key)
+            if group is None:
+                group = {'messages': [], 'first_at': now, 'timer': None}
+                self._groups[key] = group
+                self.groups += 1
+            group['messages'].append(message)
+
+            if group['timer'] is not None:
+                group['timer'].cancel()
+
+            if len(group['messages']) >= MAX_GROUP_SIZE:
+                # Альбом полный, ждать больше нечего
+                delay = 0
+            else:
+                delay = min(self.window, max(0.0, group['first_at'] + self.max_wait - now))
+
+            timer = threading.Timer(delay, self._flush, args=(key,))
+            timer.daemon = True
+            group['timer'] = timer
+            timer.start()
+
+    def _flush(self, key: Tuple):
+        with self._lock:
+            group = self._groups.pop(key, None)
+        if group is None:
+            return
+
+        messages = sorted(group['messages'], key=lambda message: message.get('message_id', 0))
+        logger.info(f"📚 Альбом {key[1]} из чата {key[0]}: {len(messages)} фото")
+        try:
+            self.on_group(messages)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки альбома: {e}")
+
+    def flush_all(self):
+        """Немедленная передача всех буферизованных альбомов (при остановке)"""
+        with self._lock:
+            keys = list(self._groups)
+            for key in keys:
+                timer = self._groups[key]['timer']
+                if timer is not None:
+                    timer.cancel()
+        for key in keys:
+            self._flush(key)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'window': self.window,
+                'max_wait': self.max_wait,
+                'pending_groups': len(self._groups),
+                'groups': self.groups,
+                'messages': self.messages
+            }
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Выбор модели OpenAI, max_tokens и таймаута по типу задачи и размеру входа
+
+Определению языка хватает 50 токенов ответа и самой дешевой модели,
+короткий перевод и исправление OCR тоже справляются с mini моделью,
+а большая модель нужна только длинным документам. Правила маршрутизации
+задаются таблицей: для каждой задачи - список правил, из которых берется
+первое, в чей max_input_tokens помещается вход (последнее - без предела).
+
+По каждому маршруту (задача и модель) собираются задержка, токены и
+стоимость, чтобы по ним подбирать пороги.
+
+Правила отдельных задач можно заменить JSON в переменной OPENAI_ROUTES
+(остальные задачи сохраняют встроенные правила):
+    {"translate": [{"max_input_tokens": 1500, "model": "gpt-4o-mini",
+                    "max_tokens": 2000, "timeout": 30}, ...], ...}
+Некорректные правила пропускаются с ошибкой в логе.
+
+Использует только стандартную библиотеку Python.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from conversation_memory import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SMALL_MODEL = os.getenv('OPENAI_MODEL_SMALL') or os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+LARGE_MODEL = os.getenv('OPENAI_MODEL_LARGE', 'gpt-4o')
+VISION_MODEL = os.getenv('OPENAI_VISION_MODEL', 'gpt-4o')
+# Вход длиннее этого (в токенах) считается длинным документом
+LONG_INPUT_TOKENS = int(os.getenv('OPENAI_ROUTE_LONG_TOKENS', '1500'))
+
+# Цены за 1M токенов (вход, выход) в долларах; дополняются OPENAI_MODEL_PRICES
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4.1-nano': (0.10, 0.40),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+}
+
+
+def _rule(model: str, max_tokens: int, timeout: float, max_input_tokens: Optional[int] = None) -> Dict:
+    return {'max_input_tokens': max_input_tokens, 'model': model, 'max_tokens': max_tokens, 'timeout': timeout}
+
+
+DEFAULT_ROUTES = {
+    'detect_language': [_rule(SMALL_MODEL, 50, 10)],
+    'translate': [
+        _rule(SMALL_MODEL, 2000, 30, LONG_INPUT_TOKENS),
+        _rule(LARGE_MODEL, 4000, 90),
+    ],
+    'improve_ocr': [
+        _rule(SMALL_MODEL, 2000, 30, LONG_INPUT_TOKENS),
+        _rule(LARGE_MODEL, 4000, 90),
+    ],
+    'chat': [
+        _rule(SMALL_MODEL, 1000, 30, LONG_INPUT_TOKENS),
+        _rule(LARGE_MODEL, 1000, 60),
+    ],
+    'summary': [_rule(SMALL_MODEL, 300, 30)],
+    # max_tokens для изображения; для альбома умножается на число фото
+    'vision': [_rule(VISION_MODEL, 1000, 60)],
+}
+
+
+class ModelRouter:
+    """
+    Таблица маршрутов и метрики по каждому маршруту
+    """
+
+    def __init__(self, routes: Optional[Dict[str, List[Dict]]] = None):
+        self.routes = {task: list(rules) for task, rules in DEFAULT_ROUTES.items()}
+        self.prices = dict(MODEL_PRICES)
+
+        if routes is None:
+            routes = self._load_json('OPENAI_ROUTES') or {}
+        for task, rules in routes.items():
+            rules = self._parse_rules(task, rules)
+            if rules:
+                self.routes[task] = rules
+        for model, price in (self._load_json('OPENAI_MODEL_PRICES') or {}).items():
+            if (isinstance(price, list) and len(price) == 2
+                    and all(isinstance(value, (int, float)) for value in price)):
+                self.prices[model] = tuple(price)
+            else:
+                logger.error(f"❌ Некорректная цена модели {model} в OPENAI_MODEL_PRICES: {price}")
+
+        self._lock = threading.Lock()
+        # имя маршрута -> метрики
+        self._metrics: Dict[str, Dict] = {}
+
+    @staticmethod
+    def _load_json(name: str) -> Optional[Dict]:
+        value = os.getenv(name)
+        if not value:
+            return None
+        try:
+            data = json.loads(value)
+        except ValueError as e:
+            logger.error(f"❌ Некорректный JSON в {name}: {e}")
+            return None
+        if not isinstance(data, dict):
+            logger.error(f"❌ {name} должен быть JSON объектом")
+            return None
+        return data
+
+    @staticmethod
+    def _parse_rules(task: str, rules) -> List[Dict]:
+        """Проверка правил задачи из OPENAI_ROUTES, некорректные пропускаются"""
+        if not isinstance(rules, list):
+            logger.error(f"❌ OPENAI_ROUTES: правила задачи {task} должны быть списком")
+            return []
+        parsed = []
+        for rule in rules:
+            if (isinstance(rule, dict) and set(rule) <= {'max_input_tokens', 'model', 'max_tokens', 'timeout'}
+                    and isinstance(rule.get('model'), str) and rule['model']
+                    and isinstance(rule.get('max_tokens'), int) and rule['max_tokens'] > 0
+                    and isinstance(rule.get('timeout'), (int, float)) and rule['timeout'] > 0
+                    and (rule.get('max_input_tokens') is None or isinstance(rule['max_input_tokens'], int))):
+                parsed.append(_rule(**rule))
+            else:
+                logger.error(f"❌ OPENAI_ROUTES: некорректное правило задачи {task} пропущено: {rule}")
+        return parsed
+
+    def route(self, task: str, text: str = '', input_tokens: Optional[int] = None) -> Dict:
+        """
+        Маршрут для задачи
+
+        Args:
+            task: detect_language | translate | improve_ocr | chat | summary | vision
+            text: Входной текст (для оценки размера)
+            input_tokens: Размер входа, если уже известен
+
+        Returns:
+            {'name', 'task', 'model', 'max_tokens', 'timeout'}
+        """
+        if input_tokens is None:
+            input_tokens = estimate_tokens(text)
+        rules = self.routes.get(task) or self.routes['chat']
+        for rule in rules:
+            if rule['max_input_tokens'] is None or input_tokens <= rule['max_input_tokens']:
+                break
+        return {
+            'name': f"{task}:{rule['model']}",
+            'task': task,
+            'model': rule['model'],
+            'max_tokens': rule['max_tokens'],
+            'timeout': rule['timeout'],
+        }
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """Стоимость запроса в долларах (0, если цена модели неизвестна)"""
+        input_price, output_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+    def record(self, route: Dict, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+               success: bool = True):
+        """Учет выполненного запроса по маршруту"""
+        with self._lock:
+            metrics = self._metrics.get(route['name'])
+            if metrics is None:
+                metrics = {
+                    'requests': 0, 'errors': 0, 'total_latency': 0.0, 'latencies': deque(maxlen=500),
+                    'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0
+                }
+                self._metrics[route['name']] = metrics
+            metrics['requests'] += 1
+            if not success:
+                metrics['errors'] += 1
+            metrics['total_latency'] += latency
+            metrics['latencies'].append(latency)
+            metrics['prompt_tokens'] += prompt_tokens
+            metrics['completion_tokens'] += completion_tokens
+            metrics['cost'] += self.cost(route['model'], prompt_tokens, completion_tokens)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = {}
+            for name, metrics in self._metrics.items():
+                latencies = sorted(metrics['latencies'])
+                requests = metrics['requests']
+                stats[name] = {
+                    'requests': requests,
+                    'errors': metrics['errors'],
+                    'avg_latency': round(metrics['total_latency'] / requests, 3) if requests else 0,
+                    'p95_latency': round(latencies[int(len(latencies) * 0.95)], 3) if latencies else 0,
+                    'prompt_tokens': metrics['prompt_tokens'],
+                    'completion_tokens': metrics['completion_tokens'],
+                    'cost_usd': round(metrics['cost'], 6),
+                    'avg_cost_usd': round(metrics['cost'] / requests, 6) if requests else 0,
+                }
+            return stats
+
+
+# Глобальный экземпляр маршрутизатора
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    """Получение общего маршрутизатора моделей"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
@@ -0,0 +1,304 @@
+import os
+import io
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from PIL import Image
+from loguru import logger
+from typing import Optional, Dict, Tuple
+from cache import TTLCache, make_key
+
+
+class OCRCache:
+    """
+    Кэш результатов OCR: одно и то же фото не распознается повторно
+
+    Три уровня поиска:
+    1. Точное совпадение по SHA-256 байтов изображения в памяти процесса
+    2. То же в SQLite базе на диске (опционально), переживает перезапуск
+    3. Похожее изображение по перцептивному хэшу (опционально, по умолчанию
+       отключено): находит пережатые копии. Кандидаты ищутся по dHash 64 бита,
+       затем проверяются соотношение сторон и подробный dHash 32x32 (1024 бита).
+       Индекс хэшей хранится в памяти и при старте загружается из базы
+
+    Перцептивный хэш описывает раскладку страницы, а не текст: чеки одного
+    магазина с разными позициями дают одинаковый 64-битный dHash, а чек,
+    отличающийся только суммой, неотличим и по подробному. Поэтому третий
+    уровень включается только там, где это допустимо.
+    """
+
+    def __init__(self, namespace: str = '', db_path: Optional[str] = None):
+        self.enabled = os.getenv('OCR_CACHE_ENABLED', 'true').lower() == 'true'
+        self.ttl_seconds = int(os.getenv('OCR_CACHE_TTL', '604800'))  # 7 дней
+        max_bytes = int(os.getenv('OCR_CACHE_MAX_BYTES', '5242880'))  # 5MB
+        # Поиск похожих изображений по перцептивному хэшу
+        self.perceptual = os.getenv('OCR_CACHE_PERCEPTUAL', 'false').lower() == 'true'
+        # Максимум отличающихся бит dHash 64 бита для кандидата
+        self.max_distance = int(os.getenv('OCR_CACHE_PHASH_DISTANCE', '4'))
+        # Максимум отличающихся бит подробного dHash (из 1024) для совпадения
+        self.max_fine_distance = int(os.getenv('OCR_CACHE_FINE_DISTANCE', '8'))
+        # Допустимое относительное отличие соотношения сторон
+        self.max_aspect_difference = float(os.getenv('OCR_CACHE_ASPECT_TOLERANCE', '0.02'))
+        self.max_phash_entries = int(os.getenv('OCR_CACHE_PHASH_ENTRIES', '10000'))
+        self.db_path = db_path if db_path is not None else os.getenv('OCR_CACHE_DB', '')
+        # Настройки OCR, от которых зависит результат
+        self.namespace = namespace
+
+        self.results = TTLCache(max_bytes, self.ttl_seconds, name='ocr_results')
+        # ключ -> подпись изображения (dHash, подробный dHash, размер), в порядке последнего использования
+        self._phashes = OrderedDict()
+        self._phash_lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        # Статистика
+        self.exact_hits = 0
+        self.disk_hits = 0
+        self.perceptual_hits = 0
+        self.perceptual_rejects = 0
+        self.misses = 0
+
+        if self.enabled and self.db_path:
+            self._open_db()
+
+        logger.info(
+            f"Кэш OCR: {'включен' if self.enabled else 'отключен'}"
+            f"{', поиск похожих изображений' if self.enabled and self.perceptual else ''}"
+            f"{f', SQLite: {self.db_path}' if self._db else ''}"
+        )
+
+    def _open_db(self):
+        """Открытие SQLite базы и создание таблицы"""
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, phash TEXT, "
+                "result TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            # Последние записи с теми же настройками OCR - в индекс похожих изображений
+            rows = self._db.execute(
+                "SELECT key, phash FROM ocr_cache WHERE namespace = ? AND phash IS NOT NULL "
+                "AND created_at > ? ORDER BY created_at DESC LIMIT ?",
+                (self.namespace, time.time() - self.ttl_seconds, self.max_phash_entries)
+            ).fetchall()
+            for key, phash in reversed(rows):
+                signature = self.parse_signature(phash)
+                # Записи прежнего формата (только dHash 64 бита) не проверить, они пропускаются
+                if signature is not None:
+                    self._phashes[key] = signature
+        except Exception as e:
+            logger.error(f"Не удалось открыть базу кэша OCR {self.db_path}: {e}")
+            self._db = None
+
+    def make_key(self, image_data: bytes) -> str:
+        return make_key(self.namespace, hashlib.sha256(image_data).hexdigest())
+
+    @staticmethod
+    def _dhash(image: Image.Image, width: int, height: int) -> int:
+        """dHash: знаки разностей соседних пикселей копии (width+1)x(height)"""
+        pixels = image.resize((width + 1, height), Image.Resampling.BOX).tobytes()
+        value = 0
+        for row in range(height):
+            offset = row * (width + 1)
+            for column in range(width):
+                value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+        return value
+
+    @classmethod
+    def perceptual_hash(cls, image_data: bytes) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Подпись изображения: (dHash 8x8, dHash 32x32, ширина, высота)
+
+        Не меняется при пережатии JPEG. dHash 8x8 служит для быстрого
+        поиска кандидатов, подробный dHash и размер - для проверки.
+        """
+        try:
+            image = Image.open(io.BytesIO(image_data))
+            width, height = image.size
+            # Для JPEG декодирование сразу в уменьшенном размере
+            image.draft('L', (264, 256))
+            image = image.convert('L')
+            return cls._dhash(image, 8, 8), cls._dhash(image, 32, 32), width, height
+        except Exception as e:
+            logger.warning(f"Не удалось вычислить перцептивный хэш: {e}")
+            return None
+
+    @staticmethod
+    def format_signature(signature: Tuple[int, int, int, int]) -> str:
+        phash, fine, width, height = signature
+        return f"{phash:016x}:{fine:0256x}:{width}:{height}"
+
+    @staticmethod
+    def parse_signature(value: Optional[str]) -> Optional[Tuple[int, int, int, int]]:
+        try:
+            phash, fine, width, height = value.split(':')
+            return int(phash, 16), int(fine, 16), int(width), int(height)
+        except (AttributeError, ValueError):
+            return None
+
+    def _verify(self, signature: Tuple[int, int, int, int], other: Tuple[int, int, int, int]) -> Optional[int]:
+        """Расстояние подробного dHash, если изображения совпадают по проверке, иначе None"""
+        _, fine, width, height = signature
+        _, other_fine, other_width, other_height = other
+        aspect, other_aspect = width / height, other_width / other_height
+        if abs(aspect - other_aspect) > self.max_aspect_difference * max(aspect, other_aspect):
+            return None
+        distance = bin(fine ^ other_fine).count('1')
+        return distance if distance <= self.max_fine_distance else None
+
+    def lookup(self, key: str) -> Optional[Dict]:
+        """
+        Поиск по точному совпадению байтов
+
+        Returns:
+            Сохраненный результат OCR или None
+        """
+        if not self.enabled:
+            return None
+
+        result = self.results.get(key)
+        if result is not None:
+            self.exact_hits += 1
+        else:
+            result = self._db_get(key)
+            if result is None:
+                return None
+            self.disk_hits += 1
+            self.results.set(key, result)
+
+        self._touch_phash(key)
+        logger.info("Результат OCR найден в кэше")
+        return dict(result, cached=True)
+
+    def lookup_similar(self, signature: Optional[Tuple[int, int, int, int]]) -> Optional[Dict]:
+        """
+        Поиск похожего изображения по перцептивному хэшу
+
+        Кандидаты с близким dHash 8x8 принимаются, только если совпадают
+        соотношение сторон и подробный dHash.
+
+        Returns:
+            Результат OCR ближайшего изображения или None
+        """
+        if not self.enabled or not self.perceptual or signature is None:
+            self.misses += 1
+            return None
+
+        with self._phash_lock:
+            candidates = list(self._phashes.items())
+
+        phash = signature[0]
+        best_key, best_distance = None, self.max_fine_distance + 1
+        for key, other in candidates:
+            if bin(phash ^ other[0]).count('1') > self.max_distance:
+                continue
+            distance = self._verify(signature, other)
+            if distance is None:
+                self.perceptual_rejects += 1
+                continue
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+                if distance == 0:
+                    break
+
+        if best_key is not None:
+            result = self.results.get(best_key)
+            if result is None:
+                result = self._db_get(best_key)
+                if result is not None:
+                    self.results.set(best_key, result)
+            if result is not None:
+                self.perceptual_hits += 1
+                self._touch_phash(best_key)
+                logger.info(f"Результат OCR найден в кэше по похожему изображению (расстояние {best_distance} из 1024)")
+                return dict(result, cached=True)
+            # Запись вытеснена из кэша или устарела
+            with self._phash_lock:
+                self._phashes.pop(best_key, None)
+
+        self.misses += 1
+        return None
+
+    def store(self, key: str, signature: Optional[Tuple[int, int, int, int]], result: Dict):
+        """Сохранение успешного результата OCR"""
+        if not self.enabled or not result.get('success'):
+            return
+
+        self.results.set(key, result)
+        if signature is not None:
+            with self._phash_lock:
+                self._phashes[key] = signature
+                self._phashes.move_to_end(key)
+                while len(self._phashes) > self.max_phash_entries:
+                    self._phashes.popitem(last=False)
+        self._db_set(key, signature, result)
+
+    def _touch_phash(self, key: str):
+        with self._phash_lock:
+            if key in self._phashes:
+                self._phashes.move_to_end(key)
+
+    def _db_get(self, key: str) -> Optional[Dict]:
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT result, created_at FROM ocr_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row is None:
+                return None
+            result, created_at = row
+            if time.time() - created_at > self.ttl_seconds:
+                return None
+            return json.loads(result)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша OCR: {e}")
+            return None
+
+    def _db_set(self, key: str, signature: Optional[Tuple[int, int, int, int]], result: Dict):
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO ocr_cache (key, namespace, phash, result, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, self.namespace, self.format_signature(signature) if signature is not None else None,
+                     json.dumps(result, ensure_ascii=False), time.time())
+                )
+                self._db.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш OCR: {e}")
+
+    def get_stats(self) -> Dict:
+        """Статистика попаданий по уровням"""
+        hits = self.exact_hits + self.disk_hits + self.perceptual_hits
+        lookups = hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'exact_hits': self.exact_hits,
+            'disk_hits': self.disk_hits,
+            'perceptual_enabled': self.perceptual,
+            'perceptual_hits': self.perceptual_hits,
+            'perceptual_rejects': self.perceptual_rejects,
+            'misses': self.misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0,
+            'perceptual_entries': len(self._phashes),
+            'disk_enabled': self._db is not None,
+            'memory': self.results.get_stats()
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Движок выполнения OCR в пуле процессов
+
+Предобработка изображения (PIL) и распознавание (Tesseract) нагружают
+процессор и не должны выполняться в event loop: одно большое фото
+останавливало бы обработку всех остальных чатов. Задания выполняются
+в отдельных процессах, очередь ограничена, у каждого задания есть таймаут.
+"""
+
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from loguru import logger
+from typing import Dict, Optional
+
+
+class OCRQueueFull(Exception):
+    """Очередь заданий OCR переполнена"""
+
+
+class OCRTimeout(Exception):
+    """Задание OCR не уложилось в таймаут"""
+
+
+# Обработчик внутри процесса пула, создается один раз на процесс
+_worker_handler = None
+
+
+def _init_worker():
+    global _worker_handler
+    from ocr_handler import OCRHandler
+    _worker_handler = OCRHandler()
+
+
+def _run_job(image_data: bytes, timeout: float) -> Dict:
+    return _worker_handler.recognize(image_data, timeout=timeout)
+
+
+def _available_cpus() -> int:
+    """Число ядер, доступных процессу (с учетом affinity и cpuset контейнера)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def _pool_context():
+    """
+    Способ запуска процессов пула
+
+    fork из процесса с event loop и другими потоками копирует их блокировки
+    (например, обработчиков loguru) в захваченном состоянии, и процесс может
+    зависнуть. forkserver запускает процессы из чистого сервера.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class OCREngine:
+    """
+    Пул процессов для OCR с ограниченной очередью и таймаутами
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        # По умолчанию по одному процессу на доступное ядро
+        self.workers = workers or int(os.getenv('OCR_WORKERS', '0')) or _available_cpus()
+        self.queue_size = queue_size if queue_size is not None else int(os.getenv('OCR_QUEUE_SIZE', '10'))
+        self.timeout = timeout or float(os.getenv('OCR_TIMEOUT', '60'))
+
+        self._executor = None
+        self._lock = threading.Lock()
+        # Задания в очереди и в работе (включая продолжающие работу после таймаута)
+        self.pending = 0
+
+        # Статистика
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.total_processing_time = 0.0
+
+        logger.info(f"OCR движок: {self.workers} процессов, очередь {self.queue_size}, таймаут {self.timeout} с")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Ленивое создание пула, чтобы процессы не запускались при импорте"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     mp_context=_pool_context())
+            return self._executor
+
+    def _reset_executor(self):
+        """Пересоздание пула после аварийного завершения процесса"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        # Вне блокировки: отмена заданий вызывает _release
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future=None):
+        """Освобождение места в очереди, когда задание действительно завершилось"""
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, image_data: bytes) -> Dict:
+        """
+        Распознавание изображения в пуле процессов
+
+        Returns:
+            Словарь результата OCRHandler.recognize
+
+        Raises:
+            OCRQueueFull: все процессы заняты и очередь заполнена
+            OCRTimeout: задание не завершилось за timeout секунд
+        """
+        with self._lock:
+            if self.pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise OCRQueueFull(f"Очередь OCR заполнена ({self.pending} заданий)")
+            self.pending += 1
+            self.submitted += 1
+
+        start = time.monotonic()
+        try:
+            future = self._get_executor().submit(_run_job, image_data, self.timeout)
+        except BaseException:
+            self._release()
+            raise
+        # После таймаута процесс еще занят, поэтому место освобождается только по завершении задания
+        future.add_done_callback(self._release)
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            with self._lock:
+                self.completed += 1
+                self.total_processing_time += time.monotonic() - start
+            return result
+        except asyncio.TimeoutError:
+            # Задание из очереди снимается, запущенный Tesseract завершится по своему таймауту
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise OCRTimeout(f"OCR не завершился за {self.timeout} с")
+        except asyncio.CancelledError:
+            future.cancel()
+            with self._lock:
+                self.cancelled += 1
+            raise
+        except BrokenProcessPool:
+            logger.error("Процесс OCR аварийно завершился, пул будет пересоздан")
+            self._reset_executor()
+            with self._lock:
+                self.failed += 1
+            raise
+
+    def get_stats(self) -> Dict:
+        """Статистика очереди и заданий"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'pending': self.pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'cancelled': self.cancelled,
+                'failed': self.failed,
+                'avg_processing_time': round(self.total_processing_time / self.completed, 3) if self.completed else 0
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# Глобальный экземпляр движка
+ocr_engine = None
+
+
+def get_ocr_engine() -> OCREngine:
+    """Получить глобальный экземпляр OCR движка"""
+    global ocr_engine
+    if ocr_engine is None:
+        ocr_engine = OCREngine()
+    return ocr_engine
@@ -1,10 +1,65 @@
 import os
 import io
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
 import pytesseract
 from loguru import logger
 from typing import Optional, List, Tuple, Dict
 import re
+import asyncio
+from ocr_engine import get_ocr_engine, OCRQueueFull, OCRTimeout
+from image_preprocessing import ImagePreprocessor
+from ocr_cache import OCRCache
+
+# Встроенный API Tesseract (опционально): движок загружается один раз
+try:
+    from tesserocr import PyTessBaseAPI, PSM, OEM
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+# Символы, которые распознает Tesseract
+CHAR_WHITELIST = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyzАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя.,!?:;-+*/=()[]{}"№%$@#&<>|\\_ '
+
+class TesseractAPIPool:
+    """
+    Прогретые экземпляры Tesseract API, по одному на комбинацию языков
+    
+    В отличие от pytesseract не запускает процесс tesseract, не пишет
+    временные файлы и не загружает traineddata на каждое изображение.
+    Экземпляры принадлежат процессу, который их создал (процессу пула OCR).
+    """
+    
+    def __init__(self):
+        self.tessdata_path = os.getenv('TESSDATA_PREFIX', '')
+        self._apis = {}
+    
+    def get(self, lang: str):
+        api = self._apis.get(lang)
+        if api is None:
+            kwargs = {'lang': lang, 'psm': PSM.SINGLE_BLOCK, 'oem': OEM.DEFAULT}
+            if self.tessdata_path:
+                kwargs['path'] = self.tessdata_path
+            api = PyTessBaseAPI(**kwargs)
+            api.SetVariable('tessedit_char_whitelist', CHAR_WHITELIST)
+            self._apis[lang] = api
+            logger.info(f"Инициализирован Tesseract API для языков {lang}")
+        return api
+    
+    def image_to_string(self, image: Image.Image, lang: str, timeout: float = 0) -> str:
+        """Распознавание изображения из памяти"""
+        api = self.get(lang)
+        try:
+            api.SetImage(image)
+            if not api.Recognize(timeout=int(timeout * 1000)):
+                raise RuntimeError("Tesseract API: распознавание прервано по таймауту")
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+    
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis = {}
 
 class OCRHandler:
     def __init__(self):
@@ -14,7 +69,12 @@ class OCRHandler:
             pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
         
         # Используем только Tesseract для OCR
-        logger.info("Используется Tesseract OCR")
+        # auto - встроенный API при наличии tesserocr, иначе pytesseract
+        backend = os.getenv('OCR_BACKEND', 'auto').lower()
+        if backend == 'tesserocr' and not TESSEROCR_AVAILABLE:
+            logger.warning("OCR_BACKEND=tesserocr, но tesserocr не установлен, используется pytesseract")
+        self.tesseract_api = TesseractAPIPool() if backend != 'pytesseract' and TESSEROCR_AVAILABLE else None
+        logger.info(f"Используется Tesseract OCR ({'tesserocr' if self.tesseract_api else 'pytesseract'})")
         
         # Поддерживаемые форматы изображений
         self.supported_formats = ['jpg', 'jpeg', 'png', 'bmp', 'tiff', 'webp']
@@ -22,6 +82,13 @@ class OCRHandler:
         # Максимальный размер изображения (10MB)
         self.max_image_size = int(os.getenv('MAX_IMAGE_SIZE', 10485760))
         
+        # Конвейер предобработки (профиль OCR_PREPROCESS_PROFILE)
+        self.preprocessor = ImagePreprocessor()
+        
+        # Кэш результатов создается при первом распознавании,
+        # только в основном процессе (не в процессах пула OCR)
+        self._cache = None
+        
         logger.info("OCR обработчик инициализирован")
     
     def preprocess_image(self, image: Image.Image) -> Image.Image:
@@ -35,31 +102,8 @@ class OCRHandler:
             Обработанное изображение
         """
         try:
-            # Конвертация в RGB если необходимо
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Увеличение контрастности
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.5)
-            
-            # Увеличение резкости
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(2.0)
-            
-            # Конвертация в оттенки серого
-            image = image.convert('L')
-            
-            # Применение фильтра для уменьшения шума
-            image = image.filter(ImageFilter.MedianFilter())
-            
-            # Увеличение размера изображения для лучшего распознавания
-            width, height = image.size
-            if width < 1000 or height < 1000:
-                scale_factor = max(1000 / width, 1000 / height)
-                new_width = int(width * scale_factor)
-                new_height = int(height * scale_factor)
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            # Серый цвет, контраст и резкость, шумоподавление, масштабирование
+            image = self.preprocessor.process(image)
             
             logger.info("Изображение предварительно обработано")
             return image
@@ -68,13 +112,14 @@ class OCRHandler:
             logger.error(f"Ошибка при предварительной обработке изображения: {e}")
             return image
     
-    def extract_text_tesseract(self, image: Image.Image, lang: str = 'rus+eng') -> Optional[str]:
+    def extract_text_tesseract(self, image: Image.Image, lang: str = 'rus+eng', timeout: float = 0) -> Optional[str]:
         """
         Извлечение текста с помощью Tesseract OCR
         
         Args:
             image: PIL изображение
             lang: Языки для распознавания
+            timeout: Таймаут процесса Tesseract в секундах (0 - без ограничения)
         
         Returns:
             Распознанный текст или None
@@ -83,7 +128,10 @@ class OCRHandler:
             # Настройки Tesseract для лучшего распознавания
             custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyzАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя.,!?:;-+*/=()[]{}"№%$@#&<>|\\_ '
             
-            text = pytesseract.image_to_string(image, lang=lang, config=custom_config)
+            if self.tesseract_api is not None:
+                text = self.tesseract_api.image_to_string(image, lang, timeout=timeout)
+            else:
+                text = pytesseract.image_to_string(image, lang=lang, config=custom_config, timeout=timeout)
             
             if text.strip():
                 logger.info(f"Tesseract распознал текст длиной {len(text)} символов")
@@ -129,23 +177,90 @@ class OCRHandler:
         
         return text.strip()
     
+    @staticmethod
+    def _empty_result() -> Dict[str, any]:
+        return {
+            'success': False,
+            'text': None,
+            'method': None,
+            'confidence': 0,
+            'error': None
+        }
+    
+    @staticmethod
+    def _cache_lookup(cache: OCRCache, image_data: bytes) -> Tuple[str, Optional[Tuple[int, int, int, int]], Optional[Dict]]:
+        """Поиск в кэше OCR: (ключ, подпись изображения, результат или None)"""
+        key = cache.make_key(image_data)
+        cached = cache.lookup(key)
+        if cached is not None:
+            return key, None, cached
+        # Без поиска похожих lookup_similar только учитывает промах
+        signature = cache.perceptual_hash(image_data) if cache.perceptual else None
+        return key, signature, cache.lookup_similar(signature)
+    
     async def extract_text_from_image(self, image_data: bytes) -> Dict[str, any]:
         """
         Основной метод для извлечения текста из изображения
         
+        Распознавание выполняется в пуле процессов OCR движка,
+        event loop на это время не блокируется.
+        
         Args:
             image_data: Байты изображения
         
         Returns:
             Словарь с результатами распознавания
         """
-        result = {
-            'success': False,
-            'text': None,
-            'method': None,
-            'confidence': 0,
-            'error': None
-        }
+        result = self._empty_result()
+        
+        # Проверка размера до передачи байтов в другой процесс
+        if len(image_data) > self.max_image_size:
+            result['error'] = f"Размер изображения превышает максимальный ({self.max_image_size} байт)"
+            return result
+        
+        try:
+            cache = self.cache
+            # SHA-256, чтение SQLite и декодирование для перцептивного хэша - вне event loop
+            key, signature, cached = await asyncio.to_thread(self._cache_lookup, cache, image_data)
+            if cached is not None:
+                return cached
+            
+            result = await get_ocr_engine().run(image_data)
+            # Запись в SQLite (commit с fsync) тоже вне event loop
+            await asyncio.to_thread(cache.store, key, signature, result)
+            return result
+        except (OCRQueueFull, OCRTimeout) as e:
+            logger.warning(str(e))
+            result['error'] = str(e)
+            return result
+        except Exception as e:
+            error_msg = f"Ошибка при обработке изображения: {e}"
+            logger.error(error_msg)
+            result['error'] = error_msg
+            return result
+    
+    @property
+    def cache(self) -> OCRCache:
+        if self._cache is None:
+            # Результат зависит от профиля предобработки и движка Tesseract
+            backend = 'tesserocr' if self.tesseract_api else 'pytesseract'
+            self._cache = OCRCache(namespace=f"{self.preprocessor.profile}:{backend}")
+        return self._cache
+    
+    def recognize(self, image_data: bytes, timeout: float = 0) -> Dict[str, any]:
+        """
+        Синхронное распознавание: загрузка, предобработка, Tesseract, очистка
+        
+        Выполняется в процессе пула OCR движка.
+        
+        Args:
+            image_data: Байты изображения
+            timeout: Таймаут Tesseract в секундах (0 - без ограничения)
+        
+        Returns:
+            Словарь с результатами распознавания
+        """
+        result = self._empty_result()
         
         try:
             # Проверка размера файла
@@ -161,7 +276,7 @@ class OCRHandler:
             processed_image = self.preprocess_image(image)
             
             # Распознавание с помощью Tesseract
-            best_text = self.extract_text_tesseract(processed_image)
+            best_text = self.extract_text_tesseract(processed_image, timeout=timeout)
             best_method = 'Tesseract'
             
             if best_text:
@@ -1,24 +1,97 @@
 import os
+import json
+import time
+import asyncio
 import openai
 from loguru import logger
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Iterable, Awaitable
+from language_detector import get_language_detector
+from cache import make_key
+from singleflight import AsyncSingleFlight
+from model_router import get_model_router
+
+async def fan_out(items: Iterable[str], call: Callable[[str], Awaitable[Any]],
+                  concurrency: int, timeout: float) -> Dict[str, Any]:
+    """
+    Параллельный запуск call(item) для каждого элемента
+    
+    Args:
+        items: Элементы (например, целевые языки)
+        call: Асинхронная функция для одного элемента
+        concurrency: Максимум одновременных вызовов
+        timeout: Таймаут одного вызова в секундах
+    
+    Returns:
+        Словарь {элемент: результат или исключение} в порядке items
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    
+    async def run(item):
+        async with semaphore:
+            return await asyncio.wait_for(call(item), timeout)
+    
+    items = list(items)
+    results = await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+    return dict(zip(items, results))
 
 class OpenAIHandler:
     def __init__(self):
         self.api_key = os.getenv('OPENAI_API_KEY')
         self.model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+        # Модель, max_tokens и таймаут выбираются по задаче и размеру текста
+        self.router = get_model_router()
         
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY не найден в переменных окружения")
         
         openai.api_key = self.api_key
-        self.client = openai.OpenAI(api_key=self.api_key)
+        # Асинхронный клиент не блокирует event loop на время запроса
+        self.timeout = float(os.getenv('OPENAI_TIMEOUT', '60'))
+        self.client = openai.AsyncOpenAI(api_key=self.api_key, timeout=self.timeout)
+        
+        # Ограничение одновременных запросов к API из всех чатов
+        self.max_concurrency = int(os.getenv('OPENAI_MAX_CONCURRENCY', '8'))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Одинаковые одновременные переводы выполняются одним запросом
+        self.inflight = AsyncSingleFlight()
+        
+        # Параллельные переводы на несколько языков
+        self.fanout_concurrency = int(os.getenv('TRANSLATION_FANOUT_CONCURRENCY', '3'))
+        self.fanout_timeout = float(os.getenv('TRANSLATION_FANOUT_TIMEOUT', '30'))
+        
+        # Локальный детектор языка, API используется только при низкой уверенности
+        self.language_detector = get_language_detector()
+        self.language_detection_threshold = float(os.getenv('LANGUAGE_DETECTION_THRESHOLD', '0.5'))
         logger.info(f"OpenAI клиент инициализирован с моделью: {self.model}")
     
+    async def _create_completion(self, task: str, text: str, **kwargs):
+        """
+        Запрос chat completion с ограничением числа одновременных запросов
+        
+        Модель, max_tokens и таймаут берутся из маршрута задачи task
+        для входного текста text; задержка и токены учитываются по маршруту.
+        """
+        route = self.router.route(task, text)
+        async with self._semaphore:
+            started_at = time.monotonic()
+            try:
+                response = await self.client.chat.completions.create(
+                    model=route['model'], max_tokens=route['max_tokens'], timeout=route['timeout'], **kwargs
+                )
+            except Exception:
+                self.router.record(route, time.monotonic() - started_at, success=False)
+                raise
+        usage = getattr(response, 'usage', None)
+        self.router.record(route, time.monotonic() - started_at,
+                           getattr(usage, 'prompt_tokens', 0) or 0, getattr(usage, 'completion_tokens', 0) or 0)
+        return response
+    
     async def translate_text(self, text: str, target_language: str = "английский", source_language: str = "автоопределение") -> Optional[str]:
         """
         Переводит текст с помощью OpenAI GPT
         
+        Одновременные запросы с тем же текстом и языками ждут один общий запрос.
+        
         Args:
             text: Текст для перевода
             target_language: Целевой язык перевода
@@ -27,6 +100,16 @@ class OpenAIHandler:
         Returns:
             Переведенный текст или None в случае ошибки
         """
+        key = make_key('translate', text, target_language, source_language, self.router.route('translate', text)['model'])
+        translated_text, shared = await self.inflight.do(
+            key, lambda: self._translate_text(text, target_language, source_language)
+        )
+        if shared:
+            logger.info(f"Перевод на {target_language} получен от такого же выполняющегося запроса")
+        return translated_text
+    
+    async def _translate_text(self, text: str, target_language: str, source_language: str) -> Optional[str]:
+        """Запрос перевода к OpenAI"""
         try:
             prompt = f"""
 Ты профессиональный переводчик. Переведи следующий текст с языка "{source_language}" на "{target_language}".
@@ -42,13 +125,12 @@ class OpenAIHandler:
 
 Переведенный текст:"""
 
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self._create_completion(
+                'translate', text,
                 messages=[
                     {"role": "system", "content": "Ты профессиональный переводчик, который сохраняет структуру и форматирование оригинального текста."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=2000,
                 temperature=0.3
             )
             
@@ -60,6 +142,61 @@ class OpenAIHandler:
             logger.error(f"Ошибка при переводе текста: {e}")
             return None
     
+    async def translate_and_detect(self, text: str, target_language: str = "английский") -> Optional[Dict[str, str]]:
+        """
+        Переводит текст и определяет его исходный язык одним запросом
+        
+        Args:
+            text: Текст для перевода
+            target_language: Целевой язык перевода
+        
+        Returns:
+            Словарь с ключами translated_text и source_language или None в случае ошибки
+        """
+        try:
+            prompt = f"""
+Ты профессиональный переводчик. Определи язык следующего текста и переведи его на "{target_language}".
+
+Важно:
+1. Сохрани оригинальную структуру и форматирование текста
+2. Если это чек или документ, сохрани табличную структуру
+3. Переведи только содержимое, сохранив числа, даты и специальные символы
+4. Если встречаются названия брендов или собственные имена, оставь их без изменений
+
+Ответь JSON объектом с двумя полями:
+- "source_language": название исходного языка на русском языке (например: "русский", "английский", "немецкий")
+- "translation": переведенный текст
+
+Текст для перевода:
+{text}"""
+
+            response = await self._create_completion(
+                'translate', text,
+                messages=[
+                    {"role": "system", "content": "Ты профессиональный переводчик, который сохраняет структуру и форматирование оригинального текста. Отвечай только JSON."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                response_format={"type": "json_object"}
+            )
+            
+            data = json.loads(response.choices[0].message.content)
+            translated_text = (data.get('translation') or '').strip()
+            source_language = (data.get('source_language') or '').strip().lower()
+            if not translated_text:
+                logger.warning("Комбинированный запрос не вернул перевод")
+                return None
+            
+            logger.info(f"Текст переведен на {target_language}, определен язык: {source_language}")
+            return {
+                'translated_text': translated_text,
+                'source_language': source_language
+            }
+            
+        except Exception as e:
+            logger.error(f"Ошибка при переводе с определением языка: {e}")
+            return None
+    
     async def improve_ocr_text(self, ocr_text: str, context: str = "документ") -> Optional[str]:
         """
         Улучшает качество распознанного OCR текста с помощью GPT
@@ -89,13 +226,12 @@ class OpenAIHandler:
 
 Исправленный текст:"""
 
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self._create_completion(
+                'improve_ocr', ocr_text,
                 messages=[
                     {"role": "system", "content": "Ты эксперт по исправлению текста после OCR распознавания."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=2000,
                 temperature=0.1
             )
             
@@ -117,6 +253,11 @@ class OpenAIHandler:
         Returns:
             Название языка или None в случае ошибки
         """
+        local = self.language_detector.detect(text)
+        if local and local['confidence'] >= self.language_detection_threshold:
+            logger.info(f"Определен язык локально: {local['language_name']} ({local['confidence']})")
+            return local['language_name']
+        
         try:
             prompt = f"""
 Определи язык следующего текста. Ответь только названием языка на русском языке (например: "русский", "английский", "немецкий", "французский", "испанский", "китайский", "японский" и т.д.).
@@ -125,13 +266,12 @@ class OpenAIHandler:
 
 Язык:"""
 
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self._create_completion(
+                'detect_language', text[:200],
                 messages=[
                     {"role": "system", "content": "Ты эксперт по определению языков текста."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=50,
                 temperature=0.1
             )
             
@@ -162,19 +302,34 @@ class OpenAIHandler:
             "中文": "китайский"
         }
         
-        translations = {}
+        results = await fan_out(
+            languages,
+            lambda lang_name: self.translate_text(text, languages[lang_name]),
+            self.fanout_concurrency,
+            self.fanout_timeout
+        )
         
-        for lang_name, lang_full in languages.items():
-            try:
-                translation = await self.translate_text(text, lang_full)
-                if translation:
-                    translations[lang_name] = translation
-            except Exception as e:
-                logger.warning(f"Не удалось перевести на {lang_name}: {e}")
-                continue
+        # Частичный результат: языки с ошибкой или таймаутом пропускаются
+        translations = {}
+        for lang_name, translation in results.items():
+            if isinstance(translation, asyncio.TimeoutError):
+                logger.warning(f"Не удалось перевести на {lang_name}: таймаут {self.fanout_timeout} с")
+            elif isinstance(translation, Exception):
+                logger.warning(f"Не удалось перевести на {lang_name}: {translation}")
+            elif translation:
+                translations[lang_name] = translation
         
         return translations
 
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика объединения одинаковых запросов и маршрутов моделей"""
+        return {
+            'model': self.model,
+            'max_concurrency': self.max_concurrency,
+            'coalescing': self.inflight.get_stats(),
+            'routes': self.router.get_stats()
+        }
+
 # Глобальный экземпляр обработчика
 openai_handler = None
 
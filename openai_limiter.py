@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Выполнение запросов к OpenAI с повторами и адаптивным ограничением параллельности
+
+Ошибки 429 и 5xx часто проходят при повторе, поэтому запрос повторяется
+с экспоненциальной задержкой со случайным разбросом (full jitter), а если
+сервер указал Retry-After или время сброса лимита в x-ratelimit-reset-*,
+ждем именно столько.
+
+Число одновременных запросов подбирается по схеме AIMD: после успешных
+запросов при полной загрузке лимит растет на 1/limit (примерно +1 за
+"раунд"), после 429 или перегрузки сервера уменьшается вдвое. Уменьшение
+выполняется один раз на волну ошибок: ответы на запросы, начатые до
+предыдущего уменьшения, лимит повторно не снижают. Когда x-ratelimit-remaining-*
+показывает, что лимит организации исчерпан, новые запросы ждут его сброса,
+а не получают 429.
+
+Использует только стандартную библиотеку Python.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа, при которых запрос стоит повторить
+RETRYABLE_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+# Коды, означающие перегрузку: лимит параллельности уменьшается
+OVERLOAD_STATUSES = (429, 503)
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Длительность из заголовков OpenAI ('20ms', '1.5s', '6m0s') в секундах"""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Задержка из Retry-After / retry-after-ms или None"""
+    if headers is None:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            # Формат HTTP-date не используется OpenAI
+            return None
+    return None
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Лимит одновременных запросов, подстраиваемый по схеме AIMD
+    """
+
+    def __init__(self, initial: float, minimum: float, maximum: float):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial, minimum), maximum)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._last_decrease = 0.0
+
+        # Статистика
+        self.increases = 0
+        self.decreases = 0
+
+    def acquire(self) -> Dict:
+        """Ожидание свободного места, возвращает сведения о запросе для release"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return {'started_at': time.monotonic(), 'saturated': self.in_flight >= int(self.limit)}
+
+    def release(self, slot: Dict, overloaded: bool = False, success: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                # Одно уменьшение на волну ошибок
+                if slot['started_at'] >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+                    logger.warning(f"⚠️ Лимит параллельных запросов к OpenAI снижен до {int(self.limit)}")
+            elif success and slot['saturated'] and self.limit < self.maximum:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.increases += 1
+            self._condition.notify_all()
+
+
+class OpenAIRequestExecutor:
+    """
+    Повторы запросов к OpenAI с учетом Retry-After, x-ratelimit-* и AIMD
+    """
+
+    def __init__(self, max_retries: Optional[int] = None, backoff_base: Optional[float] = None,
+                 backoff_max: Optional[float] = None, deadline: Optional[float] = None,
+                 initial_concurrency: Optional[float] = None, min_concurrency: Optional[float] = None,
+                 max_concurrency: Optional[float] = None, max_connections: Optional[int] = None):
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('OPENAI_MAX_RETRIES', '3'))
+        self.backoff_base = backoff_base or float(os.getenv('OPENAI_BACKOFF_BASE', '0.5'))
+        self.backoff_max = backoff_max or float(os.getenv('OPENAI_BACKOFF_MAX', '20'))
+        # Дольше этого (с первой попытки) запрос не повторяется
+        self.deadline = deadline or float(os.getenv('OPENAI_RETRY_DEADLINE', '60'))
+        # Запас токенов лимита организации, при котором новые запросы ждут сброса
+        self.token_reserve = int(os.getenv('OPENAI_RATELIMIT_TOKEN_RESERVE', '1000'))
+
+        maximum = max_concurrency or float(os.getenv('OPENAI_CONCURRENCY_MAX', '16'))
+        if max_connections:
+            # Сверх числа соединений пула запросы ждали бы соединения и получали
+            # PoolTimeout, который повторяется как сетевая ошибка и не снижает лимит
+            maximum = min(maximum, max_connections)
+        self.concurrency = AdaptiveConcurrencyLimit(
+            initial_concurrency or float(os.getenv('OPENAI_CONCURRENCY_INITIAL', '4')),
+            min(maximum, min_concurrency or float(os.getenv('OPENAI_CONCURRENCY_MIN', '1'))),
+            maximum
+        )
+        # До этого момента лимит организации исчерпан
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.network_errors = 0
+        self.exhausted = 0
+        self.pauses = 0
+        self.total_retry_wait = 0.0
+
+    def acquire(self) -> Dict:
+        """Ожидание сброса лимита организации и свободного места"""
+        with self._lock:
+            pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+        return self.concurrency.acquire()
+
+    def release(self, slot: Dict, status: Optional[int] = None, headers=None):
+        """Учет результата запроса: лимит параллельности и заголовки x-ratelimit-*"""
+        if headers is not None:
+            self._update_rate_limits(headers)
+        self.concurrency.release(slot, overloaded=status in OVERLOAD_STATUSES,
+                                 success=status is not None and 200 <= status < 300)
+
+    def execute(self, send: Callable):
+        """
+        Выполнение запроса с повторами
+
+        Args:
+            send: Функция без аргументов, возвращающая ответ с полями status, headers, data
+
+        Returns:
+            Последний полученный ответ (успешный или нет)
+
+        Raises:
+            Последнее сетевое исключение, если ответа так и не было
+        """
+        started_at = time.monotonic()
+        with self._lock:
+            self.requests += 1
+
+        for attempt in range(self.max_retries + 1):
+            slot = self.acquire()
+            response, error = None, None
+            try:
+                with self._lock:
+                    self.attempts += 1
+                response = send()
+            except Exception as e:
+                error = e
+            finally:
+                self.release(slot, response.status if response is not None else None,
+                             response.headers if response is not None else None)
+
+            if response is not None and not self._should_retry(response):
+                return response
+
+            delay = self._retry_delay(attempt, response)
+            if attempt == self.max_retries or time.monotonic() + delay - started_at > self.deadline:
+                with self._lock:
+                    self.exhausted += 1
+                if response is not None:
+                    return response
+                raise error
+
+            with self._lock:
+                self.retries += 1
+                self.total_retry_wait += delay
+                if error is not None:
+                    self.network_errors += 1
+                elif response.status == 429:
+                    self.rate_limited += 1
+                else:
+                    self.server_errors += 1
+            reason = f"HTTP {response.status}" if response is not None else str(error)
+            logger.warning(f"⚠️ Запрос к OpenAI не удался ({reason}), повтор через {delay:.2f} с")
+            time.sleep(delay)
+
+    def _should_retry(self, response) -> bool:
+        if response.status not in RETRYABLE_STATUSES:
+            return False
+        if response.status == 429:
+            # Исчерпанная квота оплаты не восстановится при повторе
+            try:
+                error = json.loads(response.data.decode('utf-8')).get('error') or {}
+            except Exception:
+                error = {}
+            if error.get('code') == 'insufficient_quota' or error.get('type') == 'insufficient_quota':
+                return False
+        # Сервер может явно запретить повтор
+        return (response.headers or {}).get('x-should-retry', 'true') != 'false'
+
+    def _retry_delay(self, attempt: int, response) -> float:
+        """Задержка перед повтором: указанная сервером или экспоненциальная с разбросом"""
+        if response is not None:
+            delay = retry_after_seconds(response.headers)
+            if delay is None and response.status == 429:
+                delay = max(filter(None, (
+                    parse_duration(response.headers.get('x-ratelimit-reset-requests')),
+                    parse_duration(response.headers.get('x-ratelimit-reset-tokens')),
+                )), default=None)
+            if delay is not None:
+                # Небольшой разброс, чтобы повторы не пришли одновременно
+                return min(self.backoff_max, delay) + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _update_rate_limits(self, headers):
+        """Пауза новых запросов до сброса исчерпанного лимита организации"""
+        pause = 0.0
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        if remaining_requests is not None and remaining_requests.isdigit() and int(remaining_requests) == 0:
+            pause = max(pause, parse_duration(headers.get('x-ratelimit-reset-requests')) or 0)
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        if remaining_tokens is not None and remaining_tokens.isdigit() and int(remaining_tokens) < self.token_reserve:
+            pause = max(pause, parse_duration(headers.get('x-ratelimit-reset-tokens')) or 0)
+        if pause <= 0:
+            return
+
+        pause = min(pause, self.backoff_max)
+        with self._lock:
+            paused_until = time.monotonic() + pause
+            if paused_until > self._paused_until:
+                self._paused_until = paused_until
+                self.pauses += 1
+        logger.info(f"⏸ Лимит OpenAI почти исчерпан, новые запросы ждут {pause:.2f} с")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'concurrency_limit': int(self.concurrency.limit),
+                'concurrency_max': int(self.concurrency.maximum),
+                'in_flight': self.concurrency.in_flight,
+                'limit_increases': self.concurrency.increases,
+                'limit_decreases': self.concurrency.decreases,
+                'requests': self.requests,
+                'attempts': self.attempts,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'server_errors': self.server_errors,
+                'network_errors': self.network_errors,
+                'exhausted': self.exhausted,
+                'rate_limit_pauses': self.pauses,
+                'avg_retry_wait': round(self.total_retry_wait / self.retries, 3) if self.retries else 0
+            }
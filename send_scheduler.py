@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Планировщик исходящих сообщений Telegram с ограничением частоты
+
+Telegram ограничивает отправку примерно 30 сообщениями в секунду на бота,
+одним сообщением в секунду в личный чат и 20 сообщениями в минуту в группу.
+При превышении Bot API отвечает 429 с полем retry_after.
+
+Каждая отправка (sendMessage, editMessageText) проходит через два
+token bucket: общий для бота и отдельный для чата. Отправки в один чат
+выполняются строго в порядке вызова. Ответ 429 блокирует чат на
+retry_after секунд, после чего та же отправка повторяется.
+
+Вызывающий поток ждет своей очереди и получает результат вызова API,
+поэтому message_id отправленного сообщения доступен сразу. Пока идет
+генерация потокового ответа, его отправки и правки идут через try_submit:
+без свободного токена вызов пропускается, а не ждет (текст уйдет позже).
+
+Использует только стандартную библиотеку Python.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд без отправок состояние чата удаляется
+CHAT_STATE_IDLE_SECONDS = 60
+
+
+class TokenBucket:
+    """
+    Token bucket в форме расписания (GCRA)
+
+    Вместо счетчика токенов хранится время, когда bucket снова станет
+    полным. reserve() сразу резервирует ближайшее разрешенное время
+    отправки, поэтому потоки не соревнуются за освободившийся токен.
+    """
+
+    __slots__ = ('interval', 'tolerance', 'full_at')
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.interval = 1.0 / rate
+        self.tolerance = (max(1.0, capacity) - 1) * self.interval
+        self.full_at = 0.0
+
+    def reserve(self, at: float) -> float:
+        """Резервирование токена не раньше at, возвращает время отправки"""
+        full_at = max(self.full_at, at)
+        send_at = max(at, full_at - self.tolerance)
+        self.full_at = full_at + self.interval
+        return send_at
+
+    def available(self, now: float) -> bool:
+        """Можно ли отправить сейчас без ожидания"""
+        return self.full_at - self.tolerance <= now
+
+    def is_idle(self, now: float) -> bool:
+        return self.full_at <= now
+
+
+class _ChatState:
+    __slots__ = ('bucket', 'next_ticket', 'serving', 'blocked_until', 'last_used')
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        # Очередь отправок чата: билет выдается при вызове, обслуживается по порядку
+        self.next_ticket = 0
+        self.serving = 0
+        self.blocked_until = 0.0
+        self.last_used = time.monotonic()
+
+
+class SendScheduler:
+    """
+    Ограничение частоты отправок: общий лимит бота и лимиты чатов
+    """
+
+    def __init__(self, global_rate: Optional[float] = None, chat_rate: Optional[float] = None,
+                 group_rate_per_minute: Optional[float] = None, chat_burst: Optional[int] = None,
+                 max_retries: Optional[int] = None, max_retry_after: Optional[float] = None):
+        self.global_rate = global_rate or float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+        self.chat_rate = chat_rate or float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+        self.group_rate_per_minute = group_rate_per_minute or float(os.getenv('TELEGRAM_GROUP_RATE_PER_MINUTE', '20'))
+        # Сколько сообщений подряд можно отправить в чат без паузы
+        self.chat_burst = chat_burst or int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('TELEGRAM_SEND_MAX_RETRIES', '3'))
+        # Дольше этого отправка не ждет, ответ 429 возвращается вызывающему
+        self.max_retry_after = max_retry_after or float(os.getenv('TELEGRAM_MAX_RETRY_AFTER', '60'))
+
+        self.global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self._chats: Dict[int, _ChatState] = {}
+        self._condition = threading.Condition()
+        self._last_sweep = time.monotonic()
+
+        # Статистика
+        self.sends = 0
+        self.delayed = 0
+        self.skipped = 0
+        self.rate_limited = 0
+        self.gave_up = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+        self._recent_delays = deque(maxlen=1000)
+
+    def _new_bucket(self, chat_id: int) -> TokenBucket:
+        # У групп и каналов отрицательный chat_id
+        if chat_id < 0:
+            return TokenBucket(self.group_rate_per_minute / 60, self.chat_burst)
+        return TokenBucket(self.chat_rate, self.chat_burst)
+
+    def submit(self, chat_id: int, send: Callable[[], Dict]) -> Dict:
+        """
+        Выполнение отправки в чат с соблюдением лимитов
+
+        Args:
+            chat_id: Чат получателя
+            send: Вызов Bot API, возвращающий ответ Telegram
+
+        Returns:
+            Ответ Telegram (после повторов при 429)
+        """
+        enqueued_at = time.monotonic()
+        with self._condition:
+            self._sweep_locked(enqueued_at)
+            state = self._chats.get(chat_id)
+            if state is None:
+                state = _ChatState(self._new_bucket(chat_id))
+                self._chats[chat_id] = state
+            ticket = state.next_ticket
+            state.next_ticket += 1
+            while state.serving != ticket:
+                self._condition.wait()
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                with self._condition:
+                    now = time.monotonic()
+                    send_at = state.bucket.reserve(max(now, state.blocked_until))
+                    send_at = self.global_bucket.reserve(send_at)
+                wait = send_at - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                if attempt == 0:
+                    self._record_delay(time.monotonic() - enqueued_at)
+
+                result = send()
+                retry_after = self._retry_after(result)
+                if retry_after is None:
+                    return result
+
+                with self._condition:
+                    self.rate_limited += 1
+                    state.blocked_until = time.monotonic() + retry_after
+                if retry_after > self.max_retry_after or attempt == self.max_retries:
+                    self.gave_up += 1
+                    logger.error(f"❌ Лимит отправки в чат {chat_id}: retry_after={retry_after} с, отправка отменена")
+                    return result
+                logger.warning(f"⚠️ Лимит отправки в чат {chat_id}: повтор через {retry_after} с")
+            return result
+        finally:
+            with self._condition:
+                state.serving += 1
+                state.last_used = time.monotonic()
+                self._condition.notify_all()
+
+    def try_submit(self, chat_id: int, send: Callable[[], Dict]) -> Optional[Dict]:
+        """
+        Отправка в чат без ожидания
+
+        Если в чате есть очередь, он заблокирован после 429 или в общем
+        либо чатовом bucket нет токена, отправка пропускается.
+
+        Returns:
+            Ответ Telegram (без повторов при 429) или None, если отправка пропущена
+        """
+        now = time.monotonic()
+        with self._condition:
+            self._sweep_locked(now)
+            state = self._chats.get(chat_id)
+            if state is None:
+                state = _ChatState(self._new_bucket(chat_id))
+                self._chats[chat_id] = state
+            if (state.serving != state.next_ticket or state.blocked_until > now
+                    or not state.bucket.available(now) or not self.global_bucket.available(now)):
+                self.skipped += 1
+                return None
+            state.bucket.reserve(now)
+            self.global_bucket.reserve(now)
+            # Билет удерживает очередь чата, пока идет вызов
+            state.next_ticket += 1
+
+        try:
+            self._record_delay(0.0)
+            result = send()
+            retry_after = self._retry_after(result)
+            if retry_after is not None:
+                with self._condition:
+                    self.rate_limited += 1
+                    state.blocked_until = time.monotonic() + retry_after
+            return result
+        finally:
+            with self._condition:
+                state.serving += 1
+                state.last_used = time.monotonic()
+                self._condition.notify_all()
+
+    @staticmethod
+    def _retry_after(result: Dict) -> Optional[float]:
+        """retry_after из ответа 429 или None"""
+        if not isinstance(result, dict) or result.get('ok') or result.get('error_code') != 429:
+            return None
+        return float((result.get('parameters') or {}).get('retry_after', 1))
+
+    def _record_delay(self, delay: float):
+        with self._condition:
+            self.sends += 1
+            if delay > 0.001:
+                self.delayed += 1
+            self.total_delay += delay
+            self.max_delay = max(self.max_delay, delay)
+            self._recent_delays.append(delay)
+
+    def _sweep_locked(self, now: float):
+        """Удаление состояния чатов без отправок и ожидающих"""
+        if now - self._last_sweep < CHAT_STATE_IDLE_SECONDS:
+            return
+        self._last_sweep = now
+        idle = [
+            chat_id for chat_id, state in self._chats.items()
+            if state.serving == state.next_ticket and state.bucket.is_idle(now)
+            and state.blocked_until <= now and now - state.last_used > CHAT_STATE_IDLE_SECONDS
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def get_stats(self) -> Dict:
+        with self._condition:
+            recent = sorted(self._recent_delays)
+            return {
+                'global_rate': self.global_rate,
+                'chat_rate': self.chat_rate,
+                'group_rate_per_minute': self.group_rate_per_minute,
+                'chats': len(self._chats),
+                'pending': sum(state.next_ticket - state.serving for state in self._chats.values()),
+                'sends': self.sends,
+                'delayed': self.delayed,
+                'skipped': self.skipped,
+                'rate_limited': self.rate_limited,
+                'gave_up': self.gave_up,
+                'avg_delay': round(self.total_delay / self.sends, 4) if self.sends else 0,
+                'p95_delay': round(recent[int(len(recent) * 0.95)], 4) if recent else 0,
+                'max_delay': round(self.max_delay, 4)
+            }
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Объединение одинаковых одновременных запросов (singleflight)
+
+Если запрос с тем же ключом уже выполняется, новый вызов не идет во
+внешний API, а ждет результат выполняющегося и получает его же (или то же
+исключение). Ключ строится так же, как ключ кэша. После завершения
+запроса ключ освобождается: объединяются только одновременные вызовы,
+хранение результатов - задача кэша.
+
+SingleFlight - для потоков (HTTP клиент бота), AsyncSingleFlight - для
+корутин (асинхронный клиент OpenAI).
+
+Использует только стандартную библиотеку Python.
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _Counters:
+    """Общая статистика объединения запросов"""
+
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def stats(self, in_flight: int) -> Dict:
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'coalesced_rate': round(self.coalesced / self.calls, 4) if self.calls else 0,
+            'in_flight': in_flight
+        }
+
+
+class SingleFlight(_Counters):
+    """
+    Объединение одновременных вызовов с одинаковым ключом в потоках
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Выполнение fn() или ожидание уже выполняющегося вызова с тем же ключом
+
+        Returns:
+            (результат, True если результат получен от чужого вызова)
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return self.stats(len(self._calls))
+
+
+class AsyncSingleFlight(_Counters):
+    """
+    Объединение одновременных вызовов с одинаковым ключом в корутинах
+
+    Запрос выполняется отдельной задачей, поэтому отмена одного из ожидающих
+    (например, по таймауту) не отменяет его для остальных.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Выполнение await fn() или ожидание уже выполняющегося вызова с тем же ключом
+
+        Returns:
+            (результат, True если результат получен от чужого вызова)
+        """
+        self.calls += 1
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            self.executions += 1
+            task.add_done_callback(lambda _, key=key, task=task: self._release(key, task))
+        return await asyncio.shield(task), shared
+
+    def _release(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Исключение уже получили ожидающие; без этого asyncio пишет в лог,
+            # если все ожидающие были отменены
+            task.exception()
+
+    def get_stats(self) -> Dict:
+        return self.stats(len(self._tasks))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Получение файлов Telegram: кэш getFile и загрузка байтов
+
+file_path, полученный через getFile, остается действительным около часа,
+поэтому повторный getFile для того же file_id не нужен. Загруженные байты
+хранятся в ограниченном кэше процесса по file_unique_id, так что повторный
+анализ того же фото через OpenAI не скачивает файл заново.
+
+PIL используется, только если установлен, для уменьшения изображения
+перед отправкой в OpenAI в виде data URL.
+"""
+
+import base64
+import io
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+from cache import TTLCache
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Telegram гарантирует действительность ссылки не меньше часа
+FILE_PATH_TTL_SECONDS = int(os.getenv('TELEGRAM_FILE_PATH_TTL', 3300))
+FILE_CACHE_MAX_BYTES = int(os.getenv('TELEGRAM_FILE_CACHE_MAX_BYTES', 20971520))  # 20MB
+FILE_CACHE_TTL_SECONDS = int(os.getenv('TELEGRAM_FILE_CACHE_TTL', 3600))
+# Bot API отдает файлы размером до 20MB
+MAX_DOWNLOAD_BYTES = int(os.getenv('TELEGRAM_MAX_DOWNLOAD_BYTES', 20971520))
+
+# Пределы, до которых OpenAI сам уменьшает изображение в режиме detail=high
+VISION_MAX_LONG_SIDE = 2048
+VISION_MAX_SHORT_SIDE = 768
+VISION_JPEG_QUALITY = int(os.getenv('VISION_JPEG_QUALITY', 85))
+
+
+# Общий кэш байтов файлов по file_unique_id
+_file_cache = None
+_file_cache_lock = threading.Lock()
+
+
+def get_file_cache() -> TTLCache:
+    """Получение кэша загруженных файлов"""
+    global _file_cache
+    with _file_cache_lock:
+        if _file_cache is None:
+            _file_cache = TTLCache(FILE_CACHE_MAX_BYTES, FILE_CACHE_TTL_SECONDS, name='telegram_files')
+        return _file_cache
+
+
+def to_data_url(data: bytes, max_long_side: int = VISION_MAX_LONG_SIDE,
+                max_short_side: int = VISION_MAX_SHORT_SIDE) -> str:
+    """
+    data URL изображения для OpenAI Vision
+
+    Если установлен PIL, изображение уменьшается до размеров, которые
+    OpenAI все равно использует, и пережимается в JPEG.
+    """
+    mime = 'image/jpeg'
+    if PIL_AVAILABLE:
+        try:
+            image = Image.open(io.BytesIO(data))
+            width, height = image.size
+            scale = min(1.0, max_long_side / max(width, height), max_short_side / min(width, height))
+            if scale < 1.0 or image.format != 'JPEG':
+                image = image.convert('RGB')
+                if scale < 1.0:
+                    image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))),
+                                         Image.Resampling.LANCZOS)
+                output = io.BytesIO()
+                image.save(output, 'JPEG', quality=VISION_JPEG_QUALITY, optimize=True)
+                logger.info(f"🖼 Изображение уменьшено для OpenAI: {width}x{height} -> {image.size[0]}x{image.size[1]}, "
+                            f"{len(data)} -> {output.tell()} байт")
+                data = output.getvalue()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось уменьшить изображение, отправляется оригинал: {e}")
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+class TelegramFileResolver:
+    """
+    Разрешение file_id в file_path и загрузка файлов через пул соединений
+    """
+
+    def __init__(self, telegram_api, file_cache: Optional[TTLCache] = None):
+        self.telegram_api = telegram_api
+        self.paths = TTLCache(1048576, FILE_PATH_TTL_SECONDS, name='telegram_file_paths')
+        self.file_cache = file_cache if file_cache is not None else get_file_cache()
+
+        # Статистика
+        self.get_file_calls = 0
+        self.downloads = 0
+        self.downloaded_bytes = 0
+
+    def get_file_info(self, file_id: str) -> Optional[Dict]:
+        """Информация о файле (file_path) из кэша или через getFile"""
+        cached = self.paths.get(file_id)
+        if cached is not None:
+            return cached
+
+        self.get_file_calls += 1
+        result = self.telegram_api.call('getFile', {'file_id': file_id})
+        if not result.get('ok'):
+            logger.error(f"❌ Ошибка получения файла: {result}")
+            return None
+
+        file_info = result.get('result') or {}
+        if 'file_path' in file_info:
+            self.paths.set(file_id, file_info)
+        return file_info
+
+    def file_url(self, file_path: str) -> str:
+        """Ссылка на файл (содержит токен бота)"""
+        return f"https://api.telegram.org/file/bot{self.telegram_api.token}/{file_path}"
+
+    def download(self, file_id: str, file_unique_id: Optional[str] = None) -> Optional[bytes]:
+        """
+        Байты файла из кэша или загрузкой с серверов Telegram
+
+        Если ссылка устарела (404), file_path запрашивается заново один раз.
+        """
+        cache_key = file_unique_id or file_id
+        data = self.file_cache.get(cache_key)
+        if data is not None:
+            return data
+
+        for attempt in range(2):
+            file_info = self.get_file_info(file_id)
+            if not file_info or 'file_path' not in file_info:
+                return None
+            if file_info.get('file_size', 0) > MAX_DOWNLOAD_BYTES:
+                logger.warning(f"⚠️ Файл {file_id} больше {MAX_DOWNLOAD_BYTES} байт")
+                return None
+
+            response = self.telegram_api.pool.request(
+                'GET', f"/file/bot{self.telegram_api.token}/{file_info['file_path']}", timeout=30
+            )
+            if response.status == 404 and attempt == 0:
+                self.paths.delete(file_id)
+                continue
+            if not response.ok:
+                logger.error(f"❌ Ошибка загрузки файла {file_id}: HTTP {response.status}")
+                return None
+
+            data = response.data
+            self.downloads += 1
+            self.downloaded_bytes += len(data)
+            self.file_cache.set(cache_key, data)
+            return data
+        return None
+
+    def get_stats(self) -> Dict:
+        return {
+            'get_file_calls': self.get_file_calls,
+            'downloads': self.downloads,
+            'downloaded_bytes': self.downloaded_bytes,
+            'paths': self.paths.get_stats(),
+            'files': self.file_cache.get_stats()
+        }
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Проверка поиска похожих изображений в кэше OCR
+
+Запуск: python -m unittest test_ocr_cache
+"""
+
+import io
+import os
+import random
+import unittest
+
+from PIL import Image, ImageDraw, ImageFont
+
+from ocr_cache import OCRCache
+
+ITEMS = ['Молоко 2.5%', 'Хлеб', 'Сыр Российский', 'Кофе', 'Яйца C1', 'Масло', 'Сахар', 'Чай', 'Вода 1.5л', 'Кефир']
+
+
+def receipt(seed: int) -> Image.Image:
+    """Чек одного и того же магазина: шапка и подвал общие, позиции разные"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (600, 1200), (250, 250, 245))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=24)
+    title = ImageFont.load_default(size=36)
+    draw.text((150, 30), 'МАГАЗИН "ПРОДУКТЫ"', font=title, fill=0)
+    draw.text((60, 90), 'ИНН 7701234567  Касса 3', font=font, fill=0)
+    y = 160
+    for _ in range(rng.randint(5, 9)):
+        draw.text((40, y), rng.choice(ITEMS), font=font, fill=0)
+        draw.text((440, y), f'{rng.randint(10, 999)}.{rng.randint(0, 99):02d}', font=font, fill=0)
+        y += 40
+    draw.line((40, 900, 560, 900), fill=0, width=2)
+    draw.text((40, 920), 'ИТОГО', font=title, fill=0)
+    draw.text((400, 920), f'{rng.randint(100, 9999)}.00', font=title, fill=0)
+    draw.text((120, 1100), 'Спасибо за покупку!', font=font, fill=0)
+    return image
+
+
+def jpeg(image: Image.Image, quality: int = 85) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+class PerceptualLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self._environ = dict(os.environ)
+        os.environ['OCR_CACHE_ENABLED'] = 'true'
+        os.environ['OCR_CACHE_PERCEPTUAL'] = 'true'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+
+    def _cache_with(self, image_data: bytes, text: str) -> OCRCache:
+        cache = OCRCache(namespace='test', db_path='')
+        cache.store(cache.make_key(image_data), cache.perceptual_hash(image_data),
+                    {'success': True, 'text': text})
+        return cache
+
+    def test_same_template_documents_do_not_collide(self):
+        for first, second in ((1, 2), (3, 4), (5, 6), (7, 8)):
+            first_data, second_data = jpeg(receipt(first)), jpeg(receipt(second))
+            cache = self._cache_with(first_data, f'чек {first}')
+            signature = cache.perceptual_hash(second_data)
+            # Грубый хэш совпадает, отличие находит только проверка
+            self.assertLessEqual(bin(signature[0] ^ cache.perceptual_hash(first_data)[0]).count('1'),
+                                 cache.max_distance)
+            self.assertIsNone(cache.lookup_similar(signature))
+
+    def test_recompressed_copy_matches(self):
+        image = receipt(1)
+        cache = self._cache_with(jpeg(image), 'чек 1')
+        result = cache.lookup_similar(cache.perceptual_hash(jpeg(image, quality=70)))
+        self.assertEqual(result['text'], 'чек 1')
+
+    def test_different_aspect_ratio_rejected(self):
+        image = receipt(1)
+        cache = self._cache_with(jpeg(image), 'чек 1')
+        cropped = image.crop((0, 0, 600, 1100))
+        self.assertIsNone(cache.lookup_similar(cache.perceptual_hash(jpeg(cropped))))
+
+    def test_perceptual_lookup_disabled_by_default(self):
+        del os.environ['OCR_CACHE_PERCEPTUAL']
+        image = receipt(1)
+        cache = self._cache_with(jpeg(image), 'чек 1')
+        self.assertFalse(cache.perceptual)
+        self.assertIsNone(cache.lookup_similar(cache.perceptual_hash(jpeg(image, quality=70))))
+
+    def test_signature_round_trip(self):
+        signature = OCRCache.perceptual_hash(jpeg(receipt(1)))
+        self.assertEqual(OCRCache.parse_signature(OCRCache.format_signature(signature)), signature)
+        # Записи прежнего формата пропускаются
+        self.assertIsNone(OCRCache.parse_signature('ffffffffffffffff'))
+
+
+if __name__ == '__main__':
+    unittest.main()
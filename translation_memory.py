@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from loguru import logger
+from typing import Optional, Dict
+from cache import TTLCache, make_key
+
+
+class TranslationMemory:
+    """
+    Память переводов: повторно не переводит уже переведенный текст
+
+    Два уровня хранения:
+    1. LRU кэш в памяти процесса
+    2. Опционально SQLite база на диске, которая переживает перезапуск
+
+    lookup и store блокирующие (чтение SQLite, commit с fsync), поэтому из
+    асинхронного кода они вызываются через asyncio.to_thread.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.enabled = os.getenv('TRANSLATION_MEMORY_ENABLED', 'true').lower() == 'true'
+        self.ttl_seconds = int(os.getenv('TRANSLATION_MEMORY_TTL', '604800'))  # 7 дней
+        max_bytes = int(os.getenv('TRANSLATION_MEMORY_MAX_BYTES', '5242880'))  # 5MB
+        self.db_path = db_path if db_path is not None else os.getenv('TRANSLATION_MEMORY_DB', '')
+
+        self.memory = TTLCache(max_bytes, self.ttl_seconds, name='translation_memory')
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        # Статистика
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+        if self.enabled and self.db_path:
+            self._open_db()
+
+        logger.info(
+            f"Память переводов: {'включена' if self.enabled else 'отключена'}"
+            f"{f', SQLite: {self.db_path}' if self._db else ''}"
+        )
+
+    def _open_db(self):
+        """Открытие SQLite базы и создание таблицы"""
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS translation_memory ("
+                "key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        except Exception as e:
+            logger.error(f"Не удалось открыть базу памяти переводов {self.db_path}: {e}")
+            self._db = None
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        Нормализация исходного текста для ключа
+
+        Сохраняет структуру строк (важно для чеков и таблиц),
+        убирает только концевые пробелы и различия в переводах строк.
+        """
+        lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        return '\n'.join(line.rstrip() for line in lines).strip()
+
+    def make_key(self, text: str, source_lang: str, target_lang: str, model: str) -> str:
+        return make_key(self.normalize_text(text), source_lang.lower(), target_lang.lower(), model)
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Грубая оценка числа токенов (около 4 символов на токен)"""
+        return max(1, len(text) // 4) if text else 0
+
+    def lookup(self, text: str, source_lang: str, target_lang: str, model: str) -> Optional[Dict]:
+        """
+        Поиск перевода в памяти
+
+        Returns:
+            Сохраненный результат перевода или None
+        """
+        if not self.enabled:
+            return None
+
+        key = self.make_key(text, source_lang, target_lang, model)
+        result = self.memory.get(key)
+        if result is not None:
+            self.memory_hits += 1
+        else:
+            result = self._db_get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            # Поднимаем запись с диска в память
+            self.memory.set(key, result)
+
+        self.tokens_saved += self.estimate_tokens(text) + self.estimate_tokens(result.get('translated_text', ''))
+        logger.info(f"Перевод найден в памяти переводов: {source_lang} -> {target_lang}")
+        return dict(result, cached=True)
+
+    def store(self, text: str, source_lang: str, target_lang: str, model: str, result: Dict):
+        """Сохранение успешного перевода"""
+        if not self.enabled or not result.get('success'):
+            return
+
+        key = self.make_key(text, source_lang, target_lang, model)
+        self.memory.set(key, result)
+        self._db_set(key, result)
+
+    def _db_get(self, key: str) -> Optional[Dict]:
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT result, created_at FROM translation_memory WHERE key = ?", (key,)
+                ).fetchone()
+            if row is None:
+                return None
+            result, created_at = row
+            if time.time() - created_at > self.ttl_seconds:
+                return None
+            return json.loads(result)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения памяти переводов: {e}")
+            return None
+
+    def _db_set(self, key: str, result: Dict):
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO translation_memory (key, result, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(result, ensure_ascii=False), time.time())
+                )
+                self._db.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка записи в память переводов: {e}")
+
+    def get_stats(self) -> Dict:
+        """Статистика попаданий и сэкономленных токенов"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0,
+            'tokens_saved': self.tokens_saved,
+            'disk_enabled': self._db is not None,
+            'memory': self.memory.get_stats()
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
@@ -2,7 +2,8 @@ import os
 from loguru import logger
 from typing import Optional, Dict, List, Tuple
 import asyncio
-from openai_handler import get_openai_handler
+from openai_handler import get_openai_handler, fan_out
+from translation_memory import TranslationMemory
 
 class TranslationHandler:
     def __init__(self):
@@ -13,6 +14,9 @@ class TranslationHandler:
         self.default_target_lang = os.getenv('DEFAULT_TARGET_LANG', 'en')
         self.translation_service = os.getenv('TRANSLATION_SERVICE', 'openai')
         
+        # Память уже выполненных переводов
+        self.translation_memory = TranslationMemory()
+        
         # Маппинг языков для удобства пользователей
         self.language_mapping = {
             'русский': 'ru',
@@ -112,16 +116,13 @@ class TranslationHandler:
             Словарь с результатами перевода
         """
         try:
-            translated_text = await self.openai_handler.translate_text(text, target_lang, source_lang)
+            detected_lang = source_lang
+            if source_lang in ['auto', 'автоопределение']:
+                translated_text, detected_lang = await self._translate_with_detection(text, target_lang)
+            else:
+                translated_text = await self.openai_handler.translate_text(text, target_lang, source_lang)
             
             if translated_text:
-                # Определение исходного языка если нужно
-                detected_lang = source_lang
-                if source_lang in ['auto', 'автоопределение']:
-                    detected_lang = await self.openai_handler.detect_language(text)
-                    if not detected_lang:
-                        detected_lang = 'неизвестный'
-                
                 translation_result = {
                     'success': True,
                     'translated_text': translated_text,
@@ -148,6 +149,33 @@ class TranslationHandler:
                 'service': 'OpenAI GPT'
             }
     
+    async def _translate_with_detection(self, text: str, target_lang: str) -> Tuple[Optional[str], str]:
+        """
+        Перевод с автоопределением исходного языка
+        
+        Если локальный детектор уверен в языке, выполняется только перевод.
+        Иначе пробует один комбинированный запрос, который возвращает и перевод,
+        и язык. Если он не удался, перевод и определение языка выполняются параллельно.
+        
+        Returns:
+            Кортеж (переведенный текст, исходный язык)
+        """
+        local = self.openai_handler.language_detector.detect(text)
+        if local and local['confidence'] >= self.openai_handler.language_detection_threshold:
+            # Язык уверенно определен локально: нужен только перевод
+            translated_text = await self.openai_handler.translate_text(text, target_lang, local['language_name'])
+            return translated_text, local['language_name']
+        
+        combined = await self.openai_handler.translate_and_detect(text, target_lang)
+        if combined:
+            return combined['translated_text'], combined['source_language'] or 'неизвестный'
+        
+        translated_text, detected_lang = await asyncio.gather(
+            self.openai_handler.translate_text(text, target_lang, 'автоопределение'),
+            self.openai_handler.detect_language(text)
+        )
+        return translated_text, detected_lang or 'неизвестный'
+    
     async def translate_text(self, text: str, target_lang: str = None, source_lang: str = 'auto', use_openai: bool = None) -> Dict:
         """
         Основной метод перевода текста
@@ -180,9 +208,17 @@ class TranslationHandler:
         
         logger.info(f"Начинаю перевод текста (длина: {len(text)}) на {target_lang}")
         
+        # Модель перевода зависит от длины текста
+        model = self.openai_handler.router.route('translate', text)['model']
+        # SQLite чтение и запись (commit с fsync) - вне event loop
+        cached = await asyncio.to_thread(self.translation_memory.lookup, text, source_lang, target_lang, model)
+        if cached:
+            return cached
+        
         # Перевод с помощью OpenAI
         result = await self.translate_with_openai(text, target_lang, source_lang)
         
+        await asyncio.to_thread(self.translation_memory.store, text, source_lang, target_lang, model, result)
         return result
     
     async def get_available_languages(self) -> Dict[str, str]:
@@ -204,6 +240,16 @@ class TranslationHandler:
         Returns:
             Информация о языке
         """
+        local = self.openai_handler.language_detector.detect(text)
+        if local and local['confidence'] >= self.openai_handler.language_detection_threshold:
+            return {
+                'success': True,
+                'language_name': local['language_name'],
+                'language_code': local['language_code'],
+                'confidence': local['confidence'],
+                'service': 'Локальный детектор'
+            }
+        
         try:
             # Используем OpenAI для определения языка
             language_name = await self.openai_handler.detect_language(text)
@@ -238,18 +284,29 @@ class TranslationHandler:
         Returns:
             Словарь с переводами для каждого языка
         """
-        results = {}
+        outcomes = await fan_out(
+            target_languages,
+            lambda lang: self.translate_text(text, lang),
+            self.openai_handler.fanout_concurrency,
+            self.openai_handler.fanout_timeout
+        )
         
-        for lang in target_languages:
-            try:
-                result = await self.translate_text(text, lang)
-                results[lang] = result
-            except Exception as e:
-                logger.error(f"Ошибка перевода на {lang}: {e}")
+        results = {}
+        for lang, result in outcomes.items():
+            if isinstance(result, asyncio.TimeoutError):
+                logger.error(f"Таймаут перевода на {lang}")
                 results[lang] = {
                     'success': False,
-                    'error': str(e)
+                    'error': f'Превышено время ожидания ({self.openai_handler.fanout_timeout} с)'
                 }
+            elif isinstance(result, Exception):
+                logger.error(f"Ошибка перевода на {lang}: {result}")
+                results[lang] = {
+                    'success': False,
+                    'error': str(result)
+                }
+            else:
+                results[lang] = result
         
         return results
     
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бюджет токенов изображений для OpenAI Vision
+
+Стоимость изображения для gpt-4o зависит от размера и параметра detail:
+- detail=low: 85 токенов, изображение уменьшается до 512x512
+- detail=high: изображение вписывается в 2048x2048, затем короткая сторона
+  уменьшается до 768; 85 токенов плюс 170 за каждую плитку 512x512
+
+Поэтому вместо самого большого PhotoSize выбирается наименьший, которого
+достаточно для detail=high, а detail=low используется, когда текст на фото
+заведомо крупный и читается в 512x512. Если строк текста не найдено,
+используется detail=high: мелкий текст оценка может и не увидеть.
+"""
+
+import io
+import logging
+import math
+import os
+import threading
+from typing import Dict, List, Optional
+
+try:
+    from PIL import Image
+    from image_preprocessing import estimate_text_height
+    TEXT_ESTIMATOR_AVAILABLE = True
+except ImportError:
+    TEXT_ESTIMATOR_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+TILE_SIZE = 512
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+
+# auto | low | high
+VISION_DETAIL = os.getenv('VISION_DETAIL', 'auto')
+# Короткая сторона PhotoSize, которой достаточно для detail=high
+VISION_TARGET_SHORT_SIDE = int(os.getenv('VISION_TARGET_SHORT_SIDE', HIGH_DETAIL_SHORT_SIDE))
+# Минимальная высота строки текста (px в масштабе 512x512), читаемая в detail=low
+VISION_LOW_DETAIL_MIN_TEXT_HEIGHT = float(os.getenv('VISION_LOW_DETAIL_MIN_TEXT_HEIGHT', 10))
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = 'high') -> int:
+    """Оценка числа токенов изображения по правилам OpenAI"""
+    if detail == 'low' or not width or not height:
+        return LOW_DETAIL_TOKENS
+
+    scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * tiles
+
+
+def select_photo_size(photo_sizes: List[Dict], target_short_side: int = None) -> Dict:
+    """
+    Наименьший PhotoSize с короткой стороной не меньше целевой
+
+    Если такого нет, возвращается самый большой.
+    """
+    target_short_side = target_short_side or VISION_TARGET_SHORT_SIDE
+    sizes = sorted(photo_sizes, key=lambda size: size.get('width', 0) * size.get('height', 0))
+    for size in sizes:
+        if min(size.get('width', 0), size.get('height', 0)) >= target_short_side:
+            return size
+    return sizes[-1]
+
+
+def text_height_at_low_detail(data: bytes) -> Optional[float]:
+    """
+    Высота строки текста после уменьшения изображения до 512x512
+
+    Returns:
+        Высота в пикселях или None, если строк текста не найдено или оценка недоступна
+    """
+    if not TEXT_ESTIMATOR_AVAILABLE or not data:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft('L', (1024, 1024))
+        image = image.convert('L')
+        height = estimate_text_height(image)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось оценить размер текста: {e}")
+        return None
+    # Строк не найдено: это не доказывает, что текста нет (мелкий или неровный текст)
+    if height is None:
+        return None
+    return height * TILE_SIZE / max(image.size)
+
+
+class VisionBudget:
+    """
+    Выбор размера фото и detail, учет токенов и задержки запросов
+    """
+
+    def __init__(self, detail: str = None):
+        self.detail = (detail or VISION_DETAIL).lower()
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.requests = 0
+        self.tokens = 0
+        self.baseline_tokens = 0
+        self.by_detail = {
+            'low': {'requests': 0, 'total_latency': 0.0},
+            'high': {'requests': 0, 'total_latency': 0.0},
+        }
+
+    def plan(self, photo_sizes: List[Dict], data: Optional[bytes] = None,
+             photo: Optional[Dict] = None) -> Dict:
+        """
+        План запроса для фото
+
+        Args:
+            photo_sizes: Все PhotoSize сообщения
+            data: Байты выбранного размера, если уже загружены
+            photo: Выбранный PhotoSize (по умолчанию select_photo_size)
+
+        Returns:
+            {'photo', 'detail', 'tokens', 'baseline_tokens'}
+        """
+        photo = photo or select_photo_size(photo_sizes)
+        largest = max(photo_sizes, key=lambda size: size.get('width', 0) * size.get('height', 0))
+
+        detail = self.detail
+        if detail not in ('low', 'high'):
+            text_height = text_height_at_low_detail(data)
+            # low только для заведомо крупного текста, без оценки - высокая детализация
+            detail = 'low' if text_height is not None and text_height >= VISION_LOW_DETAIL_MIN_TEXT_HEIGHT else 'high'
+
+        return {
+            'photo': photo,
+            'detail': detail,
+            'tokens': estimate_image_tokens(photo.get('width', 0), photo.get('height', 0), detail),
+            # Прежнее поведение: самое большое фото с detail=auto (для фото это high)
+            'baseline_tokens': estimate_image_tokens(largest.get('width', 0), largest.get('height', 0), 'high'),
+        }
+
+    def record(self, plan: Dict, latency: float):
+        """Учет выполненного запроса"""
+        with self._lock:
+            self.requests += 1
+            self.tokens += plan['tokens']
+            self.baseline_tokens += plan['baseline_tokens']
+            bucket = self.by_detail[plan['detail']]
+            bucket['requests'] += 1
+            bucket['total_latency'] += latency
+        logger.info(
+            f"🖼 Токены изображения: {plan['tokens']} (detail={plan['detail']}, "
+            f"{plan['photo'].get('width')}x{plan['photo'].get('height')}), "
+            f"без оптимизации {plan['baseline_tokens']}, за {latency:.2f} с"
+        )
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            latency = {
+                detail: round(bucket['total_latency'] / bucket['requests'], 3) if bucket['requests'] else None
+                for detail, bucket in self.by_detail.items()
+            }
+            return {
+                'detail_mode': self.detail,
+                'requests': self.requests,
+                'image_tokens': self.tokens,
+                'baseline_image_tokens': self.baseline_tokens,
+                'image_tokens_saved': self.baseline_tokens - self.tokens,
+                'requests_by_detail': {detail: bucket['requests'] for detail, bucket in self.by_detail.items()},
+                'avg_latency_by_detail': latency,
+            }